@@ -0,0 +1,348 @@
+"""
+Local stand-ins of live services for benchmarks
+
+`StubOpenAI` serves OpenAI API endpoints used by `chat_chain` over HTTP on localhost, with
+configurable latency, so benchmarks measure real client overhead without network access:
+
+    async with StubOpenAI(latency=0.05) as stub:
+        openai.api_base = stub.api_base
+
+Stub can also be served from its own process, so its CPU time is not counted against benchmark
+process. Process prints `api_base` on first line, and serves until its stdin is closed:
+
+    python benchmarks/_stubs.py --latency 0.05
+
+`StubMongoDB` is an in-memory stand-in of `Config.mongodb`, for collections read and written with
+plain queries, without change streams
+"""
+
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import random
+import sys
+import time
+import types
+import uuid
+from typing import Any, AsyncIterator, Optional
+
+from aiohttp import web
+from pymongo.errors import OperationFailure
+
+
+class StubOpenAI:
+    """
+    OpenAI API stub server, answering embeddings and chat completions requests
+
+    Embeddings are deterministic pseudo-random unit vectors of texts. Chat completions respond with
+    `answer`, streamed in word chunks if requested
+
+    :param float latency:
+        Seconds each request takes, before per-item latency
+    :param float item_latency:
+        Seconds each input of embeddings request adds to latency
+    :param float chunk_latency:
+        Seconds to generate each word of chat completion
+    :param Optional[int] max_concurrency:
+        Max requests served concurrently, further requests wait, as with provider-side limits
+    :param int dimensions:
+        Size of embeddings vectors
+    :param str answer:
+        Content of chat completions
+    :param float error_rate:
+        Ratio of requests failed with rate limit error. Default `0`
+    :param int port:
+        Port to listen on, shared with other stub processes listening on it. Default any free port
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.05,
+        item_latency: float = 0.0002,
+        chunk_latency: float = 0.01,
+        max_concurrency: Optional[int] = None,
+        dimensions: int = 1536,
+        answer: str = "0",
+        error_rate: float = 0,
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.item_latency = item_latency
+        self.chunk_latency = chunk_latency
+        self.dimensions = dimensions
+        self.answer = answer
+        self.error_rate = error_rate
+        self.port = port
+        self.errors = 0
+        self.connections: set[int] = set()
+        self.requests: dict[str, int] = {"embeddings": 0, "chat": 0}
+        self.inputs = 0
+
+        self._semaphore = (
+            asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        )
+        self._runner: Optional[web.AppRunner] = None
+        self.api_base = ""
+
+    async def __aenter__(self) -> "StubOpenAI":
+        app = web.Application()
+        app.router.add_post("/v1/embeddings", self._embeddings)
+        app.router.add_post("/v1/chat/completions", self._chat)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port, reuse_port=True)
+        await site.start()
+
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore # pylint: disable=protected-access
+        self.api_base = f"http://127.0.0.1:{port}/v1"
+
+        return self
+
+    async def __aexit__(self, *_):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def embedding(self, text: str, /) -> list[float]:
+        """
+        Deterministic embeddings stub returns for `text`
+        """
+
+        seed = hashlib.sha256(text.encode()).digest()
+        vector = [
+            (seed[i % len(seed)] ^ (i * 31 % 256)) / 255 - 0.5
+            for i in range(self.dimensions)
+        ]
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    async def _limited(self, delay: float):
+        if self._semaphore is None:
+            await asyncio.sleep(delay)
+            return
+
+        async with self._semaphore:
+            await asyncio.sleep(delay)
+
+    def _error(self, request: web.Request) -> Optional[web.Response]:
+        self.connections.add(id(request.transport))
+
+        if random.random() >= self.error_rate:
+            return None
+
+        self.errors += 1
+        return web.json_response(
+            {"error": {"message": "Rate limit reached", "type": "requests"}},
+            status=429,
+        )
+
+    async def _embeddings(self, request: web.Request) -> web.Response:
+        if error := self._error(request):
+            return error
+
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+
+        self.requests["embeddings"] += 1
+        self.inputs += len(inputs)
+        await self._limited(self.latency + self.item_latency * len(inputs))
+
+        return web.json_response(
+            {
+                "object": "list",
+                "model": body.get("model"),
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": i,
+                        "embedding": self.embedding(text),
+                    }
+                    for (i, text) in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        )
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        if error := self._error(request):
+            return error
+
+        body = await request.json()
+
+        self.requests["chat"] += 1
+        await self._limited(self.latency)
+
+        words = self.answer.split(" ")
+
+        if not body.get("stream"):
+            # Complete response is returned once all of it is generated
+            await asyncio.sleep(self.chunk_latency * len(words))
+            return web.json_response(
+                {
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": self.answer},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": 0,
+                        "completion_tokens": len(words),
+                        "total_tokens": len(words),
+                    },
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        for (i, word) in enumerate(words):
+            chunk = {
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if i == 0 else f" {word}"},
+                        "finish_reason": None,
+                    }
+                ],
+            }
+            try:
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            except ConnectionError:
+                # Client stopped reading stream early
+                return response
+            await asyncio.sleep(self.chunk_latency)
+
+        try:
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionError:
+            pass
+
+        return response
+
+
+class StubMongoCollection:
+    """
+    In-memory stand-in of MongoDB collection, matching documents by equality of top-level fields.
+    Projections are not applied, and change streams are not supported, as with standalone server
+    """
+
+    def __init__(self):
+        self.docs: dict[Any, dict[str, Any]] = {}
+
+    async def find(
+        self, query: Optional[dict[str, Any]] = None, projection: Any = None
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        Find documents matching `query`
+        """
+
+        del projection
+        for doc in list(self.docs.values()):
+            if self._matches(doc, query):
+                yield copy.deepcopy(doc)
+
+    async def find_one(
+        self, query: Optional[dict[str, Any]] = None, projection: Any = None
+    ) -> Optional[dict[str, Any]]:
+        """
+        Find first document matching `query`
+        """
+
+        async for doc in self.find(query, projection):
+            return doc
+        return None
+
+    async def insert_one(self, doc: dict[str, Any]) -> types.SimpleNamespace:
+        """
+        Insert `doc`, setting its `_id` if not set
+        """
+
+        doc.setdefault("_id", uuid.uuid4().hex)
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+        return types.SimpleNamespace(inserted_id=doc["_id"])
+
+    async def replace_one(
+        self, query: dict[str, Any], doc: dict[str, Any], upsert: bool = False
+    ) -> types.SimpleNamespace:
+        """
+        Replace first document matching `query` with `doc`, or insert it if `upsert`
+        """
+
+        for (doc_id, current) in self.docs.items():
+            if self._matches(current, query):
+                self.docs[doc_id] = {**copy.deepcopy(doc), "_id": doc_id}
+                return types.SimpleNamespace(matched_count=1)
+
+        if upsert:
+            await self.insert_one({**query, **doc})
+        return types.SimpleNamespace(matched_count=0)
+
+    def watch(self):
+        """
+        Change streams are not supported
+        """
+
+        raise OperationFailure("Change streams are only supported on replica sets")
+
+    @staticmethod
+    def _matches(doc: dict[str, Any], query: Optional[dict[str, Any]]) -> bool:
+        return all(doc.get(key) == value for (key, value) in (query or {}).items())
+
+
+class StubMongoDB:
+    """
+    In-memory stand-in of MongoDB database, creating collections on first use, by item or by
+    attribute
+    """
+
+    def __init__(self):
+        self.collections: dict[str, StubMongoCollection] = {}
+
+    def __getitem__(self, name: str) -> StubMongoCollection:
+        if name not in self.collections:
+            self.collections[name] = StubMongoCollection()
+        return self.collections[name]
+
+    def __getattr__(self, name: str) -> StubMongoCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+async def _serve(args: argparse.Namespace):
+    async with StubOpenAI(
+        latency=args.latency,
+        chunk_latency=args.chunk_latency,
+        dimensions=args.dimensions,
+        answer=args.answer,
+        port=args.port,
+    ) as stub:
+        print(stub.api_base, flush=True)
+        # Serve until parent process closes stdin
+        await asyncio.get_running_loop().run_in_executor(None, sys.stdin.read)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve OpenAI API stub")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--chunk-latency", type=float, default=0.01)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--answer", default="0")
+    parser.add_argument("--port", type=int, default=0)
+    asyncio.run(_serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
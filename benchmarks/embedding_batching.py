@@ -0,0 +1,94 @@
+"""
+Benchmark embeddings throughput and latency with micro-batching of concurrent requests
+
+Compares one embeddings request per text (previous behaviour, batch size 1) against batching
+concurrent texts with `Config.embedding_batcher`. Requests go over HTTP to local OpenAI API stub,
+which serves limited requests concurrently, as with provider-side limits
+
+Usage:
+    python benchmarks/embedding_batching.py [--callers N] [--batch-size N] [--batch-delay S]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import openai
+from _stubs import StubOpenAI
+
+from chat_chain import Config, EmbeddingBatcher, EmbeddingCache, get_embedding
+
+
+async def _call(text: str, latencies: list[float]):
+    start = time.perf_counter()
+    await get_embedding(text)
+    latencies.append(time.perf_counter() - start)
+
+
+async def _measure(
+    *, name: str, batcher: EmbeddingBatcher, stub: StubOpenAI, args: argparse.Namespace
+):
+    # Fresh cache, and unique texts per run, so every text is requested from stub
+    Config.embedding_cache = EmbeddingCache(max_size=args.callers)
+    Config.embedding_batcher = batcher
+    requests = stub.requests["embeddings"]
+
+    latencies: list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(_call(f"{name} message {i}", latencies) for i in range(args.callers))
+    )
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(
+        f"{name:>9}: {args.callers / elapsed:8.1f} texts/s,"
+        f" p50 {statistics.median(latencies) * 1000:7.1f}ms,"
+        f" p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f}ms,"
+        f" {stub.requests['embeddings'] - requests} requests"
+    )
+
+
+async def _run(args: argparse.Namespace):
+    async with StubOpenAI(
+        latency=args.latency,
+        max_concurrency=args.server_concurrency,
+        dimensions=args.dimensions,
+    ) as stub:
+        openai.api_base = stub.api_base
+        Config.openai_api_key = "stub"
+
+        print(
+            f"callers: {args.callers}, stub latency: {args.latency * 1000:.0f}ms,"
+            f" stub concurrency: {args.server_concurrency}"
+        )
+        await _measure(
+            name="unbatched",
+            batcher=EmbeddingBatcher(max_size=1, max_delay=0),
+            stub=stub,
+            args=args,
+        )
+        await _measure(
+            name="batched",
+            batcher=EmbeddingBatcher(
+                max_size=args.batch_size, max_delay=args.batch_delay
+            ),
+            stub=stub,
+            args=args,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--callers", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--batch-delay", type=float, default=0.005)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--server-concurrency", type=int, default=16)
+    parser.add_argument("--dimensions", type=int, default=256)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
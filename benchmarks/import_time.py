@@ -0,0 +1,53 @@
+"""
+Benchmark startup time of `import chat_chain`
+
+Each sample imports `chat_chain` in a fresh interpreter. Time to import and then create clients on
+first use of `Config` is reported separately, as clients are created lazily
+
+Usage:
+    python benchmarks/import_time.py [--repeat N]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+_SNIPPETS = {
+    "import": "import chat_chain",
+    "import+clients": (
+        "import chat_chain; chat_chain.Config.mongodb; chat_chain.Config.qdrant;"
+        " chat_chain.Config.qdrant_executor"
+    ),
+}
+
+
+def _sample(snippet: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", snippet], check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    """
+    Benchmark main
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = [_sample("pass") for _ in range(args.repeat)]
+    print(f"{'interpreter':>15}: median {statistics.median(baseline) * 1000:.1f}ms")
+
+    for label, snippet in _SNIPPETS.items():
+        samples = [_sample(snippet) for _ in range(args.repeat)]
+        print(
+            f"{label:>15}: median {statistics.median(samples) * 1000:.1f}ms,"
+            f" min {min(samples) * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
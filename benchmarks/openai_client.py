@@ -0,0 +1,103 @@
+"""
+Benchmark OpenAI API calls with managed client, under bursts of concurrent calls
+
+Compares calls through `openai` module, which opens new connection per call and fails on rate
+limit errors (previous behaviour), against calls through `Config.openai_client`, which shares
+keep-alive connections pool, limits concurrency, and retries rate limit errors. Requests go over
+HTTP to local OpenAI API stub, which fails some requests with rate limit errors
+
+Usage:
+    python benchmarks/openai_client.py [--calls N] [--bursts N] [--error-rate R]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import openai
+from _stubs import StubOpenAI
+
+from chat_chain import Config, OpenAIClient
+
+_MESSAGES = [{"role": "user", "content": "Hi"}]
+
+
+async def _module_call():
+    await openai.ChatCompletion.acreate(
+        api_key="stub", model="gpt-3.5-turbo", messages=_MESSAGES
+    )
+
+
+async def _client_call():
+    await Config.openai_client.request(
+        "chat/completions", api_key="stub", model="gpt-3.5-turbo", messages=_MESSAGES
+    )
+
+
+async def _timed(call, latencies: list[float]) -> bool:
+    start = time.perf_counter()
+    try:
+        await call()
+    except openai.error.OpenAIError:
+        return False
+    latencies.append(time.perf_counter() - start)
+    return True
+
+
+async def _measure(name: str, call, stub: StubOpenAI, args: argparse.Namespace):
+    errors = stub.errors
+    stub.connections.clear()
+
+    latencies: list[float] = []
+    succeeded = 0
+    start = time.perf_counter()
+    for _ in range(args.bursts):
+        results = await asyncio.gather(
+            *(_timed(call, latencies) for _ in range(args.calls))
+        )
+        succeeded += sum(results)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = args.calls * args.bursts
+    print(
+        f"{name:>6}: {succeeded / elapsed:7.1f} calls/s, succeeded {succeeded}/{total},"
+        f" p50 {statistics.median(latencies) * 1000:6.1f}ms,"
+        f" p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:6.1f}ms,"
+        f" {len(stub.connections)} connections, {stub.errors - errors} rate limited"
+    )
+
+
+async def _run(args: argparse.Namespace):
+    async with StubOpenAI(
+        latency=args.latency, chunk_latency=0, error_rate=args.error_rate
+    ) as stub:
+        openai.api_base = stub.api_base
+        Config.openai_client = OpenAIClient(
+            concurrency={"chat/completions": args.concurrency}, backoff=0.05
+        )
+
+        print(
+            f"calls: {args.bursts} bursts of {args.calls}, stub latency:"
+            f" {args.latency * 1000:.0f}ms, rate limited: {args.error_rate:.0%}"
+        )
+        await _measure("module", _module_call, stub, args)
+        await _measure("client", _client_call, stub, args)
+
+        print(f"client: {Config.openai_client.stats}")
+        await Config.openai_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--bursts", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark knowledge lookup latency under concurrent conversations
+
+Compares running blocking QDrant client search inline on event loop (previous behaviour) against
+running it in bounded `Config.qdrant_executor`. QDrant and embeddings are replaced with local
+stand-ins of fixed latency, so no live services are required
+
+Usage:
+    python benchmarks/qdrant_concurrency.py [--conversations N] [--turns N] [--search-latency S]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+from chat_chain import Config, _gpt
+
+
+class _InlineExecutor(Executor):
+    """
+    Executor running submitted calls synchronously in caller thread, reproducing blocking client
+    calls made directly from event loop
+    """
+
+    def submit(self, fn, /, *args, **kwargs):  # pylint: disable=arguments-differ
+        future: Future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+class _FakeQdrant:
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, *, latency: float):
+        self.latency = latency
+
+    def search(self, **kwargs):
+        # pylint: disable=unused-argument
+        time.sleep(self.latency)
+        return []
+
+
+async def _fake_get_embedding(text: str, /) -> list[float]:
+    # pylint: disable=unused-argument
+    await asyncio.sleep(0.01)
+    return [0.0] * 1536
+
+
+async def _conversation(*, turns: int, latencies: list[float]):
+    for _ in range(turns):
+        start = time.perf_counter()
+        await _gpt.match_knowledge(question="What is algebra?")
+        latencies.append(time.perf_counter() - start)
+
+
+async def _run(*, conversations: int, turns: int) -> list[float]:
+    latencies: list[float] = []
+    await asyncio.gather(
+        *(_conversation(turns=turns, latencies=latencies) for _ in range(conversations))
+    )
+    return latencies
+
+
+def _report(label: str, latencies: list[float], elapsed: float):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{label:>10}: turns={len(latencies)} elapsed={elapsed:.2f}s"
+        f" p50={quantiles[49] * 1000:.1f}ms p99={quantiles[98] * 1000:.1f}ms"
+    )
+
+
+def main():
+    """
+    Benchmark main
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--search-latency", type=float, default=0.02)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    Config.qdrant = _FakeQdrant(latency=args.search_latency)  # type: ignore
+    _gpt.get_embedding = _fake_get_embedding  # type: ignore
+
+    for label, executor in (
+        ("blocking", _InlineExecutor()),
+        ("executor", ThreadPoolExecutor(max_workers=args.workers)),
+    ):
+        Config.qdrant_executor = executor  # type: ignore
+        start = time.perf_counter()
+        latencies = asyncio.run(
+            _run(conversations=args.conversations, turns=args.turns)
+        )
+        _report(label, latencies, time.perf_counter() - start)
+        executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
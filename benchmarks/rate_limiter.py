@@ -0,0 +1,111 @@
+"""
+Benchmark answer latency under shared OpenAI rate limit, with bulk embeddings running alongside
+
+Compares `RateLimiter` granting requests in order of arrival, where answers queue behind bulk
+embeddings (all requests of same priority), against granting them by priority, where answers are
+granted ahead of queued `background` embeddings. Requests go over HTTP to local OpenAI API stub,
+so no live services are required
+
+Usage:
+    python benchmarks/rate_limiter.py [--requests-per-minute N] [--background N] [--answers N]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import openai
+from _stubs import StubOpenAI
+
+from chat_chain import Config, OpenAIClient, RateLimiter
+
+_MESSAGES = [{"role": "user", "content": "Hi"}]
+
+
+async def _background(count: int, priority: str):
+    await asyncio.gather(
+        *(
+            Config.openai_client.request(
+                "embeddings",
+                api_key="stub",
+                priority=priority,  # type: ignore
+                tokens=500,
+                model="text-embedding-ada-002",
+                input=[f"document {i}"],
+            )
+            for i in range(count)
+        )
+    )
+
+
+async def _answer(latencies: list[float]):
+    start = time.perf_counter()
+    await Config.openai_client.request(
+        "chat/completions",
+        api_key="stub",
+        priority="answer",
+        tokens=100,
+        model="gpt-3.5-turbo",
+        messages=_MESSAGES,
+    )
+    latencies.append(time.perf_counter() - start)
+
+
+async def _measure(name: str, priority: str, args: argparse.Namespace):
+    limiter = RateLimiter(requests_per_minute=args.requests_per_minute, burst=1)
+    Config.openai_client.limiter = limiter
+
+    latencies: list[float] = []
+    start = time.perf_counter()
+    background = asyncio.create_task(_background(args.background, priority))
+    answers = []
+    for _ in range(args.answers):
+        answers.append(asyncio.create_task(_answer(latencies)))
+        await asyncio.sleep(args.interval)
+    await asyncio.gather(background, *answers)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(
+        f"{name:>8}: answer p50 {statistics.median(latencies) * 1000:7.1f}ms,"
+        f" p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f}ms,"
+        f" all done in {elapsed:5.2f}s"
+    )
+    for (level, stats) in limiter.stats.items():
+        if stats.acquired:
+            print(
+                f"{level:>18}: {stats.acquired} granted, max queued {stats.max_queued},"
+                f" mean wait {stats.wait_time / stats.acquired * 1000:7.1f}ms"
+            )
+
+
+async def _run(args: argparse.Namespace):
+    async with StubOpenAI(latency=args.latency, chunk_latency=0) as stub:
+        Config.openai_client = OpenAIClient()
+        Config.openai_api_key = "stub"
+
+        openai.api_base = stub.api_base
+
+        print(
+            f"requests per minute: {args.requests_per_minute}, background embeddings:"
+            f" {args.background}, answers: {args.answers} every {args.interval * 1000:.0f}ms"
+        )
+        await _measure("arrival", "answer", args)
+        await _measure("priority", "background", args)
+
+        await Config.openai_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests-per-minute", type=int, default=3000)
+    parser.add_argument("--background", type=int, default=150)
+    parser.add_argument("--answers", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.02)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Benchmark `chat_chain` own overhead by replaying conversations against local stand-ins
+
+Conversations are replayed concurrently, turn by turn, through `handle_message` and
+`get_response_chunks`, with knowledge side effect matching knowledge-base. OpenAI API stub server
+runs in its own process, with configurable latency and streaming, QDrant runs in memory, and
+MongoDB is replaced with in-memory stand-in, so no live services are required, and results are
+deterministic. Reports throughput, latency percentiles per turn and per traced stage, CPU time of
+benchmark process per turn, and memory retained per conversation
+
+Conversations are read from JSONL file of `{"session": ..., "messages": [...]}` lines, with user
+messages of each conversation. Without file, synthetic conversations on knowledge-base questions
+are replayed
+
+Usage:
+    python benchmarks/replay.py [--conversations file.jsonl] [--concurrency N] [--latency S]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import AsyncIterator
+
+import openai
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from chat_chain import (Config, Conversation, Mode, ModeOption,
+                        ModeOptionSideEffectKnowledge,
+                        ModeOptionSideEffectTransaction, ResponseParserInt,
+                        Span, SpanExporter, Tracer, get_response_chunks,
+                        handle_message)
+
+# isort: split
+from _stubs import StubMongoDB, StubOpenAI
+
+_TAGS = ["history", "science", "medicine", "mathematics"]
+
+
+class _DurationsExporter(SpanExporter):
+    """
+    Exporter of spans durations, for exact percentiles per stage
+    """
+
+    def __init__(self):
+        self.durations: dict[str, list[float]] = {}
+
+    def end(self, span: "Span", /):
+        self.durations.setdefault(span.name, []).append(span.duration)
+
+
+async def _request(conversation, message, response):
+    # pylint: disable=unused-argument
+    return [{"role": "system", "content": "Ask user for details of request"}]
+
+
+_MODE = Mode(
+    name="lobby",
+    prompt=(
+        "Respond with 1 if sentence is to request registering a comment, or 0 for anything else."
+        " The sentence is: {message}"
+    ),
+    parser=ResponseParserInt(max_digits=1),
+    options=[
+        ModeOption(
+            condition=lambda response: response == 0,
+            side_effect=ModeOptionSideEffectKnowledge(collection="parts"),
+            prefetch=True,
+        ),
+        ModeOption(
+            condition=lambda response: response == 1,
+            side_effect=ModeOptionSideEffectTransaction(transaction=_request),
+        ),
+    ],
+)
+
+
+def _percentiles(samples: list[float]) -> str:
+    samples = sorted(samples)
+    (p50, p95, p99) = (
+        samples[max(0, int(len(samples) * q) - 1)] for q in (0.5, 0.95, 0.99)
+    )
+    return f"p50 {p50 * 1000:7.2f}ms, p95 {p95 * 1000:7.2f}ms, p99 {p99 * 1000:7.2f}ms"
+
+
+def _questions(count: int) -> list[str]:
+    return [
+        f"What is known about topic {i} of {_TAGS[i % len(_TAGS)]}?"
+        for i in range(count)
+    ]
+
+
+def _conversations(args: argparse.Namespace) -> list[tuple[str, list[str]]]:
+    if args.conversations:
+        with Path(args.conversations).open(encoding="utf-8") as file:
+            return [
+                (line["session"], line["messages"])
+                for line in map(json.loads, filter(str.strip, file))
+            ]
+
+    rng = random.Random(0)
+    questions = _questions(args.parts)
+    return [
+        (f"session-{i}", rng.choices(questions, k=args.turns))
+        for i in range(args.count)
+    ]
+
+
+async def _setup(args: argparse.Namespace):
+    # Vectors of parts are stub embeddings of questions, so questions match their parts
+    embedding = StubOpenAI(dimensions=args.dimensions).embedding
+
+    Config.qdrant = QdrantClient(":memory:")
+    Config.qdrant.recreate_collection(
+        "parts",
+        vectors_config={
+            "content": models.VectorParams(
+                size=args.dimensions, distance=models.Distance.COSINE
+            )
+        },
+    )
+    Config.qdrant.upsert(
+        "parts",
+        points=[
+            models.PointStruct(
+                id=i + 1,
+                vector={"content": embedding(question)},
+                payload={
+                    "id": f"part-{i}",
+                    "content": f"Part {i} answers '{question}': " + "detail " * 150,
+                    "metadata": {"tags": [_TAGS[i % len(_TAGS)]]},
+                },
+            )
+            for (i, question) in enumerate(_questions(args.parts))
+        ],
+    )
+
+    Config.mongodb = StubMongoDB()  # type: ignore
+    for tag in _TAGS:
+        await Config.mongodb.tags_prompts.insert_one(
+            {"tag": tag, "prompt": f"Suggest reading more about {tag}."}
+        )
+
+
+@contextlib.asynccontextmanager
+async def _stub_process(args: argparse.Namespace) -> AsyncIterator[str]:
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        str(Path(__file__).parent / "_stubs.py"),
+        f"--latency={args.latency}",
+        f"--chunk-latency={args.chunk_latency}",
+        f"--dimensions={args.dimensions}",
+        "--answer=0 because sentence is a question about knowledge",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    try:
+        yield (await process.stdout.readline()).decode().strip()  # type: ignore
+    finally:
+        process.stdin.close()  # type: ignore
+        await process.wait()
+
+
+async def _replay(
+    session: str, messages: list[str], turns: list[float], /
+) -> "Conversation":
+    conversation = Conversation(
+        mode=_MODE, session=session, partial_log_range=(0, None)
+    )
+
+    for message in messages:
+        start = time.perf_counter()
+        (messages_list, response_tokens_limit) = await handle_message(
+            conversation=conversation, message=message
+        )
+        response = [
+            chunk
+            async for (_, chunk) in get_response_chunks(
+                messages=messages_list, response_tokens_limit=response_tokens_limit
+            )
+        ]
+        conversation.log.append({"role": "assistant", "content": "".join(response)})
+        turns.append(time.perf_counter() - start)
+
+    return conversation
+
+
+async def _run_pass(
+    conversations: list[tuple[str, list[str]]], args: argparse.Namespace
+) -> tuple[list[float], list["Conversation"]]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    turns: list[float] = []
+
+    async def _bounded(session: str, messages: list[str]) -> "Conversation":
+        async with semaphore:
+            return await _replay(session, messages, turns)
+
+    replayed = await asyncio.gather(
+        *(_bounded(session, messages) for (session, messages) in conversations)
+    )
+    return (turns, replayed)
+
+
+async def _run(args: argparse.Namespace):
+    conversations = _conversations(args)
+    await _setup(args)
+
+    async with _stub_process(args) as api_base:
+        openai.api_base = api_base
+        Config.openai_api_key = "stub"
+
+        print(
+            f"conversations: {len(conversations)},"
+            f" turns: {sum(len(messages) for (_, messages) in conversations)},"
+            f" concurrency: {args.concurrency}, stub latency: {args.latency * 1000:.0f}ms,"
+            f" word latency: {args.chunk_latency * 1000:.0f}ms"
+        )
+
+        # Warm up caches of encodings, and connections pool
+        await _run_pass(conversations[: args.concurrency], args)
+
+        exporter = _DurationsExporter()
+        Config.tracer = Tracer(exporters=[exporter])
+        (wall, cpu) = (time.perf_counter(), time.process_time())
+        (turns, _) = await _run_pass(conversations, args)
+        (wall, cpu) = (time.perf_counter() - wall, time.process_time() - cpu)
+        Config.tracer = None
+
+        print(
+            f"throughput: {len(turns) / wall:7.1f} turns/s,"
+            f" CPU: {cpu / len(turns) * 1000:6.2f}ms per turn"
+        )
+        print(f"{'turn':>20}: {_percentiles(turns)}")
+        for (stage, durations) in exporter.durations.items():
+            print(f"{stage:>20}: {_percentiles(durations)}, {len(durations)} spans")
+
+        # Memory retained by replayed conversations, with caches already warm
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        (_, replayed) = await _run_pass(conversations, args)
+        retained = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print(f"memory: {retained / len(replayed) / 1024:7.1f}KiB per conversation")
+
+        await Config.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--conversations", help="JSONL file of conversations")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--parts", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--chunk-latency", type=float, default=0.002)
+    parser.add_argument("--dimensions", type=int, default=256)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
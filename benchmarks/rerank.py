@@ -0,0 +1,137 @@
+"""
+Benchmark knowledge prompt size and coverage with local re-ranking of matched parts
+
+Compares parts matched by score only (previous behaviour) against parts re-ranked with MMR, and
+with near-duplicate suppression, on synthetic knowledge-base where each fact is stored as several
+near-duplicate chunks, as produced by overlapping chunking or repeated documents. QDrant runs in
+memory, and embeddings are replaced with vectors of facts plus noise, so no live services are
+required
+
+Usage:
+    python benchmarks/rerank.py [--facts N] [--duplicates N] [--queries N] [--max-tokens N]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from chat_chain import Config, KnowledgeRerank, _gpt
+from chat_chain._gpt import num_tokens_from_text
+
+_DIMENSIONS = 128
+
+
+def _noisy(rng: random.Random, vector: list[float], noise: float) -> list[float]:
+    return [v + rng.gauss(0, noise) for v in vector]
+
+
+def _setup(args: argparse.Namespace) -> dict[str, list[float]]:
+    rng = random.Random(1)
+    facts = [[rng.gauss(0, 1) for _ in range(_DIMENSIONS)] for _ in range(args.facts)]
+
+    Config.qdrant = QdrantClient(":memory:")
+    Config.qdrant.recreate_collection(
+        "parts",
+        vectors_config={
+            "content": models.VectorParams(
+                size=_DIMENSIONS, distance=models.Distance.COSINE
+            )
+        },
+    )
+    Config.qdrant.upsert(
+        "parts",
+        points=[
+            models.PointStruct(
+                id=f * args.duplicates + d + 1,
+                vector={"content": _noisy(rng, facts[f], 0.05)},
+                payload={
+                    "id": f"{f}-{d}",
+                    "content": f"Fact {f} variant {d}: "
+                    + "detail " * rng.randint(40, 120),
+                    "metadata": {"tags": []},
+                },
+            )
+            for f in range(args.facts)
+            for d in range(args.duplicates)
+        ],
+    )
+
+    # Queries lie between two facts, so both are relevant answers
+    queries = {}
+    for q in range(args.queries):
+        (a, b) = rng.sample(range(args.facts), 2)
+        queries[f"query {q}"] = [
+            x + y + rng.gauss(0, 0.3) for (x, y) in zip(facts[a], facts[b])
+        ]
+
+    return queries
+
+
+async def _measure(
+    name: str,
+    queries: dict[str, list[float]],
+    rerank: "KnowledgeRerank | None",
+    args: argparse.Namespace,
+):
+    (tokens, facts, latencies) = ([], [], [])
+
+    for query in queries:
+        start = time.perf_counter()
+        knowledge = await _gpt.match_knowledge(
+            question=query, rerank=rerank, max_tokens=args.max_tokens
+        )
+        latencies.append(time.perf_counter() - start)
+
+        parts = [
+            part
+            for part in knowledge.matched_parts
+            if part[1] >= Config.consts.knowledge_bar
+        ]
+        tokens.append(
+            num_tokens_from_text(
+                " ".join(part[2] for part in parts), model=Config.consts.model
+            )
+        )
+        facts.append(len({part[0].split("-")[0] for part in parts}))
+
+    print(
+        f"{name:>8}: {statistics.mean(tokens):7.1f} knowledge tokens,"
+        f" {statistics.mean(facts):4.2f} distinct facts,"
+        f" {statistics.median(latencies) * 1000:6.2f}ms match p50"
+    )
+
+
+async def _run(args: argparse.Namespace):
+    queries = _setup(args)
+
+    async def _embedding(text: str, /) -> list[float]:
+        return queries[text]
+
+    _gpt.get_embedding = _embedding  # type: ignore
+    Config.consts.knowledge_bar = 0.5
+
+    print(
+        f"facts: {args.facts}, duplicates per fact: {args.duplicates},"
+        f" queries: {args.queries}, tokens budget: {args.max_tokens}"
+    )
+    await _measure("score", queries, None, args)
+    await _measure("dedup", queries, KnowledgeRerank(strategy="dedup"), args)
+    await _measure("mmr", queries, KnowledgeRerank(strategy="mmr"), args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--facts", type=int, default=200)
+    parser.add_argument("--duplicates", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--max-tokens", type=int, default=None)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
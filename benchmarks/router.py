@@ -0,0 +1,123 @@
+"""
+Benchmark accuracy and latency saved by `ModeRouter`
+
+Router is trained on part of samples of messages and mode prompt responses, then evaluated on rest.
+Reports accuracy of routed predictions, share of messages routed without AI model call, and mean
+latency saved per message given AI model classifier latency. Samples are read from JSONL file of
+`{"message": ..., "response": ...}` lines, embedded with OpenAI. Without dataset, synthetic lobby
+samples are embedded locally with hashed bag-of-words, so no live services are required
+
+Usage:
+    python benchmarks/router.py [--dataset samples.jsonl] [--threshold T] [--model-latency S]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+
+from chat_chain import ModeRouter, _router
+
+_QUESTIONS = [
+    "who invented algebra",
+    "what did ibn sina write about medicine",
+    "tell me about the house of wisdom in baghdad",
+    "how did al-haytham explain vision",
+    "what is the origin of arabic numerals",
+    "who was al-khwarizmi",
+    "when was the first observatory built",
+    "what did al-zahrawi contribute to surgery",
+]
+_REQUESTS = [
+    "i want to leave a comment",
+    "i'd like to register a comment on your answer",
+    "can i send feedback about what you said",
+    "i have a correction to submit",
+    "please record my comment",
+    "let me comment on that information",
+]
+_PREFIXES = ["", "hi, ", "please, ", "hey ", "excuse me, ", "ok "]
+_SUFFIXES = ["", "?", " please", " thanks", "!"]
+
+
+def _synthetic_samples(count: int) -> list[tuple[str, str]]:
+    rng = random.Random(0)
+    return [
+        (
+            f"{rng.choice(_PREFIXES)}{rng.choice(pool)}{rng.choice(_SUFFIXES)}",
+            response,
+        )
+        for (pool, response) in (
+            (rng.choice(((_QUESTIONS, "0"), (_REQUESTS, "1")))) for _ in range(count)
+        )
+    ]
+
+
+async def _hashed_embedding(text: str, /) -> list[float]:
+    vector = [0.0] * 256
+    for word in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 256] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+async def _hashed_embeddings(texts, /) -> list[list[float]]:
+    return [await _hashed_embedding(text) for text in texts]
+
+
+async def _run(args):
+    if args.dataset:
+        with open(args.dataset, encoding="utf-8") as f:
+            samples = [
+                (line["message"], line["response"])
+                for line in (json.loads(line) for line in f if line.strip())
+            ]
+    else:
+        samples = _synthetic_samples(args.samples)
+        _router.get_embedding = _hashed_embedding  # type: ignore
+        _router.get_embeddings = _hashed_embeddings  # type: ignore
+
+    random.Random(1).shuffle(samples)
+    split = int(len(samples) * 0.7)
+    (train, test) = (samples[:split], samples[split:])
+
+    router = ModeRouter(threshold=args.threshold)
+    await router.train(train)
+
+    (routed, correct) = (0, 0)
+    start = time.perf_counter()
+    for (message, response) in test:
+        prediction = await router.route(message)
+        if prediction is not None:
+            routed += 1
+            correct += prediction == response.strip()
+    route_latency = (time.perf_counter() - start) / len(test)
+
+    coverage = routed / len(test)
+    print(f"samples: train={len(train)} test={len(test)} threshold={args.threshold}")
+    print(f"routed: {coverage:.1%}, accuracy of routed: {correct / (routed or 1):.1%}")
+    print(
+        f"latency: route {route_latency * 1000:.2f}ms/message, saved"
+        f" {(coverage * args.model_latency - route_latency) * 1000:.1f}ms/message on average"
+    )
+
+
+def main():
+    """
+    Benchmark main
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--model-latency", type=float, default=0.6)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Load test `ChatServer` with many concurrent sessions
+
+Each session sends its turns in order, with some turns sent before previous response is done, so
+per-session serialization is exercised, while all sessions run concurrently. Reports turns per
+second, time to first chunk and turn latency (p50/p99), and checks every conversation log
+alternates user and assistant messages. By default, server is called in process as ASGI
+application, with OpenAI API stub server in its own process, so no live services are required.
+With `--url`, a running server is load tested over HTTP instead
+
+Usage:
+    python benchmarks/server.py [--sessions N] [--turns N] [--url http://localhost:8000]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import aiohttp
+import openai
+
+from chat_chain import (ChatServer, Config, Mode, ModeOption,
+                        ModeOptionSideEffectTransaction, ResponseParserInt)
+
+
+async def _answer(*, conversation, message, response):
+    # pylint: disable=unused-argument
+    return [{"role": "system", "content": "Answer user"}]
+
+
+_MODE = Mode(
+    name="lobby",
+    prompt="Respond with 1 if message is question, or 0: {message}",
+    parser=ResponseParserInt(max_digits=1),
+    options=[
+        ModeOption(
+            condition=lambda response: response == 1,
+            side_effect=ModeOptionSideEffectTransaction(transaction=_answer),
+        )
+    ],
+)
+
+
+async def _post_asgi(
+    server: "ChatServer", session: str, message: str, /
+) -> tuple[float, int]:
+    start = time.perf_counter()
+    (first, chunks) = (0.0, 0)
+    requests = [
+        {
+            "type": "http.request",
+            "body": json.dumps({"message": message}).encode(),
+            "more_body": False,
+        }
+    ]
+    done = asyncio.Event()
+
+    async def _receive():
+        if requests:
+            return requests.pop()
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(event):
+        nonlocal first, chunks
+        if event["type"] == "http.response.body" and b'"index"' in event["body"]:
+            first = first or time.perf_counter() - start
+            chunks += 1
+
+    await server(
+        {"type": "http", "method": "POST", "path": f"/sessions/{session}/messages"},
+        _receive,
+        _send,
+    )
+    done.set()
+    return (first, chunks)
+
+
+async def _post_http(
+    client: "aiohttp.ClientSession", url: str, session: str, message: str, /
+) -> tuple[float, int]:
+    start = time.perf_counter()
+    (first, chunks) = (0.0, 0)
+
+    async with client.post(
+        f"{url}/sessions/{session}/messages", json={"message": message}
+    ) as response:
+        async for line in response.content:
+            if line.startswith(b"data:") and b'"index"' in line:
+                first = first or time.perf_counter() - start
+                chunks += 1
+
+    return (first, chunks)
+
+
+async def _session(post, session: str, args: argparse.Namespace, results: list):
+    async def _turn(message: str):
+        start = time.perf_counter()
+        (first, chunks) = await post(session, message)
+        results.append((first, time.perf_counter() - start, chunks))
+
+    # Turns are sent in pairs, second without waiting for first, so server serializes them
+    for turn in range(0, args.turns, 2):
+        await asyncio.gather(
+            *(
+                _turn(f"Question {i} of {session}?")
+                for i in range(turn, min(turn + 2, args.turns))
+            )
+        )
+
+
+def _percentile(samples: list[float], percentile: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, int(len(samples) * percentile) - 1)] * 1000
+
+
+async def _run(args: argparse.Namespace):
+    server: Optional["ChatServer"] = None
+    client: Optional["aiohttp.ClientSession"] = None
+    stub = None
+
+    if args.url:
+        client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=args.connections)
+        )
+        post = lambda session, message: _post_http(client, args.url, session, message)
+    else:
+        stub = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(Path(__file__).parent / "_stubs.py"),
+            f"--latency={args.latency}",
+            f"--chunk-latency={args.chunk_latency}",
+            "--answer=1 because it is a question",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        openai.api_base = (await stub.stdout.readline()).decode().strip()  # type: ignore
+        Config.openai_api_key = "stub"
+        Config.consts.openai_max_connections = args.model_concurrency
+        Config.consts.openai_chat_concurrency = args.model_concurrency
+        server = ChatServer(mode=_MODE)
+        post = lambda session, message: _post_asgi(server, session, message)
+
+    print(
+        f"sessions: {args.sessions}, turns per session: {args.turns},"
+        f" target: {args.url or 'in process'}"
+    )
+
+    results: list[tuple[float, float, int]] = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(_session(post, f"s{i}", args, results) for i in range(args.sessions))
+    )
+    elapsed = time.perf_counter() - start
+
+    (firsts, latencies, _) = zip(*results)
+    print(
+        f"{len(results) / elapsed:7.1f} turns/s, first chunk p50"
+        f" {_percentile(firsts, 0.5):7.1f}ms, p99 {_percentile(firsts, 0.99):7.1f}ms,"
+        f" turn p50 {_percentile(latencies, 0.5):7.1f}ms,"
+        f" p99 {_percentile(latencies, 0.99):7.1f}ms"
+    )
+
+    if server is not None:
+        # pylint: disable=protected-access
+        conversations = [
+            server._conversations.get(f"s{i}") for i in range(args.sessions)
+        ]
+        serialized = all(
+            conversation is not None
+            and [message["role"] for message in conversation.log]
+            == ["user", "assistant"] * args.turns
+            for conversation in conversations
+        )
+        print(f"sessions serialized: {'ok' if serialized else 'FAILED'}")
+        print(f"model client: {Config.openai_client.stats}")
+        await server.aclose()
+
+    if client is not None:
+        await client.close()
+    if stub is not None:
+        stub.stdin.close()  # type: ignore
+        await stub.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument(
+        "--url", help="URL of running server, e.g. http://localhost:8000"
+    )
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--model-concurrency", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--chunk-latency", type=float, default=0.005)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
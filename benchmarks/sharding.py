@@ -0,0 +1,155 @@
+"""
+Benchmark scaling of `ChatServerSharded` throughput with count of worker processes
+
+Runs same load of concurrent sessions on `ChatServer` in single process, then on
+`ChatServerSharded` with increasing counts of workers, and reports turns per second, turn latency
+(p50/p99), and speedup over single process. Turns are made CPU-bound with long system prompt, and
+growing conversation logs, to count tokens of, while OpenAI API stub answers with short latency,
+from as many stub processes as workers, sharing one port, so stub is not bottleneck. Speedup is
+bound by count of CPU cores
+
+Usage:
+    python benchmarks/sharding.py [--workers 1,2,4] [--sessions N] [--turns N]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import time
+from pathlib import Path
+from typing import AsyncIterator
+from urllib.parse import urlsplit
+
+import openai
+
+from chat_chain import (ChatServer, ChatServerBase, ChatServerSharded, Config,
+                        Mode, ModeOption, ModeOptionSideEffectTransaction,
+                        ResponseParserInt)
+
+
+def _mode(args: argparse.Namespace) -> "Mode":
+    prompt = " ".join(
+        f"Rule {i} of answering user." for i in range(args.prompt_words // 5)
+    )
+
+    async def _answer(*, conversation, message, response):
+        # pylint: disable=unused-argument
+        return [{"role": "system", "content": prompt}]
+
+    return Mode(
+        name="lobby",
+        prompt="Respond with 1 if message is question, or 0: {message}",
+        parser=ResponseParserInt(max_digits=1),
+        options=[
+            ModeOption(
+                condition=lambda response: response == 1,
+                side_effect=ModeOptionSideEffectTransaction(transaction=_answer),
+            )
+        ],
+    )
+
+
+@contextlib.asynccontextmanager
+async def _stub_processes(args: argparse.Namespace) -> AsyncIterator[str]:
+    processes = []
+    api_base = ""
+    try:
+        for _ in range(max(args.workers)):
+            # Stubs after first listen on its port too
+            port = urlsplit(api_base).port or 0
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                str(Path(__file__).parent / "_stubs.py"),
+                f"--latency={args.latency}",
+                f"--chunk-latency={args.chunk_latency}",
+                f"--port={port}",
+                "--answer=1 because it is a question",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+            )
+            processes.append(process)
+            api_base = (await process.stdout.readline()).decode().strip()  # type: ignore
+        yield api_base
+    finally:
+        for process in processes:
+            process.stdin.close()  # type: ignore
+            await process.wait()
+
+
+async def _measure(server: "ChatServerBase", args: argparse.Namespace) -> list[float]:
+    latencies: list[float] = []
+
+    async def _session(session: str):
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            async for _ in server.turn(session, f"Question {turn} of {session}?"):
+                pass
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(_session(f"s{i}") for i in range(args.sessions)))
+    return latencies
+
+
+def _percentile(samples: list[float], percentile: float) -> float:
+    samples = sorted(samples)
+    return samples[max(0, int(len(samples) * percentile) - 1)] * 1000
+
+
+async def _run(args: argparse.Namespace):
+    async with _stub_processes(args) as api_base:
+        openai.api_base = api_base
+        Config.openai_api_key = "stub"
+
+        print(
+            f"sessions: {args.sessions}, turns per session: {args.turns},"
+            f" CPU cores: {os.cpu_count()}"
+        )
+
+        servers: list[tuple[str, "ChatServerBase"]] = [
+            ("single process", ChatServer(mode=_mode(args)))
+        ]
+        servers += [
+            (
+                f"{workers} workers",
+                ChatServerSharded(ChatServer(mode=_mode(args)), workers=workers),
+            )
+            for workers in args.workers
+        ]
+
+        baseline = 0.0
+        for (name, server) in servers:
+            await server.start()
+            start = time.perf_counter()
+            latencies = await _measure(server, args)
+            throughput = len(latencies) / (time.perf_counter() - start)
+            await server.aclose()
+
+            baseline = baseline or throughput
+            print(
+                f"{name:>15}: {throughput:7.1f} turns/s,"
+                f" turn p50 {_percentile(latencies, 0.5):7.1f}ms,"
+                f" p99 {_percentile(latencies, 0.99):7.1f}ms,"
+                f" speedup {throughput / baseline:4.2f}x"
+            )
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--workers",
+        type=lambda value: [int(workers) for workers in value.split(",")],
+        default=[2**i for i in range(cores.bit_length()) if 2**i <= cores],
+    )
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--prompt-words", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--chunk-latency", type=float, default=0.0)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
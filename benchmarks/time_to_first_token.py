@@ -0,0 +1,105 @@
+"""
+Benchmark time to first token of response to message
+
+Compares staged turn, where `handle_message` waits for complete mode prompt response before
+response is streamed (previous behaviour), against `handle_message_stream`, which parses mode
+prompt response on its first token, and streams response right away. Requests go over HTTP to
+local OpenAI API stub, so no live services are required
+
+Usage:
+    python benchmarks/time_to_first_token.py [--turns N] [--latency S] [--word-latency S]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import statistics
+import time
+
+import openai
+from _stubs import StubOpenAI
+
+from chat_chain import (Config, Conversation, Mode, ModeOption,
+                        ModeOptionSideEffectTransaction, ResponseParserInt,
+                        get_response_chunks, handle_message,
+                        handle_message_stream)
+
+
+async def _answer(*, conversation, message, response):
+    # pylint: disable=unused-argument
+    return [{"role": "system", "content": "Answer user"}]
+
+
+_MODE = Mode(
+    name="classifier",
+    prompt="Respond with 1 and reason if message is question, or 0: {message}",
+    parser=ResponseParserInt(max_digits=1),
+    options=[
+        ModeOption(
+            condition=lambda response: response == 1,
+            side_effect=ModeOptionSideEffectTransaction(transaction=_answer),
+        )
+    ],
+)
+
+
+async def _staged(conversation: "Conversation") -> float:
+    start = time.perf_counter()
+    (messages, response_tokens_limit) = await handle_message(
+        conversation=conversation, message="What is algebra?"
+    )
+    async with contextlib.aclosing(
+        get_response_chunks(
+            messages=messages, response_tokens_limit=response_tokens_limit
+        )
+    ) as chunks:
+        async for _ in chunks:
+            break
+    return time.perf_counter() - start
+
+
+async def _streamed(conversation: "Conversation") -> float:
+    start = time.perf_counter()
+    async with contextlib.aclosing(
+        handle_message_stream(conversation=conversation, message="What is algebra?")
+    ) as chunks:
+        async for _ in chunks:
+            break
+    return time.perf_counter() - start
+
+
+async def _run(args: argparse.Namespace):
+    async with StubOpenAI(
+        latency=args.latency,
+        chunk_latency=args.word_latency,
+        answer="1 because user asks what algebra is, which is a question",
+    ) as stub:
+        openai.api_base = stub.api_base
+        Config.openai_api_key = "stub"
+
+        print(
+            f"turns: {args.turns}, stub latency: {args.latency * 1000:.0f}ms,"
+            f" word latency: {args.word_latency * 1000:.0f}ms"
+        )
+        for (name, turn) in (("staged", _staged), ("streamed", _streamed)):
+            conversation = Conversation(
+                mode=_MODE, session=name, partial_log_range=(0, None)
+            )
+            latencies = sorted([await turn(conversation) for _ in range(args.turns)])
+            print(
+                f"{name:>8}: time to first token p50"
+                f" {statistics.median(latencies) * 1000:6.1f}ms,"
+                f" p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:6.1f}ms"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--word-latency", type=float, default=0.02)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
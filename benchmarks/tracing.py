@@ -0,0 +1,97 @@
+"""
+Benchmark overhead of tracing stages of chain
+
+Runs turns of `handle_message` with tracing disabled, and with in-memory histogram and Prometheus
+exporters, and reports time per turn and overhead, then per-stage latencies traced. AI model calls
+are answered in process, so overhead is not hidden by network latency, and no live services are
+required
+
+Usage:
+    python benchmarks/tracing.py [--turns N]
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from chat_chain import (Config, Conversation, Mode, ModeOption,
+                        ModeOptionSideEffectTransaction, ResponseParserInt,
+                        SpanExporterHistogram, SpanExporterPrometheus, Tracer,
+                        handle_message)
+
+
+class _InProcessClient:
+    limiter = None
+
+    async def request(self, endpoint: str, /, **_: Any) -> dict[str, Any]:
+        del endpoint
+        return {
+            "choices": [{"message": {"content": "1"}}],
+            "usage": {"prompt_tokens": 20, "completion_tokens": 1},
+        }
+
+
+async def _answer(*, conversation, message, response):
+    # pylint: disable=unused-argument
+    return [{"role": "system", "content": "Answer user"}]
+
+
+_MODE = Mode(
+    name="classifier",
+    prompt="Respond with 1 if message is question, or 0: {message}",
+    parser=ResponseParserInt(),
+    options=[
+        ModeOption(
+            condition=lambda response: response == 1,
+            side_effect=ModeOptionSideEffectTransaction(transaction=_answer),
+        )
+    ],
+)
+
+
+async def _measure(name: str, args: argparse.Namespace) -> float:
+    conversation = Conversation(mode=_MODE, session=name, partial_log_range=(0, None))
+
+    start = time.perf_counter()
+    for _ in range(args.turns):
+        await handle_message(conversation=conversation, message="What is algebra?")
+    return (time.perf_counter() - start) / args.turns
+
+
+async def _run(args: argparse.Namespace):
+    Config.openai_client = _InProcessClient()  # type: ignore
+
+    print(f"turns: {args.turns}")
+    tracers = {
+        "disabled": None,
+        "histogram": Tracer(exporters=[SpanExporterHistogram()]),
+        "prometheus": Tracer(exporters=[SpanExporterPrometheus()]),
+    }
+    baseline = None
+    for (name, tracer) in tracers.items():
+        Config.tracer = tracer
+        per_turn = await _measure(name, args)
+        baseline = baseline or per_turn
+        print(
+            f"{name:>10}: {per_turn * 1e6:6.1f}us per turn,"
+            f" overhead {(per_turn - baseline) * 1e6:5.1f}us"
+        )
+
+    Config.tracer = None
+    exporter = tracers["histogram"].exporters[0]  # type: ignore
+    for (stage, summary) in exporter.summary().items():
+        print(
+            f"{stage:>18}: {summary['count']} spans, mean {summary['mean'] * 1e6:6.1f}us,"
+            f" p99 <= {summary['p99'] * 1000:g}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--turns", type=int, default=20000)
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
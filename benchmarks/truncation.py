@@ -0,0 +1,84 @@
+"""
+Micro-benchmark prompt truncation of `build_messages_list`
+
+Compares word-ratio truncation that re-encodes prompt on every pass (previous approach, with
+truncated prompt written back so it terminates) against single-pass token budgeter, on prompts of
+10k to 100k tokens. Requires `tiktoken` encoding of `Config.consts.model` to be available
+
+Usage:
+    python benchmarks/truncation.py [--repeat N]
+"""
+
+import argparse
+import math
+import random
+import timeit
+
+from chat_chain import Config, build_messages_list
+from chat_chain._gpt import _get_encoding, num_tokens_from_messages
+
+_WORDS = (
+    "algebra astronomy medicine optics chemistry geography al-khwarizmi ibn-sina al-haytham"
+    " observatory manuscript translation house wisdom baghdad cordoba numeral zero theorem"
+).split(" ")
+
+
+def _build_messages_list_word_ratio(*, prompt: str, question: str):
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": question},
+    ]
+
+    tokens_count = num_tokens_from_messages(messages)
+    while tokens_count > 2500:
+        words = messages[0]["content"].split(" ")
+        messages[0]["content"] = " ".join(
+            words[: math.floor((len(words) * 2500) / tokens_count)]
+        )
+        tokens_count = num_tokens_from_messages(messages)
+
+    return (messages, min(4096 - tokens_count, 500))
+
+
+def _make_prompt(tokens_count: int) -> str:
+    encoding = _get_encoding(Config.consts.model)
+    rng = random.Random(tokens_count)
+    words: list[str] = []
+    while len(encoding.encode(" ".join(words))) < tokens_count:
+        words.extend(rng.choice(_WORDS) for _ in range(1000))
+    return " ".join(words)
+
+
+def main():
+    """
+    Benchmark main
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    question = "Who founded algebra?"
+
+    for tokens_count in (10_000, 25_000, 50_000, 100_000):
+        prompt = _make_prompt(tokens_count)
+        for label, func in (
+            ("word-ratio", _build_messages_list_word_ratio),
+            ("budgeter", build_messages_list),
+        ):
+            elapsed = min(
+                timeit.repeat(
+                    lambda func=func: func(prompt=prompt, question=question),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+            messages, _ = func(prompt=prompt, question=question)
+            print(
+                f"{tokens_count:>7} tokens {label:>10}: {elapsed * 1000:8.2f}ms,"
+                f" result {num_tokens_from_messages(messages)} tokens"
+            )
+
+
+if __name__ == "__main__":
+    main()
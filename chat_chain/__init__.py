@@ -4,26 +4,97 @@
 Simple chain toolings to build conversational applications
 """
 
+from ._batch import BatchStats, EmbeddingBatcher
+from ._cache import (CacheStats, EmbeddingCache, EmbeddingCacheStore,
+                     EmbeddingCacheStoreMongoDB, TagsPromptsCache)
 from ._chain import (Conversation, Message, Mode, ModeOption,
                      ModeOptionSideEffect, ModeOptionSideEffectKnowledge,
-                     ModeOptionSideEffectTransaction, handle_message)
+                     ModeOptionSideEffectTransaction, handle_message,
+                     handle_message_stream)
+from ._client import ClientStats, OpenAIClient
 from ._config import Config
-from ._gpt import get_embedding, get_response, get_response_chunks
+from ._gpt import (KnowledgeCollection, TokenBudget, build_messages_list,
+                   get_embedding, get_embeddings, get_response,
+                   get_response_chunks)
+from ._graph import ModeGraph
+from ._ingest import (IngestDocument, IngestReport, chunk_text,
+                      create_collection, ingest, read_files, read_mongodb)
+from ._limiter import RateLimiter, RateLimiterStats
+from ._log import ConversationLog
+from ._parsers import (ResponseParser, ResponseParserEnum, ResponseParserInt,
+                       ResponseParserJSON)
+from ._rerank import KnowledgeRerank
+from ._response_cache import (ResponseCache, ResponseCacheStore,
+                              ResponseCacheStoreMemory,
+                              ResponseCacheStoreQdrant)
+from ._router import ModeRouter
+from ._server import ChatServer, ChatServerBase
+from ._shard import ChatServerSharded
+from ._store import ConversationStore
+from ._template import PromptTemplate
+from ._trace import (Span, SpanExporter, SpanExporterHistogram,
+                     SpanExporterOpenTelemetry, SpanExporterPrometheus, Tracer)
 
 VERSION = "0.1.0"
 
 __all__ = [
     "VERSION",
+    "BatchStats",
+    "EmbeddingBatcher",
+    "CacheStats",
+    "ChatServer",
+    "ChatServerBase",
+    "ChatServerSharded",
+    "EmbeddingCache",
+    "EmbeddingCacheStore",
+    "EmbeddingCacheStoreMongoDB",
+    "TagsPromptsCache",
+    "ClientStats",
+    "OpenAIClient",
+    "RateLimiter",
+    "RateLimiterStats",
     "Conversation",
+    "ConversationLog",
+    "ConversationStore",
+    "Span",
+    "SpanExporter",
+    "SpanExporterHistogram",
+    "SpanExporterOpenTelemetry",
+    "SpanExporterPrometheus",
+    "Tracer",
+    "IngestDocument",
+    "IngestReport",
+    "chunk_text",
+    "create_collection",
+    "ingest",
+    "read_files",
+    "read_mongodb",
     "Message",
     "Mode",
+    "ModeGraph",
     "ModeOption",
     "ModeOptionSideEffect",
     "ModeOptionSideEffectKnowledge",
     "ModeOptionSideEffectTransaction",
+    "ModeRouter",
+    "PromptTemplate",
     "handle_message",
+    "handle_message_stream",
+    "ResponseParser",
+    "ResponseParserEnum",
+    "ResponseParserInt",
+    "ResponseParserJSON",
+    "ResponseCache",
+    "ResponseCacheStore",
+    "ResponseCacheStoreMemory",
+    "ResponseCacheStoreQdrant",
     "Config",
+    "KnowledgeCollection",
+    "KnowledgeRerank",
+    "TokenBudget",
+    "build_messages_list",
     "get_embedding",
+    "get_embeddings",
     "get_response",
     "get_response_chunks",
 ]
@@ -0,0 +1,119 @@
+"""
+Class for micro-batching of concurrent embeddings requests
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+EmbeddingsCreate = Callable[[list[str]], Awaitable[list[list[float]]]]
+
+
+@dataclass(kw_only=True)
+class BatchStats:
+    """
+    Dataclass to represent usage counters of :class:`EmbeddingBatcher`
+
+    :param int batches:
+        Count of batched requests sent
+    :param int items:
+        Count of texts sent in batched requests
+    """
+
+    batches: int = 0
+    items: int = 0
+
+
+class EmbeddingBatcher:  # pylint: disable=too-few-public-methods
+    """
+    Micro-batching scheduler, collecting concurrent embeddings requests into one batched request
+
+    Texts requested with same `create` are queued, and sent together once `max_size` texts are
+    queued, or `max_delay` seconds after first text was queued, whichever is first. Embeddings are
+    then returned to each waiting caller. If batched request fails, all its callers get the error
+
+    :param int max_size:
+        Max count of texts per batched request
+    :param float max_delay:
+        Max seconds a text waits for batch to fill
+    """
+
+    def __init__(self, *, max_size: int, max_delay: float):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.stats = BatchStats()
+
+        # Queues are bound to event loop of their futures, and are dropped if used from another
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: dict[EmbeddingsCreate, list[tuple[str, asyncio.Future]]] = {}
+        self._timers: dict[EmbeddingsCreate, asyncio.TimerHandle] = {}
+        self._flushes: set[asyncio.Task] = set()
+
+    async def get(self, text: str, /, *, create: EmbeddingsCreate) -> list[float]:
+        """
+        Get embeddings of `text` as part of batched request
+
+        :param str text:
+            Text to calculate its embeddings
+        :param Callable[[list[str]],Awaitable[list[list[float]]]] create:
+            Callable to compute embeddings of batch of texts, in order
+        :return:
+            Embeddings vector as list of float points
+        """
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            (self._loop, self._queues, self._timers) = (loop, {}, {})
+
+        future = loop.create_future()
+        queue = self._queues.setdefault(create, [])
+        queue.append((text, future))
+
+        if len(queue) >= self.max_size:
+            self._flush(create)
+        elif create not in self._timers:
+            self._timers[create] = loop.call_later(self.max_delay, self._flush, create)
+
+        return await future
+
+    def _flush(self, create: EmbeddingsCreate, /):
+        timer = self._timers.pop(create, None)
+        if timer is not None:
+            timer.cancel()
+
+        queue = self._queues.pop(create, [])
+        if not queue:
+            return
+
+        flush = asyncio.ensure_future(self._send(create, queue))
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+
+    async def _send(
+        self, create: EmbeddingsCreate, queue: list[tuple[str, asyncio.Future]], /
+    ):
+        self.stats.batches += 1
+        self.stats.items += len(queue)
+
+        try:
+            embeddings = await create([text for (text, _) in queue])
+            if len(embeddings) != len(queue):
+                raise ValueError(
+                    f"Batched request returned '{len(embeddings)}' embeddings for"
+                    f" '{len(queue)}' texts"
+                )
+        except Exception as e:  # pylint: disable=broad-except
+            logging.debug("Batched embeddings request failed: %s", e)
+            for (_, future) in queue:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except asyncio.CancelledError:
+            for (_, future) in queue:
+                future.cancel()
+            raise
+
+        for ((_, future), embedding) in zip(queue, embeddings):
+            if not future.done():
+                future.set_result(embedding)
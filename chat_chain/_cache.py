@@ -0,0 +1,394 @@
+"""
+Caches to avoid repeating round trips to AI model and databases
+"""
+
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import (TYPE_CHECKING, Awaitable, Callable, Generic, Hashable,
+                    Iterable, Optional, TypeVar)
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+if TYPE_CHECKING:
+    from motor.motor_asyncio import AsyncIOMotorCollection
+
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+
+# Error code of MongoDB server not supporting change streams, i.e. not a replica set
+_CHANGE_STREAM_NOT_SUPPORTED = {40573}
+# Seconds before first attempt to reopen failed change stream, doubled on each failure up to TTL
+_WATCH_RETRY_DELAY = 1.0
+
+
+@dataclass(kw_only=True)
+class CacheStats:
+    """
+    Counters of cache usage
+
+    :param int hits:
+        Number of lookups served from in-process cache
+    :param int persistent_hits:
+        Number of lookups served from persistent store
+    :param int misses:
+        Number of lookups that required computing value
+    :param int coalesced:
+        Number of lookups that joined an already in-flight computation of same value
+    :param int evictions:
+        Number of entries evicted from in-process cache due to size or age
+    """
+
+    hits: int = 0
+    persistent_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+
+
+class LRUCache(Generic[_K, _V]):
+    """
+    In-process least-recently-used cache bounded by size, and optionally by age of entries
+
+    :param int max_size:
+        Max number of entries kept in cache
+    :param Optional[float] ttl:
+        Max age of entries in seconds. `None` to keep entries until evicted by size
+    """
+
+    def __init__(self, *, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: OrderedDict[_K, tuple[float, _V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: _K, /) -> Optional[_V]:
+        """
+        Get value of `key` from cache, marking it as recently used
+
+        :param key:
+            Key to look up
+        :return:
+            Cached value, or `None` if key is not cached or has expired
+        """
+
+        try:
+            created, value = self._entries[key]
+        except KeyError:
+            return None
+
+        if self.ttl is not None and time.monotonic() - created > self.ttl:
+            del self._entries[key]
+            self.stats.evictions += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: _K, value: _V, /):
+        """
+        Set value of `key` in cache, evicting least recently used entries if cache is full
+
+        :param key:
+            Key to set
+        :param value:
+            Value to set
+        """
+
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def clear(self):
+        """
+        Remove all entries from cache
+        """
+
+        self._entries.clear()
+
+
+class EmbeddingCacheStore(ABC):
+    """
+    Abstract class for persistent tier of :class:`EmbeddingCache`
+    """
+
+    @abstractmethod
+    async def get(self, key: str, /) -> Optional[list[float]]:
+        """
+        Abstract method to get embeddings stored for `key`, or `None` if not stored
+        """
+
+    @abstractmethod
+    async def set(self, key: str, embedding: list[float], /):
+        """
+        Abstract method to store embeddings for `key`
+        """
+
+
+@dataclass(kw_only=True)
+class EmbeddingCacheStoreMongoDB(EmbeddingCacheStore):
+    """
+    Implementation of :class:`EmbeddingCacheStore` storing embeddings in MongoDB collection
+
+    Entries are stored with `created` date value, which can be used to define a TTL index on
+    collection
+
+    :param AsyncIOMotorCollection collection:
+        Collection to store embeddings in, e.g. `Config.mongodb.embeddings`
+    """
+
+    collection: "AsyncIOMotorCollection"
+
+    async def get(self, key: str, /) -> Optional[list[float]]:
+        doc = await self.collection.find_one({"_id": key}, {"embedding": 1})
+        return doc["embedding"] if doc else None
+
+    async def set(self, key: str, embedding: list[float], /):
+        await self.collection.replace_one(
+            {"_id": key},
+            {"embedding": embedding, "created": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for embeddings, keyed by content hash
+
+    Lookups are served from in-process :class:`LRUCache`, then from optional persistent `store`.
+    Concurrent lookups of same key are coalesced into one computation. Embeddings are kept in
+    process as arrays of 32-bit floats, of 6KiB per 1536 dimensions, rather than lists of Python
+    floats of 48KiB. Failures of `store` are logged, and embeddings are computed instead
+
+    :param int max_size:
+        Max number of embeddings kept in process
+    :param Optional[float] ttl:
+        Max age in seconds of embeddings kept in process
+    :param Optional[EmbeddingCacheStore] store:
+        Persistent tier to consult before computing embeddings
+    """
+
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        ttl: Optional[float] = None,
+        store: Optional["EmbeddingCacheStore"] = None,
+    ):
+        self.store = store
+        self._entries: LRUCache[str, "array[float]"] = LRUCache(
+            max_size=max_size, ttl=ttl
+        )
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._store_writes: set[asyncio.Task] = set()
+
+    @property
+    def stats(self) -> "CacheStats":
+        """
+        Usage counters of cache
+        """
+
+        return self._entries.stats
+
+    async def get_or_create(
+        self, key: str, create: Callable[[], Awaitable[list[float]]], /
+    ) -> list[float]:
+        """
+        Get embeddings for `key` from cache, or by awaiting `create` if not cached
+
+        :param str key:
+            Content hash to look up
+        :param Callable[[],Awaitable[list[float]]] create:
+            Callable to compute embeddings if not cached
+        :return:
+            Embeddings vector as list of float points
+        """
+
+        embedding = self._entries.get(key)
+        if embedding is not None:
+            self.stats.hits += 1
+            return embedding.tolist()
+
+        if key in self._in_flight:
+            self.stats.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._load(key, create))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self._in_flight[key] = task
+
+        return await asyncio.shield(self._in_flight[key])
+
+    def drop_pending(self):
+        """
+        Drop references to in-flight lookups and store writes without awaiting them, as they are
+        bound to event loop of parent process after fork. Cached embeddings are kept
+        """
+
+        self._in_flight = {}
+        self._store_writes = set()
+
+    async def _load(
+        self, key: str, create: Callable[[], Awaitable[list[float]]], /
+    ) -> list[float]:
+        embedding = None
+
+        if self.store:
+            try:
+                embedding = await self.store.get(key)
+            except Exception as e:  # pylint: disable=broad-except
+                logging.warning(
+                    "Failed to read embeddings from persistent store: %s", e
+                )
+
+        if embedding is not None:
+            self.stats.persistent_hits += 1
+        else:
+            self.stats.misses += 1
+            embedding = await create()
+            if self.store:
+                # Write in background to keep store round trip off the caller path
+                write = asyncio.ensure_future(self.store.set(key, embedding))
+                self._store_writes.add(write)
+                write.add_done_callback(self._store_write_done)
+
+        # Return values as kept in process, so hits and misses get same embeddings
+        embedding_array = array("f", embedding)
+        self._entries.set(key, embedding_array)
+
+        return embedding_array.tolist()
+
+    def _store_write_done(self, write: asyncio.Task, /):
+        self._store_writes.discard(write)
+        if not write.cancelled() and write.exception():
+            logging.warning(
+                "Failed to write embeddings to persistent store: %s", write.exception()
+            )
+
+
+class TagsPromptsCache:
+    """
+    Process-local cache of all tags prompts, to serve lookups without I/O
+
+    Cache is loaded on `start`, or on first lookup, then kept fresh by reloading it on every change
+    reported by collection change stream, which is opened before cache is loaded, so no change is
+    missed between them. Change stream is reopened with backoff after errors, and cache reloaded
+    once it is. If change streams are not supported, e.g. by standalone MongoDB, cache is reloaded
+    every `ttl` seconds instead
+
+    :param AsyncIOMotorCollection collection:
+        Collection of tags prompts, with documents of `tag` and `prompt` values
+    :param float ttl:
+        Seconds between reloads when change streams are not supported
+    """
+
+    def __init__(self, *, collection: "AsyncIOMotorCollection", ttl: float):
+        self.collection = collection
+        self.ttl = ttl
+        self._prompts: Optional[dict[str, str]] = None
+        self._load_lock = asyncio.Lock()
+        self._watcher: Optional[asyncio.Task] = None
+        # Set once change stream of watcher is opened, or found not supported
+        self._watching: Optional["asyncio.Future[None]"] = None
+
+    async def start(self):
+        """
+        Start watching collection for changes, and load cache
+        """
+
+        if self._watcher is None or self._watcher.done():
+            self._watching = asyncio.get_running_loop().create_future()
+            self._watcher = asyncio.ensure_future(self._watch(self._watching))
+        await asyncio.wait(
+            [self._watching, self._watcher],  # type: ignore
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+
+        async with self._load_lock:
+            if self._prompts is None:
+                await self._load()
+
+    async def get(self, tags: Iterable[str], /) -> dict[str, str]:
+        """
+        Get prompts of `tags`
+
+        :param Iterable[str] tags:
+            Tags to get prompts of
+        :return:
+            Dict of tags that have prompts, and their prompts
+        """
+
+        if self._prompts is None or self._watcher is None or self._watcher.done():
+            await self.start()
+
+        prompts = self._prompts or {}
+
+        return {tag: prompts[tag] for tag in tags if tag in prompts}
+
+    async def aclose(self):
+        """
+        Stop watching collection for changes
+        """
+
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+            self._watching = None
+
+    async def _load(self):
+        self._prompts = {
+            doc["tag"]: doc["prompt"]
+            async for doc in self.collection.find({}, {"tag": 1, "prompt": 1})
+        }
+
+    async def _watch(self, watching: "asyncio.Future[None]", /):
+        delay = min(_WATCH_RETRY_DELAY, self.ttl)
+        while True:
+            try:
+                async with self.collection.watch() as stream:
+                    if watching.done():
+                        # Reopened after error, so changes in between could be missed
+                        await self._load()
+                    else:
+                        watching.set_result(None)
+                    delay = min(_WATCH_RETRY_DELAY, self.ttl)
+                    async for _ in stream:
+                        await self._load()
+            except OperationFailure as e:
+                if e.code not in _CHANGE_STREAM_NOT_SUPPORTED:
+                    logging.warning("Change stream of tags prompts failed: %s", e)
+                else:
+                    logging.info(
+                        "Change stream of tags prompts not supported, reloading every %ss: %s",
+                        self.ttl,
+                        e,
+                    )
+                    break
+            except PyMongoError as e:
+                logging.warning("Change stream of tags prompts failed: %s", e)
+
+            # Let `start` load cache while change stream is reopened
+            if not watching.done():
+                watching.set_result(None)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.ttl)
+
+        if not watching.done():
+            watching.set_result(None)
+
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self._load()
+            except PyMongoError as e:
+                logging.warning("Failed to reload tags prompts: %s", e)
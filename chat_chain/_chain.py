@@ -2,26 +2,166 @@
 Classes and definitions for Conversation Modes feature
 """
 
+import asyncio
+import contextlib
+import contextvars
 import logging
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Any, Callable, Coroutine, Literal, Optional, TypedDict
+from dataclasses import dataclass, field
+from typing import (Any, AsyncGenerator, Callable, Coroutine, Iterable,
+                    Literal, Optional, TypedDict)
 
-import openai
 from mypy_extensions import Arg
 
 from ._config import Config
-from ._gpt import compose_prompt, match_knowledge
+from ._gpt import (Knowledge, KnowledgeCollections, TokenBudget, _set_usage,
+                   build_messages_list, compose_prompt, get_embedding,
+                   get_response_chunks, match_knowledge,
+                   num_tokens_from_messages)
+from ._log import ConversationLog
+from ._parsers import ResponseParser
+from ._rerank import KnowledgeRerank
+from ._response_cache import ResponseCacheKey, response_cache_key
+from ._router import ModeRouter
+from ._template import PromptTemplate
+from ._trace import Span, _SpanNoop, span
+
+# Tokens limit of response of current turn, set by side effects that size messages list, e.g.
+# knowledge side effect, so response fits in context window of AI model
+_response_tokens_limit: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "response_tokens_limit", default=None
+)
+
+# Embeddings of messages of current turn, by message, so router, knowledge side effect, and
+# response cache, embed message once. Dict is shared with tasks of turn, e.g. prefetches, as they
+# copy context once created
+_message_embeddings: contextvars.ContextVar[
+    Optional[dict[str, "asyncio.Future[list[float]]"]]
+] = contextvars.ContextVar("message_embeddings", default=None)
+
+
+async def _get_model_answer(*, prompt: str, tokens: int) -> str:
+    with span("get_model_answer") as stage:
+        response = await Config.openai_client.request(
+            "chat/completions",
+            api_key=Config.openai_api_key,
+            priority="classifier",
+            tokens=tokens,
+            model=Config.consts.model,
+            messages=[{"role": "system", "content": prompt}],
+            temperature=0.2,
+        )
+        _set_usage(stage, response)
 
+    return response["choices"][0]["message"]["content"]
 
-async def _get_model_answer(*, prompt: str) -> str:
-    response = await openai.ChatCompletion.acreate(
-        model=Config.consts.model,
-        messages=[{"role": "system", "content": prompt}],
-        temperature=0.2,
-    )
 
-    return response["choices"][0]["message"]["content"]
+async def _get_model_answer_stream(
+    *, prompt: str, tokens: int, parser: Optional["ResponseParser"]
+) -> str:
+    (response, tokens_out) = ("", 0)
+
+    with span("get_model_answer", stream=True, tokens_in=tokens) as stage:
+        async with contextlib.aclosing(
+            Config.openai_client.stream(
+                "chat/completions",
+                api_key=Config.openai_api_key,
+                priority="classifier",
+                tokens=tokens,
+                model=Config.consts.model,
+                messages=[{"role": "system", "content": prompt}],
+                temperature=0.2,
+            )
+        ) as chunks:
+            async for chunk in chunks:
+                content = chunk["choices"][0].get("delta", {}).get("content")
+                if content is None:
+                    continue
+
+                response += content
+                tokens_out += 1
+
+                if parser and parser.is_complete(response):
+                    logging.debug("Model response is complete early: %s", response)
+                    stage.set(early=True)
+                    break
+
+        stage.set(tokens_out=tokens_out)
+
+    return response
+
+
+async def _get_prefetched(prefetch: Optional["asyncio.Future"]) -> Any:
+    if prefetch is None:
+        return None
+
+    try:
+        return await prefetch
+    except Exception as e:  # pylint: disable=broad-except
+        logging.warning("Prefetch failed, side effect will run without it: %s", e)
+        return None
+
+
+def _discard_prefetch(prefetch: "asyncio.Future"):
+    if not prefetch.cancelled() and prefetch.exception():
+        logging.debug("Discarded prefetch failed: %s", prefetch.exception())
+
+
+async def _get_message_embedding(message: str, /) -> list[float]:
+    embeddings = _message_embeddings.get()
+    if embeddings is None:
+        return await get_embedding(message.strip())
+
+    if message not in embeddings:
+        embeddings[message] = asyncio.ensure_future(get_embedding(message.strip()))
+
+    # Shielded, so cancelling one of its consumers, e.g. discarded prefetch, doesn't cancel it
+    return await asyncio.shield(embeddings[message])
+
+
+async def _route(*, mode: "Mode", message: str) -> Optional[str]:
+    if not mode.router or not mode.router.trained:
+        return None
+
+    try:
+        return await mode.router.route(
+            message, embedding=await _get_message_embedding(message)
+        )
+    except Exception as e:  # pylint: disable=broad-except
+        logging.warning("Router failed, falling back to model: %s", e)
+        return None
+
+
+async def _get_mode_answer(
+    *,
+    mode: "Mode",
+    message: str,
+    prompt: str,
+    tokens: int,
+    stream: bool,
+    stage: Span | _SpanNoop,
+) -> str:
+    # Response to mode prompt is predicted by router of mode if it is confident, or else is of AI
+    # model, recorded to train router on
+    response = await _route(mode=mode, message=message)
+    if response is not None:
+        logging.debug("Router response: %s", response)
+        stage.set(routed=True)
+        return response
+
+    if stream:
+        response = await _get_model_answer_stream(
+            prompt=prompt, tokens=tokens, parser=mode.parser
+        )
+    else:
+        response = await _get_model_answer(prompt=prompt, tokens=tokens)
+
+    logging.debug("Model response: %s", response)
+
+    if mode.router:
+        mode.router.record(message, response)
+
+    return response
 
 
 async def handle_message(
@@ -39,28 +179,90 @@ async def handle_message(
         mode, AI model response limit
     """
 
+    return await _handle_message(
+        conversation=conversation, message=message, stream=False
+    )
+
+
+async def handle_message_stream(
+    *, conversation: "Conversation", message: str
+) -> AsyncGenerator[tuple[int, str], None]:
+    """
+    Utility function to handle a message and execute chain on, streaming response to it
+
+    :class:`Mode` prompt response is streamed, and is parsed as soon as :class:`Mode` parser finds
+    it complete, e.g. on first token for single-digit classes, then response to message is streamed
+    right away. Response is appended to conversation log once streamed fully
+
+    :param :class:`Conversation` conversation:
+        Current :class:`Conversation` session
+    :param str message:
+        Received message
+    :return:
+        Tuple of two values, first is chunk index, second is chunk value, asynchronously iterable
+    """
+
+    (messages_list, response_tokens_limit) = await _handle_message(
+        conversation=conversation, message=message, stream=True
+    )
+
+    response = []
+
+    # Response stream is closed along with this one, if caller closes it early
+    async with contextlib.aclosing(
+        get_response_chunks(
+            messages=messages_list, response_tokens_limit=response_tokens_limit
+        )
+    ) as chunks:
+        async for chunk in chunks:
+            yield chunk
+            response.append(chunk[1])
+
+    conversation.log.append({"role": "assistant", "content": "".join(response)})
+
+
+async def _handle_message(
+    *, conversation: "Conversation", message: str, stream: bool
+) -> tuple[list["Message"], int]:
     logging.debug("Handling message '%s' with mode: %s", message, conversation.mode)
 
     conversation.log.append({"role": "user", "content": message})
 
+    # Messages list of this turn is only cacheable if knowledge side effect sets its key
+    response_cache_key.set(None)
+    _response_tokens_limit.set(None)
+    _message_embeddings.set({})
+
     mode = conversation.mode
 
-    messages_conversation = "\n".join(
-        f"{message['role']}: {message['content']}"
-        for message in conversation.log[
-            conversation.partial_log_range[0] : conversation.partial_log_range[1]
-        ]
-    )
+    messages_conversation = conversation.log.transcript(*conversation.partial_log_range)
 
-    mode_prompt = mode.prompt.replace("{message}", message).replace(
-        "{conversation}", messages_conversation
+    mode_prompt = mode.template.render(
+        message=message, conversation=messages_conversation
     )
 
     logging.debug("Compiled mode prompt: %s", mode_prompt)
 
-    response = await _get_model_answer(prompt=mode_prompt)
+    # Tokens of mode prompt are only counted for rate limiter, and tracing, with static segments of
+    # prompt counted once
+    mode_prompt_tokens = 0
+    if Config.openai_client.limiter is not None or Config.tracer is not None:
+        mode_prompt_tokens = num_tokens_from_messages(
+            [{"role": "system", "content": ""}], model=Config.consts.model
+        ) + mode.template.num_tokens(
+            model=Config.consts.model,
+            message=message,
+            conversation=messages_conversation,
+        )
 
-    logging.debug("Model response: %s", response)
+    # Start prefetching side effects of options that declare it, to run concurrently with model
+    prefetches = {
+        i: asyncio.ensure_future(
+            option.side_effect.prefetch(conversation=conversation, message=message)
+        )
+        for (i, option) in enumerate(mode.options)
+        if option.prefetch
+    }
 
     messages_list: list["Message"] = [
         {
@@ -72,30 +274,77 @@ async def handle_message(
         }
     ]
 
-    for (i, option) in enumerate(mode.options):
-        if option.condition(response):
-            logging.debug(
-                "Option '%s' condition for response from model is truthy. Executing side effect",
-                i,
-            )
-            messages_list = await option.side_effect.exec(
-                conversation=conversation, message=message, response=response
+    with span("handle_message", mode=mode.name, stream=stream) as stage:
+        try:
+            response = await _get_mode_answer(
+                mode=mode,
+                message=message,
+                prompt=mode_prompt,
+                tokens=mode_prompt_tokens,
+                stream=stream,
+                stage=stage,
             )
-            break
-    else:
-        logging.debug(
-            "No options matched for model response. Falling back to default no-understand response",
-        )
 
-    response_tokens_limit = 300
+            if mode.parser:
+                response = mode.parser.parse(response)
+                logging.debug("Parsed model response: %s", response)
+
+            for (i, option) in enumerate(mode.options):
+                if option.condition(response):
+                    logging.debug(
+                        "Option '%s' condition for response from model is truthy. Executing side"
+                        " effect",
+                        i,
+                    )
+                    stage.set(option=str(i))
+                    messages_list = await option.side_effect.exec(
+                        conversation=conversation,
+                        message=message,
+                        response=response,
+                        prefetched=await _get_prefetched(prefetches.pop(i, None)),
+                    )
+                    if option.transition is not None:
+                        if option.target is None:
+                            raise ValueError(
+                                f"Transition of mode '{mode.name}' to '{option.transition}' is"
+                                " not resolved, as mode is not registered in ModeGraph"
+                            )
+                        logging.debug("Changing mode to '%s'", option.transition)
+                        conversation.mode = option.target
+                    break
+            else:
+                stage.set(option="none")
+                logging.debug(
+                    "No options matched for model response. Falling back to default no-understand"
+                    " response",
+                )
+        finally:
+            for prefetch in prefetches.values():
+                logging.debug(
+                    "Discarding prefetch of option not matched for model response"
+                )
+                prefetch.cancel()
+                prefetch.add_done_callback(_discard_prefetch)
+
+    # Side effects not setting limit, e.g. transactions, get default limit, within context window
+    limit = _response_tokens_limit.get()
+    if limit is None:
+        limit = max(
+            min(
+                4096
+                - num_tokens_from_messages(
+                    messages_list, model=Config.consts.model, memoize=False
+                ),
+                300,
+            ),
+            0,
+        )
 
     logging.debug(
-        "Final messages_list, response_tokens_limit: %s, %s",
-        messages_list,
-        response_tokens_limit,
+        "Final messages_list, response_tokens_limit: %s, %s", messages_list, limit
     )
 
-    return (messages_list, response_tokens_limit)
+    return (messages_list, limit)
 
 
 class Message(TypedDict):
@@ -121,17 +370,30 @@ class Conversation:
         Current mode of conversation
     :param str session:
         Reference to session ID
-    :param list[:class:`Message`] log:
-        List of all messages in conversation
+    :param :class:`ConversationLog` log:
+        Log of messages in conversation. Default empty log with window limits set in
+        `Config.consts`. If list of messages is passed, it is converted to such log
     :param tuple[int,Optional[int]] partial_log_range:
         Range representation of messages log that are of interest for current mode
     """
 
     mode: "Mode"
     session: str
-    log: list["Message"]
+    log: "ConversationLog" = field(default_factory=lambda: _create_log([]))
     partial_log_range: tuple[int, Optional[int]]
 
+    def __post_init__(self):
+        if not isinstance(self.log, ConversationLog):
+            self.log = _create_log(self.log)
+
+
+def _create_log(messages: Iterable["Message"], /) -> "ConversationLog":
+    return ConversationLog(
+        messages,
+        max_messages=Config.consts.conversation_max_messages,
+        max_tokens=Config.consts.conversation_max_tokens,
+    )
+
 
 @dataclass(kw_only=True)
 class Mode:
@@ -142,13 +404,27 @@ class Mode:
         Unique name for logging and debugging
     :param str prompt:
         Prompt used to analyse user message. `{message}` in prompt will be replaced with user
-        message
-
+        message, and `{conversation}` with transcript of conversation. Prompt is compiled once into
+        :class:`PromptTemplate` as `template`
+    :param list[:class:`ModeOption`] options:
+        Options to test against `prompt` response, in order
+    :param Optional[:class:`ResponseParser`] parser:
+        Parser to run once on `prompt` response. Parsed response is passed to options conditions
+        and side effects instead of raw response
+    :param Optional[:class:`ModeRouter`] router:
+        Local router to predict `prompt` response from message, skipping AI model call if its
+        prediction is confident
     """
 
     name: str
     prompt: str
     options: list["ModeOption"]
+    parser: Optional["ResponseParser"] = None
+    router: Optional["ModeRouter"] = None
+    template: "PromptTemplate" = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.template = PromptTemplate(self.prompt)
 
 
 @dataclass(kw_only=True)
@@ -156,14 +432,26 @@ class ModeOption:
     """
     Define an option for :class:`Mode` to test against `prompt` response
 
-    :param Callable[[str],bool] condition:
-        Callable to execute to test whether :class:`Mode` prompt response satisfies this action
+    :param Callable[[Any],bool] condition:
+        Callable to execute to test whether :class:`Mode` prompt response, parsed if :class:`Mode`
+        has parser, satisfies this action
     :param :class:`ModelActionSideEffect` side_effect:
         Side effect to be executed if `condition` is truthful
+    :param bool prefetch:
+        Speculatively run `side_effect` prefetch concurrently with :class:`Mode` prompt, and
+        discard its result if another option is matched. Default `False`
+    :param Optional[str] transition:
+        Name of mode to change conversation to once `side_effect` is executed. Resolved, and
+        validated, by :class:`ModeGraph` mode is registered in, as `target`. Default no transition
     """
 
-    condition: Callable[[str], bool]
+    condition: Callable[[Any], bool]
     side_effect: "ModeOptionSideEffect"
+    prefetch: bool = False
+    transition: Optional[str] = None
+    target: Optional["Mode"] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
 
 class ModeOptionSideEffect(ABC):
@@ -171,11 +459,24 @@ class ModeOptionSideEffect(ABC):
     Abstract class for possible :class:`ModeOption` side effects
     """
 
-    # pylint: disable=too-few-public-methods
+    async def prefetch(self, *, conversation: "Conversation", message: str) -> Any:
+        """
+        Method to compute, ahead of mode prompt response, values side effect depends on. Returned
+        value is passed to `exec` as `prefetched`. Default implementation prefetches nothing
+        """
+
+        # pylint: disable=unused-argument
+
+        return None
 
     @abstractmethod
     async def exec(
-        self, *, conversation: "Conversation", message: str, response: str
+        self,
+        *,
+        conversation: "Conversation",
+        message: str,
+        response: Any,
+        prefetched: Any = None,
     ) -> list["Message"]:
         """
         Abstract method to provide side effect definition for a mode option
@@ -187,23 +488,72 @@ class ModeOptionSideEffectKnowledge(ModeOptionSideEffect):
     """
     Implementation of :class:`ModeOptionSideEffect` to provide knowledge side effect
 
-    :param str collection:
-        Name of collection to query for knowledge
+    If `Config.response_cache` is set, messages list is keyed for response cache by question
+    embeddings and knowledge fingerprint, so :func:`get_response_chunks` can replay response
+
+    :param str|:class:`KnowledgeCollection`|Sequence[str|:class:`KnowledgeCollection`] collection:
+        Collection to query for knowledge, by name or as :class:`KnowledgeCollection` object with
+        its own limit and score threshold. Multiple collections are queried concurrently, and
+        their matches are merged by score
+    :param :class:`TokenBudget` budget:
+        Tokens budget for messages list. Default :class:`TokenBudget` values if not set
+    :param Optional[:class:`KnowledgeRerank`] rerank:
+        Re-ranking to select matched parts with, packing them into `knowledge` section of budget.
+        Default no re-ranking
     """
 
-    collection: str
+    collection: "KnowledgeCollections"
+    budget: "TokenBudget" = field(default_factory=TokenBudget)
+    rerank: Optional["KnowledgeRerank"] = None
+
+    async def prefetch(
+        self, *, conversation: "Conversation", message: str
+    ) -> "Knowledge":
+        return await self._match_knowledge(message)
 
     async def exec(
-        self, *, conversation: "Conversation", message: str, response: str
+        self,
+        *,
+        conversation: "Conversation",
+        message: str,
+        response: Any,
+        prefetched: Any = None,
     ) -> list["Message"]:
-        knowledge = await match_knowledge(question=message)
+        if isinstance(prefetched, Knowledge):
+            knowledge = prefetched
+        else:
+            knowledge = await self._match_knowledge(message)
 
-        prompt = await compose_prompt(knowledge=knowledge)
+        prompt = await compose_prompt(knowledge=knowledge, budget=self.budget)
 
-        return [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": message},
-        ]
+        (messages, limit) = build_messages_list(
+            prompt=prompt, question=message, budget=self.budget
+        )
+        _response_tokens_limit.set(limit)
+
+        if Config.response_cache is not None:
+            response_cache_key.set(
+                ResponseCacheKey.create(
+                    embedding=await _get_message_embedding(message),
+                    parts_ids=(
+                        part[0]
+                        for part in knowledge.matched_parts
+                        if part[1] >= Config.consts.knowledge_bar
+                    ),
+                    prompt=messages[0]["content"],
+                )
+            )
+
+        return messages
+
+    async def _match_knowledge(self, message: str, /) -> "Knowledge":
+        return await match_knowledge(
+            question=message,
+            embedding=await _get_message_embedding(message),
+            collection=self.collection,
+            rerank=self.rerank,
+            max_tokens=self.budget.knowledge,
+        )
 
 
 @dataclass(kw_only=True)
@@ -219,13 +569,18 @@ class ModeOptionSideEffectTransaction(ModeOptionSideEffect):
         [
             Arg("Conversation", "conversation"),
             Arg(str, "message"),
-            Arg(str, "response"),
+            Arg(Any, "response"),
         ],
         Coroutine[Any, Any, list["Message"]],
     ]
 
     async def exec(
-        self, *, conversation: "Conversation", message: str, response: str
+        self,
+        *,
+        conversation: "Conversation",
+        message: str,
+        response: Any,
+        prefetched: Any = None,
     ) -> list["Message"]:
         return await self.transaction(
             conversation=conversation, message=message, response=response
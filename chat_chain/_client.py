@@ -0,0 +1,334 @@
+"""
+Class for managed HTTP client of OpenAI API
+"""
+
+import asyncio
+import contextlib
+import logging
+import random
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Mapping, Optional
+
+import openai
+from openai.api_requestor import APIRequestor
+
+from ._limiter import Priority, RateLimiter
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+@dataclass(kw_only=True)
+class ClientStats:
+    """
+    Dataclass to represent usage counters of :class:`OpenAIClient`
+
+    :param int requests:
+        Count of requests sent, including retries
+    :param int retries:
+        Count of requests retried after rate limit, server, or connection error
+    :param int failures:
+        Count of calls failed after all retries
+    """
+
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0
+
+
+class OpenAIClient:  # pylint: disable=too-many-instance-attributes
+    """
+    Managed client of OpenAI API, sharing one keep-alive connections pool for all calls
+
+    Calls to each endpoint are limited to its concurrency, and wait for a free slot beyond it,
+    rather than fanning out into rate limit errors. If `limiter` is set, calls wait for its budget
+    first, by priority. Calls failing with rate limit, server, timeout,
+    or connection error are retried with exponential backoff and full jitter, honouring
+    `Retry-After` of response. Streams are retried only until their first chunk
+
+    Connections pool and limits are bound to event loop, and are created again if client is used
+    from another event loop
+
+    :param int max_connections:
+        Max open connections of pool. Default `100`
+    :param Mapping[str,int] concurrency:
+        Max concurrent calls per endpoint, e.g. `{"embeddings": 16}`. Endpoints not set are not
+        limited
+    :param float timeout:
+        Max seconds of request, until complete response. Default `60`
+    :param float stream_timeout:
+        Max seconds of stream, until last chunk. Default `300`
+    :param float connect_timeout:
+        Max seconds to connect, including waiting for free connection of pool. Default `5`
+    :param int max_retries:
+        Max retries of failed call. Default `3`
+    :param float backoff:
+        Seconds of backoff of first retry, doubled with each retry. Default `0.5`
+    :param float max_backoff:
+        Max seconds of backoff. Default `8`
+    :param Optional[RateLimiter] limiter:
+        Rate limiter to wait for budget of each request from, and to pause on rate limit error.
+        Default not limited
+    """
+
+    # Errors of these statuses are transient, and are retried
+    _RETRY_STATUSES = frozenset((409, 429, 500, 502, 503, 504))
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = 100,
+        concurrency: Optional[Mapping[str, int]] = None,
+        timeout: float = 60,
+        stream_timeout: float = 300,
+        connect_timeout: float = 5,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8,
+        limiter: Optional["RateLimiter"] = None,
+    ):
+        self.max_connections = max_connections
+        self.concurrency = dict(concurrency or {})
+        self.timeout = timeout
+        self.stream_timeout = stream_timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = limiter
+        self.stats = ClientStats()
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    async def request(
+        self,
+        endpoint: str,
+        /,
+        *,
+        api_key: Optional[str] = None,
+        priority: "Priority" = "answer",
+        tokens: int = 0,
+        **params: Any,
+    ) -> dict[str, Any]:
+        """
+        Send request to OpenAI API endpoint
+
+        :param str endpoint:
+            Path of endpoint, e.g. `chat/completions`
+        :param Optional[str] api_key:
+            OpenAI API key. Default `openai.api_key`
+        :param Priority priority:
+            Priority of request in `limiter`. Default `answer`
+        :param int tokens:
+            Estimated tokens of request in `limiter`, corrected by tokens used as reported in
+            response. Default `0`
+        :param Any params:
+            Parameters of request
+        :return:
+            Response data
+        """
+
+        # pylint: disable=import-outside-toplevel,protected-access
+        import aiohttp
+
+        requestor = APIRequestor(key=api_key)
+
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                await self.limiter.acquire(tokens, priority=priority)
+
+            async with self._limit(endpoint):
+                try:
+                    result = await self._post(
+                        requestor, endpoint, params, timeout=self.timeout
+                    )
+                    # Errors reading body are raised as errors of sending request are
+                    try:
+                        (response, _) = await requestor._interpret_async_response(
+                            result, False
+                        )
+                    except asyncio.TimeoutError as e:
+                        raise openai.error.Timeout("Request timed out") from e
+                    except aiohttp.ClientError as e:
+                        raise openai.error.APIConnectionError(
+                            "Error communicating with OpenAI"
+                        ) from e
+                    finally:
+                        result.release()
+                except openai.error.OpenAIError as e:
+                    error = e
+                else:
+                    data = response.data  # type: ignore
+                    if self.limiter is not None and "usage" in data:
+                        self.limiter.settle(tokens, data["usage"]["total_tokens"])
+                    return data
+
+            self._refund(tokens)
+            await self._retry_or_raise(error, attempt)
+
+        raise AssertionError("Unreachable")  # pragma: no cover
+
+    async def stream(
+        self,
+        endpoint: str,
+        /,
+        *,
+        api_key: Optional[str] = None,
+        priority: "Priority" = "answer",
+        tokens: int = 0,
+        **params: Any,
+    ) -> AsyncGenerator[dict[str, Any], None]:
+        """
+        Stream response chunks of OpenAI API endpoint
+
+        Response connection is closed as soon as stream is closed, e.g. once caller has read
+        enough of it, so AI model stops generating it
+
+        :param str endpoint:
+            Path of endpoint, e.g. `chat/completions`
+        :param Optional[str] api_key:
+            OpenAI API key. Default `openai.api_key`
+        :param Priority priority:
+            Priority of request in `limiter`. Default `answer`
+        :param int tokens:
+            Estimated tokens of request in `limiter`, including `max_tokens` of response, if set,
+            corrected by tokens used once stream is closed. Stream is counted as one token per
+            chunk, unless usage is reported in its chunks. Default `0`
+        :param Any params:
+            Parameters of request, `stream` is set
+        :return:
+            Chunks of response data, asynchronously iterable
+        """
+
+        # pylint: disable=protected-access
+        requestor = APIRequestor(key=api_key)
+
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                await self.limiter.acquire(tokens, priority=priority)
+
+            async with self._limit(endpoint):
+                try:
+                    result = await self._post(
+                        requestor,
+                        endpoint,
+                        {**params, "stream": True},
+                        timeout=self.stream_timeout,
+                    )
+                    try:
+                        # Raises API error of response, if response is not a stream
+                        (chunks, _) = await requestor._interpret_async_response(
+                            result, True
+                        )
+                    except BaseException:
+                        result.close()
+                        raise
+                except openai.error.OpenAIError as e:
+                    error = e
+                else:
+                    (streamed, used) = (0, None)
+                    try:
+                        async for chunk in chunks:  # type: ignore
+                            streamed += 1
+                            if chunk.data.get("usage"):
+                                used = chunk.data["usage"]["total_tokens"]
+                            yield chunk.data
+                    finally:
+                        result.close()
+                        if self.limiter is not None:
+                            if used is None:
+                                used = tokens - params.get("max_tokens", 0) + streamed
+                            self.limiter.settle(tokens, max(used, 0))
+                    return
+
+            self._refund(tokens)
+            await self._retry_or_raise(error, attempt)
+
+    async def aclose(self):
+        """
+        Close connections pool. Pool is created again if client is used after closing
+        """
+
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._reset()
+
+    def _reset(self):
+        self._loop = None
+        self._session = None
+        self._semaphores = {}
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._reset()
+            self._loop = loop
+
+    def _limit(self, endpoint: str, /) -> Any:
+        self._bind()
+
+        if endpoint not in self.concurrency:
+            return contextlib.nullcontext()
+
+        if endpoint not in self._semaphores:
+            self._semaphores[endpoint] = asyncio.Semaphore(self.concurrency[endpoint])
+        return self._semaphores[endpoint]
+
+    async def _post(
+        self,
+        requestor: "APIRequestor",
+        endpoint: str,
+        params: dict[str, Any],
+        /,
+        *,
+        timeout: float,
+    ) -> "aiohttp.ClientResponse":
+        # pylint: disable=import-outside-toplevel
+        import aiohttp
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+
+        self.stats.requests += 1
+
+        return await requestor.arequest_raw(
+            "post",
+            f"/{endpoint}",
+            self._session,
+            params=params,
+            request_timeout=(self.connect_timeout, timeout),
+        )
+
+    def _refund(self, tokens: int, /):
+        # Failed request used no tokens, so its budget is given back, rather than taken again by
+        # each retry
+        if self.limiter is not None:
+            self.limiter.settle(tokens, 0)
+
+    async def _retry_or_raise(self, error: "openai.error.OpenAIError", attempt: int, /):
+        retryable = isinstance(
+            error, (openai.error.Timeout, openai.error.APIConnectionError)
+        ) or (error.http_status in self._RETRY_STATUSES)
+
+        if not retryable or attempt >= self.max_retries:
+            self.stats.failures += 1
+            raise error
+
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        try:
+            delay = max(delay, float((error.headers or {}).get("Retry-After", 0)))
+        except ValueError:
+            pass
+
+        if self.limiter is not None and error.http_status == 429:
+            self.limiter.pause(delay)
+
+        logging.debug(
+            "OpenAI API call failed, retrying in %.2fs: %s", delay, error.user_message
+        )
+        self.stats.retries += 1
+        await asyncio.sleep(delay)
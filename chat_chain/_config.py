@@ -3,42 +3,249 @@ Class and instance of runtime config
 """
 
 import os
-from dataclasses import dataclass
-from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional
 
-import openai
-import qdrant_client
-from motor.motor_asyncio import AsyncIOMotorClient
+from ._batch import EmbeddingBatcher
+from ._cache import EmbeddingCache, TagsPromptsCache
+from ._client import OpenAIClient
+from ._limiter import RateLimiter
 
 if TYPE_CHECKING:
-    from motor.motor_asyncio import AsyncIOMotorDatabase
+    import qdrant_client
+    from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+    from ._response_cache import ResponseCache
+    from ._trace import Tracer
 
 
 @dataclass(kw_only=True)
-class _ConfigConsts:
+class _ConfigConsts:  # pylint: disable=too-many-instance-attributes
     system_prompt_intro: str
     system_prompt_knowledge: str
     system_prompt_no_knowledge: str
     system_prompt_ending: str
     model: str
+    embedding_model: str
     knowledge_bar: float
     max_knowledge: int
+    mongodb_max_pool_size: int
+    qdrant_max_concurrency: int
+    conversation_max_messages: Optional[int]
+    conversation_max_tokens: Optional[int]
+    tags_prompts_ttl: float
+    openai_max_connections: int
+    openai_chat_concurrency: int
+    openai_embeddings_concurrency: int
+    openai_timeout: float
+    openai_max_retries: int
+    openai_tokens_per_minute: Optional[int]
+    openai_requests_per_minute: Optional[int]
 
 
 @dataclass(kw_only=True)
-class _Config:
-    mongodb: "AsyncIOMotorDatabase"
-    qdrant: "qdrant_client.QdrantClient"
+class _Config:  # pylint: disable=too-many-instance-attributes
+    """
+    Runtime config, with clients created on first use
+
+    Clients are created from environment variables at time of first use, and are dropped in child
+    processes after fork, so each process creates its own clients. Clients can also be set
+    explicitly, e.g. for testing
+
+    Responses to knowledge questions are cached only if `response_cache` is set, and stages of
+    chain are traced only if `tracer` is set
+    """
+
     consts: "_ConfigConsts"
+    embedding_cache: "EmbeddingCache"
+    embedding_batcher: "EmbeddingBatcher"
+    response_cache: Optional["ResponseCache"] = None
+    tracer: Optional["Tracer"] = None
+    _openai_api_key: Optional[str] = field(default=None, init=False, repr=False)
+    _mongodb_client: Optional["AsyncIOMotorClient"] = field(
+        default=None, init=False, repr=False
+    )
+    _mongodb: Optional["AsyncIOMotorDatabase"] = field(
+        default=None, init=False, repr=False
+    )
+    _qdrant: Optional["qdrant_client.QdrantClient"] = field(
+        default=None, init=False, repr=False
+    )
+    _qdrant_executor: Optional["ThreadPoolExecutor"] = field(
+        default=None, init=False, repr=False
+    )
+    _tags_prompts: Optional["TagsPromptsCache"] = field(
+        default=None, init=False, repr=False
+    )
+    _openai_client: Optional["OpenAIClient"] = field(
+        default=None, init=False, repr=False
+    )
+
+    @property
+    def openai_api_key(self) -> Optional[str]:
+        """
+        OpenAI API key, from `OPENAI_API_KEY` environment variable unless set explicitly. If
+        `None`, `openai.api_key` is used
+        """
+
+        if self._openai_api_key is None:
+            self._openai_api_key = os.getenv("OPENAI_API_KEY")
+        return self._openai_api_key
+
+    @openai_api_key.setter
+    def openai_api_key(self, value: Optional[str]):
+        self._openai_api_key = value
+
+    @property
+    def mongodb(self) -> "AsyncIOMotorDatabase":
+        """
+        MongoDB database, connected using `DB_CONN_STRING` environment variable, with connections
+        pool of up to `consts.mongodb_max_pool_size` connections
+        """
+
+        if self._mongodb is None:
+            # pylint: disable=import-outside-toplevel
+            from motor.motor_asyncio import AsyncIOMotorClient
+
+            self._mongodb_client = AsyncIOMotorClient(
+                os.getenv("DB_CONN_STRING"),
+                maxPoolSize=self.consts.mongodb_max_pool_size,
+            )
+            self._mongodb = self._mongodb_client.chain_data
+        return self._mongodb
+
+    @mongodb.setter
+    def mongodb(self, value: "AsyncIOMotorDatabase"):
+        self._mongodb = value
+
+    @property
+    def qdrant(self) -> "qdrant_client.QdrantClient":
+        """
+        QDrant client, connected using `QDRANT_HOST_STRING` environment variable over gRPC
+        """
+
+        if self._qdrant is None:
+            # pylint: disable=import-outside-toplevel
+            import qdrant_client
+
+            self._qdrant = qdrant_client.QdrantClient(
+                host=os.getenv("QDRANT_HOST_STRING"),
+                prefer_grpc=True,
+            )
+        return self._qdrant
+
+    @qdrant.setter
+    def qdrant(self, value: "qdrant_client.QdrantClient"):
+        self._qdrant = value
+
+    @property
+    def qdrant_executor(self) -> "ThreadPoolExecutor":
+        """
+        Executor to run QDrant client calls in, with up to `consts.qdrant_max_concurrency` calls
+        running concurrently
+        """
+
+        if self._qdrant_executor is None:
+            self._qdrant_executor = ThreadPoolExecutor(
+                max_workers=self.consts.qdrant_max_concurrency,
+                thread_name_prefix="chat_chain_qdrant",
+            )
+        return self._qdrant_executor
+
+    @qdrant_executor.setter
+    def qdrant_executor(self, value: "ThreadPoolExecutor"):
+        self._qdrant_executor = value
+
+    @property
+    def tags_prompts(self) -> "TagsPromptsCache":
+        """
+        Cache of `tags_prompts` collection of `mongodb`, reloaded on changes, or every
+        `consts.tags_prompts_ttl` seconds if change streams are not supported
+        """
+
+        if self._tags_prompts is None:
+            self._tags_prompts = TagsPromptsCache(
+                collection=self.mongodb.tags_prompts, ttl=self.consts.tags_prompts_ttl
+            )
+        return self._tags_prompts
+
+    @tags_prompts.setter
+    def tags_prompts(self, value: "TagsPromptsCache"):
+        self._tags_prompts = value
+
+    @property
+    def openai_client(self) -> "OpenAIClient":
+        """
+        Client of OpenAI API, with shared connections pool of up to
+        `consts.openai_max_connections` connections, and up to `consts.openai_chat_concurrency`
+        chat completions, and `consts.openai_embeddings_concurrency` embeddings calls running
+        concurrently. If `consts.openai_tokens_per_minute` or `consts.openai_requests_per_minute`
+        is set, calls wait for their budget, with answers ahead of classifier calls, and of
+        embeddings
+        """
+
+        if self._openai_client is None:
+            self._openai_client = OpenAIClient(
+                max_connections=self.consts.openai_max_connections,
+                concurrency={
+                    "chat/completions": self.consts.openai_chat_concurrency,
+                    "embeddings": self.consts.openai_embeddings_concurrency,
+                },
+                timeout=self.consts.openai_timeout,
+                max_retries=self.consts.openai_max_retries,
+                limiter=(
+                    RateLimiter(
+                        tokens_per_minute=self.consts.openai_tokens_per_minute,
+                        requests_per_minute=self.consts.openai_requests_per_minute,
+                    )
+                    if self.consts.openai_tokens_per_minute
+                    or self.consts.openai_requests_per_minute
+                    else None
+                ),
+            )
+        return self._openai_client
+
+    @openai_client.setter
+    def openai_client(self, value: "OpenAIClient"):
+        self._openai_client = value
+
+    async def aclose(self):
+        """
+        Close clients created by config. Clients are created again if used after closing
+        """
+
+        if self._tags_prompts is not None:
+            await self._tags_prompts.aclose()
+        if self._mongodb_client is not None:
+            self._mongodb_client.close()
+        if self._qdrant_executor is not None:
+            self._qdrant_executor.shutdown(wait=False, cancel_futures=True)
+        if self._openai_client is not None:
+            await self._openai_client.aclose()
+
+        self._reset()
+
+    def _reset(self):
+        # Drop references to clients without closing them, as they could be shared with parent
+        # process after fork
+        self._mongodb_client = None
+        self._mongodb = None
+        self._qdrant = None
+        self._qdrant_executor = None
+        self._tags_prompts = None
+        self._openai_client = None
+        self.embedding_cache.drop_pending()
 
 
 Config = _Config(
-    mongodb=AsyncIOMotorClient(os.getenv("DB_CONN_STRING")).chain_data,
-    qdrant=qdrant_client.QdrantClient(
-        host=os.getenv("QDRANT_HOST_STRING"),
-        prefer_grpc=True,
+    embedding_cache=EmbeddingCache(
+        max_size=int(os.getenv("EMBEDDING_CACHE_SIZE") or 4096),
+        ttl=float(os.getenv("EMBEDDING_CACHE_TTL") or 86400),
+    ),
+    embedding_batcher=EmbeddingBatcher(
+        max_size=int(os.getenv("EMBEDDING_BATCH_SIZE") or 64),
+        max_delay=float(os.getenv("EMBEDDING_BATCH_DELAY") or 0.005),
     ),
     consts=_ConfigConsts(
         system_prompt_intro=os.getenv("SYSTEM_PROMPT_INTRO")
@@ -56,7 +263,30 @@ Config = _Config(
         system_prompt_ending=os.getenv("SYSTEM_PROMPT_ENDING")
         or "End the your messages with: ",
         model="gpt-3.5-turbo",
+        embedding_model="text-embedding-ada-002",
         knowledge_bar=0.80,
         max_knowledge=5,
+        mongodb_max_pool_size=int(os.getenv("MONGODB_MAX_POOL_SIZE") or 100),
+        qdrant_max_concurrency=int(os.getenv("QDRANT_MAX_CONCURRENCY") or 8),
+        conversation_max_messages=int(os.getenv("CONVERSATION_MAX_MESSAGES") or 100),
+        conversation_max_tokens=(
+            int(os.getenv("CONVERSATION_MAX_TOKENS") or 0) or None
+        ),
+        tags_prompts_ttl=float(os.getenv("TAGS_PROMPTS_TTL") or 300),
+        openai_max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS") or 100),
+        openai_chat_concurrency=int(os.getenv("OPENAI_CHAT_CONCURRENCY") or 64),
+        openai_embeddings_concurrency=int(
+            os.getenv("OPENAI_EMBEDDINGS_CONCURRENCY") or 16
+        ),
+        openai_timeout=float(os.getenv("OPENAI_TIMEOUT") or 60),
+        openai_max_retries=int(os.getenv("OPENAI_MAX_RETRIES") or 3),
+        openai_tokens_per_minute=(
+            int(os.getenv("OPENAI_TOKENS_PER_MINUTE") or 0) or None
+        ),
+        openai_requests_per_minute=(
+            int(os.getenv("OPENAI_REQUESTS_PER_MINUTE") or 0) or None
+        ),
     ),
 )
+
+os.register_at_fork(after_in_child=Config._reset)  # pylint: disable=protected-access
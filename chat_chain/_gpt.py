@@ -2,43 +2,112 @@
 Functions to craft messages and to get response from AI model
 """
 
+import asyncio
+import contextlib
+import functools
+import hashlib
 import itertools
-import math
+import logging
+import time
 from collections import Counter
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, AsyncIterator, Optional
+from typing import TYPE_CHECKING, AsyncGenerator, Iterable, Optional, Sequence
 
-import openai
 import tiktoken
 
 from ._config import Config
+from ._rerank import KnowledgeRerank, select_parts
+from ._response_cache import response_cache_key
+from ._trace import Span, _SpanNoop, span
 
 if TYPE_CHECKING:
     from qdrant_client.conversions.common_types import ScoredPoint
 
+    from ._batch import EmbeddingsCreate
     from ._chain import Message
+    from ._limiter import Priority
+    from ._response_cache import ResponseCacheKey
 
 
-async def query_qdrant(query: str, /) -> list["ScoredPoint"]:
+@dataclass(kw_only=True)
+class KnowledgeCollection:
+    """
+    Dataclass to represent QDrant collection to search for knowledge
+
+    :param str name:
+        Name of collection
+    :param Optional[int] limit:
+        Max count of parts matched from collection. Default `Config.consts.max_knowledge`
+    :param Optional[float] score_threshold:
+        Min score of parts matched from collection. Default no threshold
+    """
+
+    name: str
+    limit: Optional[int] = None
+    score_threshold: Optional[float] = None
+
+
+# Collection, or collections, to search for knowledge, by name or as `KnowledgeCollection` objects
+KnowledgeCollections = str | KnowledgeCollection | Sequence[str | KnowledgeCollection]
+
+
+async def query_qdrant(
+    query: str,
+    /,
+    *,
+    collection: str = "parts",
+    limit: Optional[int] = None,
+    score_threshold: Optional[float] = None,
+) -> list["ScoredPoint"]:
     """
     Search QDrant database for articles matching `query`
 
+    QDrant client is synchronous, so search is run in `Config.qdrant_executor`, which bounds number
+    of concurrent searches and keeps event loop free to serve other conversations
+
     :param str query:
         String to vectorise and match against database data
+    :param str collection:
+        Name of collection to search. Default `parts`
+    :param Optional[int] limit:
+        Max count of matches. Default `Config.consts.max_knowledge`
+    :param Optional[float] score_threshold:
+        Min score of matches. Default no threshold
     :return:
-        List of :class:`ScoredPoint` objects, each representing one match, sorted by match score,
-        limited to 5
+        List of :class:`ScoredPoint` objects, each representing one match, sorted by match score
     """
 
-    query_embeddings = await get_embedding(query)
-
-    query_results = Config.qdrant.search(
-        collection_name="parts",
-        query_vector=("content", query_embeddings),
-        limit=Config.consts.max_knowledge,
+    return await _search_qdrant(
+        await get_embedding(query),
+        KnowledgeCollection(
+            name=collection, limit=limit, score_threshold=score_threshold
+        ),
     )
 
-    return query_results
+
+async def _search_qdrant(
+    embedding: list[float],
+    collection: "KnowledgeCollection",
+    /,
+    *,
+    fetch_factor: int = 1,
+    with_vectors: bool = False,
+) -> list["ScoredPoint"]:
+    with span("query_qdrant", collection=collection.name) as stage:
+        results = await asyncio.get_running_loop().run_in_executor(
+            Config.qdrant_executor,
+            functools.partial(
+                Config.qdrant.search,
+                collection_name=collection.name,
+                query_vector=("content", embedding),
+                limit=(collection.limit or Config.consts.max_knowledge) * fetch_factor,
+                score_threshold=collection.score_threshold,
+                with_vectors=with_vectors,
+            ),
+        )
+        stage.set(results=len(results))
+
+    return results
 
 
 @dataclass(kw_only=True)
@@ -57,19 +126,73 @@ class Knowledge:
     parts_tags: "Counter"
 
 
-async def match_knowledge(*, question: str) -> "Knowledge":
+async def match_knowledge(
+    *,
+    question: str,
+    embedding: Optional[list[float]] = None,
+    collection: "KnowledgeCollections" = "parts",
+    rerank: Optional["KnowledgeRerank"] = None,
+    max_tokens: Optional[int] = None,
+) -> "Knowledge":
     """
     Match question against knowledge-base and find best matches, along with tags
 
+    If multiple collections are set, question embeddings are calculated once, collections are
+    searched concurrently, and their matches are merged by score. If `rerank` is set, parts are
+    over-fetched with their vectors, and best parts above `Config.consts.knowledge_bar` are
+    selected locally, without near-duplicates, and packed into `max_tokens`
+
     :param str question:
         Question to match against knowledge-base
+    :param Optional[list[float]] embedding:
+        Embeddings of question, if already calculated, e.g. for router of mode. Default calculated
+        from question
+    :param str|KnowledgeCollection|Sequence[str|KnowledgeCollection] collection:
+        Collection, or collections, to search, by name or as :class:`KnowledgeCollection` objects.
+        Default `parts`
+    :param Optional[KnowledgeRerank] rerank:
+        Re-ranking to select matched parts with. Default no re-ranking
+    :param Optional[int] max_tokens:
+        Max tokens of contents of parts selected by re-ranking. Default no budget
     :return:
         :class:`Knowledge` object
     """
 
     question = question.strip()
 
-    query_results = await query_qdrant(question)
+    collections = [
+        c if isinstance(c, KnowledgeCollection) else KnowledgeCollection(name=c)
+        for c in (
+            [collection]
+            if isinstance(collection, (str, KnowledgeCollection))
+            else collection
+        )
+    ]
+
+    if embedding is None:
+        embedding = await get_embedding(question)
+
+    search = functools.partial(
+        _search_qdrant,
+        fetch_factor=rerank.fetch_factor if rerank else 1,
+        with_vectors=rerank is not None,
+    )
+
+    if len(collections) == 1:
+        query_results = await search(embedding, collections[0])
+    else:
+        query_results = sorted(
+            itertools.chain.from_iterable(
+                await asyncio.gather(*(search(embedding, c) for c in collections))
+            ),
+            key=lambda result: result.score,
+            reverse=True,
+        )
+
+    if rerank:
+        query_results = _rerank_results(
+            query_results, rerank=rerank, max_tokens=max_tokens
+        )
 
     knowledge_tags = itertools.chain.from_iterable(
         (result.payload or {}).get("metadata", {}).get("tags", [])
@@ -89,7 +212,57 @@ async def match_knowledge(*, question: str) -> "Knowledge":
     )
 
 
-async def compose_prompt(*, knowledge: "Knowledge") -> str:
+def _rerank_results(
+    query_results: list["ScoredPoint"],
+    /,
+    *,
+    rerank: "KnowledgeRerank",
+    max_tokens: Optional[int],
+) -> list["ScoredPoint"]:
+    # Parts under knowledge bar are not used in prompt, so they are not selected
+    candidates = [
+        result
+        for result in query_results
+        if result.score >= Config.consts.knowledge_bar
+    ]
+
+    selected = select_parts(
+        [result.score for result in candidates],
+        [_get_vector(result) for result in candidates],
+        rerank=rerank,
+        limit=rerank.limit or Config.consts.max_knowledge,
+        tokens=(
+            [
+                num_tokens_from_text(
+                    (result.payload or {}).get("content") or "",
+                    model=Config.consts.model,
+                )
+                for result in candidates
+            ]
+            if max_tokens is not None
+            else None
+        ),
+        max_tokens=max_tokens,
+    )
+
+    return [candidates[i] for i in selected]
+
+
+def _get_vector(result: "ScoredPoint", /) -> list[float]:
+    vector = result.vector
+    if isinstance(vector, dict):
+        vector = vector.get("content")
+
+    # Parts are searched with their vectors for re-ranking, so a part without one is unexpected
+    if vector is None:
+        raise ValueError(f"Matched part '{result.id}' has no vector to re-rank it by")
+
+    return vector
+
+
+async def compose_prompt(
+    *, knowledge: "Knowledge", budget: Optional["TokenBudget"] = None
+) -> str:
     """
     Compose AI model system prompt that dictates model task
 
@@ -99,123 +272,215 @@ async def compose_prompt(*, knowledge: "Knowledge") -> str:
 
     :param :class:`Knowledge` knowledge:
         :class:`Knowledge` object to analyse
+    :param Optional[TokenBudget] budget:
+        Tokens budget to truncate intro and knowledge parts sections of prompt to
     :return:
         AI model system prompt
     """
 
-    prompt = Config.consts.system_prompt_intro
+    with span("compose_prompt", parts=len(knowledge.matched_parts)):
+        budget = budget or TokenBudget()
 
-    acceptable_knowledge = tuple(
-        part
-        for part in knowledge.matched_parts
-        if part[1] >= Config.consts.knowledge_bar
-    )
+        prompt = truncate_prompt(
+            prompt=Config.consts.system_prompt_intro, max_tokens=budget.intro
+        )
 
-    if not acceptable_knowledge:
-        prompt += f" {Config.consts.system_prompt_no_knowledge}"
-        return prompt
+        acceptable_knowledge = tuple(
+            part
+            for part in knowledge.matched_parts
+            if part[1] >= Config.consts.knowledge_bar
+        )
 
-    tags = [tag[0] for tag in knowledge.parts_tags.most_common()]
-    tags_prompts = {
-        doc["tag"]: doc["prompt"]
-        async for doc in Config.mongodb.tags_prompts.find({"tag": {"$in": tags}})
-    }
+        if not acceptable_knowledge:
+            prompt += f" {Config.consts.system_prompt_no_knowledge}"
+            return prompt
 
-    for tag in tags:
-        if tag in tags_prompts:
-            prompt += f" {Config.consts.system_prompt_ending}{tags_prompts[tag]}"
-            break
+        tags = [tag[0] for tag in knowledge.parts_tags.most_common()]
+        tags_prompts = await Config.tags_prompts.get(tags)
 
-    prompt += (
-        f" {Config.consts.system_prompt_knowledge}"
-        f"{' '.join(part[2] for part in acceptable_knowledge)}"
-    )
+        for tag in tags:
+            if tag in tags_prompts:
+                prompt += f" {Config.consts.system_prompt_ending}{tags_prompts[tag]}"
+                break
+
+        knowledge_prompt = truncate_prompt(
+            prompt=" ".join(part[2] for part in acceptable_knowledge),
+            max_tokens=budget.knowledge,
+        )
+
+        prompt += f" {Config.consts.system_prompt_knowledge}{knowledge_prompt}"
 
-    return prompt
+        return prompt
+
+
+@dataclass(kw_only=True)
+class TokenBudget:
+    """
+    Dataclass to represent tokens budget of messages list sent to AI model
+
+    Sections with `None` budget are not truncated on their own, but still count towards `total`,
+    but for `question`, which takes only what is left of `total` after system prompt, but at least
+    100 tokens, so neither long question nor long system prompt leaves other one empty
+
+    :param int total:
+        Max tokens of messages list, including system prompt, question, and messages format
+        overhead. Default `2500`
+    :param Optional[int] intro:
+        Max tokens of system prompt intro
+    :param Optional[int] knowledge:
+        Max tokens of knowledge parts in system prompt
+    :param Optional[int] question:
+        Max tokens of user question. Default what is left of `total` after system prompt, but at
+        least 100 tokens
+    """
+
+    total: int = 2500
+    intro: Optional[int] = None
+    knowledge: Optional[int] = None
+    question: Optional[int] = None
 
 
 def build_messages_list(
-    *, prompt: str, question: Optional[str] = None
+    *,
+    prompt: str,
+    question: Optional[str] = None,
+    budget: Optional["TokenBudget"] = None,
 ) -> tuple[list["Message"], int]:
     """
     Build messages list to be used with AI model to generate response
 
     Beside formatting arguments into the correct format for AI model SDK, this function also
-    truncates `prompt` down to point where it takes two thirds of tokens limit impose by AI model,
-    in order to keep 100 max tokens for question, and rest for the answer
+    truncates `question` to its budget, or to what is left of `total` of `budget` after `prompt`
+    if not set, then truncates `prompt` at exact token boundary so messages list fits in `total` of
+    `budget`, keeping rest of tokens limit imposed by AI model for the answer. `prompt` is encoded
+    only once
 
     :param str prompt:
         AI model system prompt
     :param str question:
         User question
+    :param Optional[TokenBudget] budget:
+        Tokens budget of messages list. Default :class:`TokenBudget` values if not set
     :return:
         Tuple of two values, first is truncated prompt and question as AI model SDK messages list,
         second is tokens limit to be set for response
     """
 
+    budget = budget or TokenBudget()
+    # Messages list stays within context window of AI model, whatever `total` of budget is
+    total = min(budget.total, 4096)
+
     messages: list["Message"] = [
-        {"role": "system", "content": prompt},
+        {"role": "system", "content": ""},
     ]
 
+    encoding = _get_encoding(Config.consts.model)
+    prompt_tokens = encoding.encode(prompt)
+
     if question:
-        messages.append({"role": "user", "content": question})
+        messages.append({"role": "user", "content": ""})
+        # Question fits in what is left of total, after messages format, and, unless it has its own
+        # budget, after prompt, with at least its minimum reserved from prompt
+        question_tokens = total - num_tokens_from_messages(
+            messages, model=Config.consts.model
+        )
+        if budget.question is not None:
+            question_tokens = min(question_tokens, budget.question)
+        else:
+            question_tokens = min(
+                question_tokens,
+                max(question_tokens - len(prompt_tokens), _QUESTION_MIN_TOKENS),
+            )
+        messages[1]["content"] = truncate_prompt(
+            prompt=question, max_tokens=max(question_tokens, 0)
+        )
+
+    # Tokens of messages format and question, to which prompt tokens are added without re-encoding
+    overhead_tokens_count = num_tokens_from_messages(
+        messages, model=Config.consts.model, memoize=False
+    )
 
-    tokens_count = num_tokens_from_messages(messages)
-    while True:
-        if tokens_count <= 2500:
-            break
-        prompt = truncate_prompt(prompt=prompt, tokens_count=tokens_count)
-        tokens_count = num_tokens_from_messages(messages)
+    if overhead_tokens_count + len(prompt_tokens) > total:
+        prompt_tokens = prompt_tokens[: max(total - overhead_tokens_count, 0)]
+        prompt = encoding.decode(prompt_tokens)
 
-    return (messages, min(4096 - tokens_count, 500))
+    messages[0]["content"] = prompt
+    tokens_count = overhead_tokens_count + len(prompt_tokens)
 
+    return (messages, max(min(4096 - tokens_count, 500), 0))
 
-def truncate_prompt(*, prompt: str, tokens_count: int) -> str:
+
+def truncate_prompt(*, prompt: str, max_tokens: Optional[int]) -> str:
     """
-    Truncate prompt in relative to `tokens_count` to words count of `prompt`
+    Truncate prompt at exact token boundary to fit in `max_tokens`
 
     :param str prompt:
-        AI model system prompt
-    :param int tokens_count:
-        Tokens count for messages list which `prompt` was part of
+        AI model system prompt, or section of it
+    :param Optional[int] max_tokens:
+        Max tokens of truncated prompt. `None` to return `prompt` as is
     :return:
         Truncated AI model system prompt
     """
 
-    knowledge_words = prompt.split(" ")
-    knowledge_words_count = len(knowledge_words)
-    prompt = " ".join(
-        knowledge_words[: math.floor((knowledge_words_count * 2500) / tokens_count)]
-    )
+    if max_tokens is None:
+        return prompt
+
+    encoding = _get_encoding(Config.consts.model)
+    prompt_tokens = encoding.encode(prompt)
+
+    if len(prompt_tokens) <= max_tokens:
+        return prompt
 
-    return prompt
+    return encoding.decode(prompt_tokens[:max_tokens])
 
 
 async def get_response(*, messages: list["Message"], response_tokens_limit: int) -> str:
     """
     Get response to user question from AI model
 
+    Response is served from `Config.response_cache`, if set, same as :func:`get_response_chunks`
+
     :param list[Message] messages:
         List of messages which includes AI model system prompt and user question
     :return:
         AI model response
     """
 
-    response = await openai.ChatCompletion.acreate(
-        model=Config.consts.model,
-        messages=messages,
-        max_tokens=response_tokens_limit,
-    )
+    if _get_response_cache_key(messages) is not None:
+        return "".join(
+            [
+                chunk
+                async for (_, chunk) in get_response_chunks(
+                    messages=messages, response_tokens_limit=response_tokens_limit
+                )
+            ]
+        )
+
+    with span("get_response") as stage:
+        response = await Config.openai_client.request(
+            "chat/completions",
+            api_key=Config.openai_api_key,
+            priority="answer",
+            tokens=_estimate_tokens(messages, response_tokens_limit),
+            model=Config.consts.model,
+            messages=messages,
+            max_tokens=response_tokens_limit,
+        )
+        _set_usage(stage, response)
 
     return response["choices"][0]["message"]["content"]
 
 
 async def get_response_chunks(
     *, messages: list["Message"], response_tokens_limit: int
-) -> AsyncIterator[tuple[int, str]]:
+) -> AsyncGenerator[tuple[int, str], None]:
     """
     Get response to user question from AI model in chunks
 
+    If `Config.response_cache` is set, and messages list is of knowledge side effect of current
+    turn, response to a similar question on same knowledge is replayed from cache, and otherwise
+    chunks of response are recorded to cache once streamed fully
+
     :param list[Message] messages:
         List of messages which includes AI model system prompt and user question
     :param int response_tokens_limit:
@@ -224,55 +489,267 @@ async def get_response_chunks(
         Tuple of two values, first is chunk index, second is chunk value, asynchronously iterable
     """
 
-    content_index = 0
-
-    async for chunk in await openai.ChatCompletion.acreate(
-        model=Config.consts.model,
-        messages=messages,
-        max_tokens=response_tokens_limit,
-        stream=True,
-    ):
-        content = chunk["choices"][0].get("delta", {}).get("content")
-        if content is not None:
-            yield (content_index, content)
-            content_index += 1
-
+    with span("get_response_chunks") as stage:
+        key = _get_response_cache_key(messages)
+
+        if key is not None:
+            try:
+                cached = await Config.response_cache.lookup(key=key)  # type: ignore
+            except Exception as e:  # pylint: disable=broad-except
+                logging.warning("Response cache lookup failed: %s", e)
+                cached = None
+
+            if cached is not None:
+                stage.set(cache_hit=True, tokens_out=len(cached))
+                for (content_index, content) in enumerate(cached):
+                    # Spans of caller, while stream is suspended, are not nested in its span
+                    with stage.detached():
+                        yield (content_index, content)
+                return
+
+        chunks: list[str] = []
+        if stage.recording:
+            stage.set(
+                cache_hit=False,
+                tokens_in=num_tokens_from_messages(
+                    messages, model=Config.consts.model, memoize=False
+                ),
+            )
 
-async def get_embedding(text: str, /) -> list[float]:
+        try:
+            async with contextlib.aclosing(
+                Config.openai_client.stream(
+                    "chat/completions",
+                    api_key=Config.openai_api_key,
+                    priority="answer",
+                    tokens=_estimate_tokens(messages, response_tokens_limit),
+                    model=Config.consts.model,
+                    messages=messages,
+                    max_tokens=response_tokens_limit,
+                )
+            ) as completion:
+                async for chunk in completion:
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                    if content is None:
+                        continue
+
+                    if not chunks and stage.recording:
+                        stage.set(first_chunk=time.perf_counter() - stage.start)
+
+                    with stage.detached():
+                        yield (len(chunks), content)
+                    chunks.append(content)
+        finally:
+            # Stream may be closed early by caller
+            stage.set(tokens_out=len(chunks))
+
+        if key is not None:
+            try:
+                await Config.response_cache.add(key=key, chunks=chunks)  # type: ignore
+            except Exception as e:  # pylint: disable=broad-except
+                logging.warning("Response cache add failed: %s", e)
+
+
+def _get_response_cache_key(
+    messages: list["Message"], /
+) -> Optional["ResponseCacheKey"]:
+    key = response_cache_key.get()
+
+    if Config.response_cache is None or key is None or not key.matches(messages):
+        return None
+
+    return key
+
+
+async def get_embedding(
+    text: str, /, *, priority: "Priority" = "embedding"
+) -> list[float]:
     """
     Calculate embeddings of `text`
 
+    Embeddings are cached in `Config.embedding_cache` by hash of model and `text`, so repeated
+    texts, e.g. greetings, don't require a round trip to AI model. Texts not cached are sent to AI
+    model in batches by `Config.embedding_batcher`, along with texts of concurrent calls
+
     :param str text:
         Text to calculate its embeddings
+    :param Priority priority:
+        Priority of request in `Config.openai_client.limiter`. Default `embedding`
     :return:
         Embeddings vector as list of float points
     """
 
-    result = await openai.Embedding.acreate(model="text-embedding-ada-002", input=text)
-    return result["data"][0]["embedding"]
+    model = Config.consts.embedding_model
+
+    with span("get_embedding", cache_hit=True) as stage:
+
+        async def _create() -> list[float]:
+            stage.set(cache_hit=False)
+            return await Config.embedding_batcher.get(
+                text, create=_get_embeddings_create(model, priority)
+            )
+
+        key = hashlib.sha256(f"{model}\n{text}".encode()).hexdigest()
+
+        return await Config.embedding_cache.get_or_create(key, _create)
+
+
+async def get_embeddings(
+    texts: Iterable[str],
+    /,
+    *,
+    priority: "Priority" = "embedding",
+    cache: bool = True,
+) -> list[list[float]]:
+    """
+    Calculate embeddings of multiple texts, e.g. for ingestion
+
+    Texts are looked up in `Config.embedding_cache`, if `cache`, and ones not cached are sent to
+    AI model in batches of up to `Config.embedding_batcher.max_size` texts
+
+    :param Iterable[str] texts:
+        Texts to calculate their embeddings
+    :param Priority priority:
+        Priority of requests in `Config.openai_client.limiter`, e.g. `background` for bulk
+        ingestion. Default `embedding`
+    :param bool cache:
+        Whether to look up, and keep embeddings in `Config.embedding_cache`. Set to `False` for
+        texts not likely to be repeated, e.g. for bulk ingestion, so they don't evict cached
+        embeddings of messages. Default `True`
+    :return:
+        List of embeddings vectors, in order of texts
+    """
+
+    if not cache:
+        create = _get_embeddings_create(Config.consts.embedding_model, priority)
+        return list(
+            await asyncio.gather(
+                *(Config.embedding_batcher.get(text, create=create) for text in texts)
+            )
+        )
+
+    return list(
+        await asyncio.gather(
+            *(get_embedding(text, priority=priority) for text in texts)
+        )
+    )
 
 
-def num_tokens_from_messages(messages, model="gpt-3.5-turbo"):
-    """Returns the number of tokens used by a list of messages."""
+@functools.lru_cache(maxsize=None)
+def _get_embeddings_create(model: str, priority: "Priority", /) -> "EmbeddingsCreate":
+    # One callable per model and priority, so batcher batches texts of same model and priority
+    # together
+    async def _create(texts: list[str]) -> list[list[float]]:
+        tokens = 0
+        if Config.openai_client.limiter is not None:
+            tokens = sum(num_tokens_from_text(text, model=model) for text in texts)
+
+        result = await Config.openai_client.request(
+            "embeddings",
+            api_key=Config.openai_api_key,
+            priority=priority,
+            tokens=tokens,
+            model=model,
+            input=texts,
+        )
+        return [
+            item["embedding"]
+            for item in sorted(result["data"], key=lambda item: item["index"])
+        ]
+
+    return _create
+
+
+# Tokens overhead of messages format per model, as tuples of three values; tokens per message,
+# tokens per name, and tokens priming reply. Models not listed use overhead of later chat models
+_MESSAGES_FORMAT_TOKENS: dict[str, tuple[int, int, int]] = {
+    # every message follows <im_start>{role/name}\n{content}<im_end>\n, if there's a name, the role
+    # is omitted, and every reply is primed with <im_start>assistant
+    "gpt-3.5-turbo": (4, -1, 2),
+    "gpt-3.5-turbo-0301": (4, -1, 2),
+}
+_MESSAGES_FORMAT_TOKENS_DEFAULT = (3, 1, 3)
+
+# Min tokens of question without budget of its own, reserved from system prompt
+_QUESTION_MIN_TOKENS = 100
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model: str) -> "tiktoken.Encoding":
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model == "gpt-3.5-turbo":  # note: future models may deviate from this
-        num_tokens = 0
-        for message in messages:
-            num_tokens += (
-                4  # every message follows <im_start>{role/name}\n{content}<im_end>\n
-            )
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":  # if there's a name, the role is omitted
-                    num_tokens += -1  # role is always required and always 1 token
-        num_tokens += 2  # every reply is primed with <im_start>assistant
-        return num_tokens
-
-    raise NotImplementedError(
-        f"""num_tokens_from_messages() is not presently implemented for model {model}.
-  https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are
-  converted to tokens."""
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def num_tokens_from_text(text: str, /, *, model: str, memoize: bool = True) -> int:
+    """
+    Count tokens of `text` for `model`
+
+    :param str text:
+        Text to count its tokens
+    :param str model:
+        Name of model to use its encoding
+    :param bool memoize:
+        Memoize count per text, for texts counted repeatedly, e.g. messages of conversation log,
+        or static segments of prompts. Texts counted once, e.g. rendered prompts, are encoded
+        without memoizing, so they don't fill memo. Default `True`
+    :return:
+        Tokens count
+    """
+
+    if memoize:
+        return _num_tokens_memoized(text, model)
+
+    return len(_get_encoding(model).encode(text))
+
+
+@functools.lru_cache(maxsize=16384)
+def _num_tokens_memoized(text: str, model: str, /) -> int:
+    return len(_get_encoding(model).encode(text))
+
+
+def _set_usage(stage: Span | _SpanNoop, response: dict, /):
+    # Record tokens of chat completion response, if reported, on span of its request
+    if stage.recording and "usage" in response:
+        stage.set(
+            tokens_in=response["usage"]["prompt_tokens"],
+            tokens_out=response["usage"]["completion_tokens"],
+        )
+
+
+def _estimate_tokens(
+    messages: list["Message"], max_tokens: Optional[int] = None, /
+) -> int:
+    # Estimated tokens of chat completion request, as counted against tokens-per-minute limit
+    if Config.openai_client.limiter is None:
+        return 0
+
+    return num_tokens_from_messages(
+        messages, model=Config.consts.model, memoize=False
+    ) + (max_tokens or 0)
+
+
+def num_tokens_from_messages(messages, model="gpt-3.5-turbo", memoize=True):
+    """
+    Returns the number of tokens used by a list of messages
+
+    Encoding of `model` is resolved once, and tokens of every message value are memoized, so
+    counting a conversation log that grows by appending only encodes new messages. Messages built
+    once, e.g. with rendered system prompt, are counted with `memoize` set to `False`
+    """
+
+    tokens_per_message, tokens_per_name, tokens_per_reply = _MESSAGES_FORMAT_TOKENS.get(
+        model, _MESSAGES_FORMAT_TOKENS_DEFAULT
     )
+
+    num_tokens = 0
+    for message in messages:
+        num_tokens += tokens_per_message
+        for key, value in message.items():
+            num_tokens += num_tokens_from_text(value, model=model, memoize=memoize)
+            if key == "name":
+                num_tokens += tokens_per_name
+    num_tokens += tokens_per_reply
+
+    return num_tokens
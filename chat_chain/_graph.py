@@ -0,0 +1,64 @@
+"""
+Class for registry of conversation modes, and transitions between them
+"""
+
+from typing import TYPE_CHECKING, Iterable, Iterator, Mapping, Optional
+
+from ._config import Config
+
+if TYPE_CHECKING:
+    from ._chain import Mode
+
+
+class ModeGraph(Mapping[str, "Mode"]):
+    """
+    Registry of conversation modes by name, with transitions of their options validated, and
+    resolved, once on creation
+
+    Every :class:`ModeOption` `transition` is resolved to its mode as option `target`, so changing
+    mode of conversation costs no lookup, or import, per turn. Tokens of static segments of modes
+    prompts are counted on creation. As mapping of modes by name, graph can be passed as `modes` of
+    :class:`ConversationStore`, so conversations are persisted with their mode name only
+
+    :param Iterable[:class:`Mode`] modes:
+        Modes to register
+    :param Optional[str] model:
+        Name of model to count tokens of modes prompts for. Default `Config.consts.model`
+    :raises ValueError:
+        If modes names are not unique, or option transitions to mode not registered
+    """
+
+    def __init__(self, modes: Iterable["Mode"], /, *, model: Optional[str] = None):
+        self._modes: dict[str, "Mode"] = {}
+        for mode in modes:
+            if mode.name in self._modes:
+                raise ValueError(f"Mode '{mode.name}' is registered more than once")
+            self._modes[mode.name] = mode
+
+        self.transitions: dict[str, frozenset[str]] = {}
+        for mode in self._modes.values():
+            for (i, option) in enumerate(mode.options):
+                if option.transition is None:
+                    continue
+                if option.transition not in self._modes:
+                    raise ValueError(
+                        f"Option '{i}' of mode '{mode.name}' transitions to mode"
+                        f" '{option.transition}' which is not registered"
+                    )
+                option.target = self._modes[option.transition]
+
+            self.transitions[mode.name] = frozenset(
+                option.transition
+                for option in mode.options
+                if option.transition is not None
+            )
+            mode.template.num_tokens(model=model or Config.consts.model)
+
+    def __getitem__(self, name: str) -> "Mode":
+        return self._modes[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._modes)
+
+    def __len__(self) -> int:
+        return len(self._modes)
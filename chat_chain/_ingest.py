@@ -0,0 +1,679 @@
+"""
+Functions to ingest knowledge documents into QDrant collection read by :func:`match_knowledge`
+"""
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Optional
+
+from ._config import Config
+from ._gpt import _get_encoding, get_embeddings
+
+# Namespace of chunks point IDs, which are derived from documents IDs, and chunks content hashes
+_NAMESPACE = uuid.UUID("5b8e4e3c-3c0f-4b44-9d4f-0c6f5a7e2b61")
+
+
+@dataclass(kw_only=True)
+class IngestDocument:
+    """
+    Dataclass to represent document to ingest into knowledge-base
+
+    :param str id:
+        ID of document, e.g. path of file
+    :param str content:
+        Content of document
+    :param list[str] tags:
+        Tags of document, set on all of its parts. Default empty list
+    """
+
+    id: str
+    content: str
+    tags: list[str] = field(default_factory=list)
+
+
+@dataclass(kw_only=True)
+class IngestReport:
+    """
+    Dataclass to represent results of ingestion
+
+    :param int documents:
+        Count of documents ingested
+    :param int skipped_documents:
+        Count of documents skipped, as ingested with same content per checkpoint
+    :param int chunks:
+        Count of chunks of ingested documents
+    :param int duplicate_chunks:
+        Count of chunks skipped, as already in collection or repeated in document
+    :param float elapsed:
+        Seconds ingestion took
+    """
+
+    documents: int = 0
+    skipped_documents: int = 0
+    chunks: int = 0
+    duplicate_chunks: int = 0
+    elapsed: float = 0
+
+    @property
+    def documents_per_second(self) -> float:
+        """
+        Throughput of ingestion, in documents ingested per second
+        """
+
+        return self.documents / self.elapsed if self.elapsed else 0
+
+    def __str__(self) -> str:
+        return (
+            f"Ingested {self.documents} documents ({self.skipped_documents} skipped) as"
+            f" {self.chunks} chunks ({self.duplicate_chunks} duplicate) in"
+            f" {self.elapsed:.1f}s, {self.documents_per_second:.1f} documents/s"
+        )
+
+
+def chunk_text(text: str, /, *, max_tokens: int = 500, overlap: int = 50) -> list[str]:
+    """
+    Split text into chunks of up to `max_tokens` tokens of embeddings model encoding, at exact
+    token boundaries
+
+    :param str text:
+        Text to split
+    :param int max_tokens:
+        Max tokens of chunk. Default `500`
+    :param int overlap:
+        Tokens repeated from end of chunk at start of next chunk, to keep context. Default `50`
+    :return:
+        List of chunks, stripped of surrounding whitespace, with empty chunks dropped
+    """
+
+    if overlap >= max_tokens:
+        raise ValueError("Chunks overlap should be less than max tokens of chunk")
+
+    encoding = _get_encoding(Config.consts.embedding_model)
+    tokens = encoding.encode(text)
+
+    chunks = []
+    for start in range(0, max(len(tokens) - overlap, 1), max_tokens - overlap):
+        chunk = encoding.decode(tokens[start : start + max_tokens]).strip()
+        if chunk:
+            chunks.append(chunk)
+
+    return chunks
+
+
+async def read_files(
+    paths: Iterable[str], /, *, tags: Iterable[str] = ()
+) -> AsyncIterator["IngestDocument"]:
+    """
+    Read documents from files, or files in directories, recursively
+
+    `.jsonl` files are read as document per line, with `id`, `content`, and optional `tags`
+    fields. Other files are read as one document of text, with path as ID
+
+    :param Iterable[str] paths:
+        Paths of files or directories to read
+    :param Iterable[str] tags:
+        Tags to set on all documents, along with their own tags
+    :return:
+        :class:`IngestDocument` objects, asynchronously iterable
+    """
+
+    tags = list(tags)
+
+    for path in map(pathlib.Path, paths):
+        files = (
+            sorted(p for p in path.rglob("*") if p.is_file())
+            if path.is_dir()
+            else [path]
+        )
+
+        for file in files:
+            text = await asyncio.to_thread(file.read_text, encoding="utf-8")
+
+            if file.suffix != ".jsonl":
+                yield IngestDocument(id=str(file), content=text, tags=tags)
+                continue
+
+            for line in text.splitlines():
+                if not line.strip():
+                    continue
+                doc = json.loads(line)
+                yield IngestDocument(
+                    id=str(doc["id"]),
+                    content=doc["content"],
+                    tags=tags + list(doc.get("tags", [])),
+                )
+
+
+async def read_mongodb(
+    collection: str,
+    /,
+    *,
+    query: Optional[dict[str, Any]] = None,
+    content_field: str = "content",
+    tags_field: str = "tags",
+) -> AsyncIterator["IngestDocument"]:
+    """
+    Read documents from MongoDB collection of `Config.mongodb`
+
+    :param str collection:
+        Name of collection to read documents from
+    :param Optional[dict[str,Any]] query:
+        Query to filter documents. Default all documents
+    :param str content_field:
+        Name of field of document content. Default `content`
+    :param str tags_field:
+        Name of field of document tags. Default `tags`
+    :return:
+        :class:`IngestDocument` objects, with `_id` as ID, asynchronously iterable
+    """
+
+    async for doc in Config.mongodb[collection].find(
+        query or {}, {content_field: 1, tags_field: 1}
+    ):
+        yield IngestDocument(
+            id=str(doc["_id"]),
+            content=doc.get(content_field) or "",
+            tags=list(doc.get(tags_field) or []),
+        )
+
+
+class _Checkpoint:
+    """
+    Record of ingested documents hashes by ID, appended to file as JSON lines, so recording a
+    document costs one line regardless of size of checkpoint
+    """
+
+    def __init__(self, path: Optional[str], /):
+        self.documents: dict[str, str] = {}
+        self._file = None
+
+        if not path:
+            return
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    # Last line can be partial, if ingestion was interrupted while writing it
+                    try:
+                        (document_id, document_hash) = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.documents[document_id] = document_hash
+
+        # pylint: disable-next=consider-using-with
+        self._file = open(path, "a", encoding="utf-8")
+
+    def add(self, document_id: str, document_hash: str, /):
+        """
+        Record document as ingested, appending it to file, if any
+
+        :param str document_id:
+            ID of document
+        :param str document_hash:
+            Hash of content, and tags of document
+        """
+
+        self.documents[document_id] = document_hash
+        if self._file:
+            self._file.write(f"{json.dumps([document_id, document_hash])}\n")
+
+    def flush(self):
+        """
+        Flush documents recorded to file, if any, so they are kept if ingestion is interrupted
+        """
+
+        if self._file:
+            self._file.flush()
+
+    def close(self):
+        """
+        Close file, if any
+        """
+
+        if self._file:
+            self._file.close()
+
+
+@dataclass(kw_only=True)
+class _Chunk:
+    point_id: str
+    content: str
+    document: "IngestDocument"
+    document_hash: str
+    index: int
+
+
+@dataclass(kw_only=True)
+class _Batch:
+    chunks: list["_Chunk"] = field(default_factory=list)
+    # Documents of which first chunk is in batch, or of no chunks, as tuples of document ID,
+    # document hash, and IDs of points of chunks of document. Other points of document, e.g. of
+    # its previous content, are stale
+    documents: list[tuple[str, str, list[str]]] = field(default_factory=list)
+
+
+async def ingest(
+    documents: "AsyncIterable[IngestDocument] | Iterable[IngestDocument]",
+    /,
+    *,
+    collection: str = "parts",
+    checkpoint: Optional[str] = None,
+    chunk_tokens: int = 500,
+    chunk_overlap: int = 50,
+    batch_size: int = 64,
+    concurrency: int = 4,
+) -> "IngestReport":
+    """
+    Ingest documents into QDrant collection of `Config.qdrant`, as parts matched by
+    :func:`match_knowledge`
+
+    Documents are split into chunks, which are embedded and upserted in batches by `concurrency`
+    workers. Documents are read only as fast as workers take batches, so memory stays bounded for
+    large sources. Chunks are points of ID derived from document ID, and content hash, so chunks
+    already in collection are not embedded again, but only have their tags updated, if changed,
+    and points of document no longer among its chunks, e.g. of its previous content, are deleted,
+    in one request per batch. Chunks repeated across documents are points of each document, with
+    its tags. Embeddings are not cached in `Config.embedding_cache`, as ingested chunks are not
+    looked up again. Documents ingested with same content, and tags are recorded in `checkpoint`
+    file, and are skipped if ingestion is run again, e.g. after it was interrupted
+
+    :param AsyncIterable[IngestDocument]|Iterable[IngestDocument] documents:
+        Documents to ingest, e.g. from :func:`read_files`, or :func:`read_mongodb`
+    :param str collection:
+        Name of collection to upsert parts to. Default `parts`
+    :param Optional[str] checkpoint:
+        Path of checkpoint file to resume from and to record ingested documents to
+    :param int chunk_tokens:
+        Max tokens of chunk. Default `500`
+    :param int chunk_overlap:
+        Tokens repeated from end of chunk at start of next chunk. Default `50`
+    :param int batch_size:
+        Count of chunks embedded and upserted per batch. Default `64`
+    :param int concurrency:
+        Count of batches processed concurrently. Default `4`
+    :return:
+        :class:`IngestReport` object
+    """
+
+    start = time.perf_counter()
+    ingestion = _Ingestion(
+        collection=collection, checkpoint=checkpoint, concurrency=concurrency
+    )
+
+    try:
+        batch = _Batch()
+
+        async for document in _aiter(documents):
+            # Tags are hashed along with content, so documents of changed tags are not skipped
+            document_hash = hashlib.sha256(
+                json.dumps([document.content, document.tags]).encode()
+            ).hexdigest()
+            if ingestion.state.documents.get(document.id) == document_hash:
+                ingestion.report.skipped_documents += 1
+                continue
+
+            chunks = _chunk_document(
+                document, document_hash, max_tokens=chunk_tokens, overlap=chunk_overlap
+            )
+            batch.documents.append(
+                (document.id, document_hash, [chunk.point_id for chunk in chunks])
+            )
+            ingestion.report.chunks += len(chunks)
+
+            for chunk in chunks:
+                batch.chunks.append(chunk)
+
+                if len(batch.chunks) >= batch_size:
+                    # Waits while `concurrency` batches are queued already, as backpressure
+                    await ingestion.put(batch)
+                    batch = _Batch()
+
+        if batch.chunks or batch.documents:
+            await ingestion.put(batch)
+
+        await ingestion.join()
+    finally:
+        ingestion.close()
+
+    ingestion.report.elapsed = time.perf_counter() - start
+
+    return ingestion.report
+
+
+class _Ingestion:
+    # State of run of `ingest`, shared by reader of documents, and workers of batches
+
+    def __init__(self, *, collection: str, checkpoint: Optional[str], concurrency: int):
+        self.collection = collection
+        self.report = IngestReport()
+        self.state = _Checkpoint(checkpoint)
+
+        # Chunks of document left to upsert, and one for its stale points left to delete, to
+        # record document in checkpoint once all are done
+        self._remaining: dict[str, int] = {}
+        self._batches: asyncio.Queue[Optional["_Batch"]] = asyncio.Queue(
+            maxsize=concurrency
+        )
+        self._workers = [
+            asyncio.ensure_future(self._work()) for _ in range(concurrency)
+        ]
+
+    async def put(self, batch: "_Batch", /):
+        """
+        Queue batch for workers, waiting while `concurrency` batches are queued already
+        """
+
+        for (document_id, _, point_ids) in batch.documents:
+            self._remaining[document_id] = (
+                self._remaining.get(document_id, 0) + len(point_ids) + 1
+            )
+
+        await _put(self._batches, batch, self._workers)
+
+    async def join(self):
+        """
+        Wait for workers to process batches queued, and stop
+        """
+
+        for _ in self._workers:
+            await _put(self._batches, None, self._workers)
+
+        await asyncio.gather(*self._workers)
+
+    def close(self):
+        """
+        Cancel workers, if not stopped, and close checkpoint
+        """
+
+        for worker in self._workers:
+            worker.cancel()
+        self.state.close()
+
+    async def _work(self):
+        while (batch := await self._batches.get()) is not None:
+            # Points of previous content of documents are deleted before new ones are upserted, so
+            # outdated chunks are not matched
+            await _delete_stale(batch.documents, collection=self.collection)
+            await _upsert_batch(
+                batch.chunks, collection=self.collection, report=self.report
+            )
+
+            for (document_id, document_hash, _) in batch.documents:
+                self._done(document_id, document_hash)
+            for chunk in batch.chunks:
+                self._done(chunk.document.id, chunk.document_hash)
+            self.state.flush()
+
+    def _done(self, document_id: str, document_hash: str, /):
+        self._remaining[document_id] -= 1
+        if not self._remaining[document_id]:
+            del self._remaining[document_id]
+            self.state.add(document_id, document_hash)
+            self.report.documents += 1
+
+
+def _chunk_document(
+    document: "IngestDocument", document_hash: str, /, *, max_tokens: int, overlap: int
+) -> list["_Chunk"]:
+    return [
+        _Chunk(
+            point_id=str(
+                uuid.uuid5(
+                    _NAMESPACE,
+                    f"{document.id}\n{hashlib.sha256(content.encode()).hexdigest()}",
+                )
+            ),
+            content=content,
+            document=document,
+            document_hash=document_hash,
+            index=index,
+        )
+        for (index, content) in enumerate(
+            chunk_text(document.content, max_tokens=max_tokens, overlap=overlap)
+        )
+    ]
+
+
+async def _aiter(
+    documents: "AsyncIterable[IngestDocument] | Iterable[IngestDocument]", /
+) -> AsyncIterator["IngestDocument"]:
+    if isinstance(documents, AsyncIterable):
+        async for document in documents:
+            yield document
+    else:
+        for document in documents:
+            yield document
+
+
+async def _put(queue: "asyncio.Queue", item: Any, workers: list[asyncio.Task], /):
+    # Surface failure of workers, rather than waiting on queue they no longer take from
+    put = asyncio.ensure_future(queue.put(item))
+    await asyncio.wait([put, *workers], return_when=asyncio.FIRST_COMPLETED)
+
+    for worker in workers:
+        if worker.done() and not worker.cancelled() and worker.exception():
+            put.cancel()
+            raise worker.exception()  # type: ignore
+
+    await put
+
+
+async def _delete_stale(
+    documents: list[tuple[str, str, list[str]]], /, *, collection: str
+):
+    # pylint: disable=import-outside-toplevel
+    from qdrant_client.http import models
+
+    if not documents:
+        return
+
+    # Stale points of all documents of batch are deleted in one request
+    await asyncio.get_running_loop().run_in_executor(
+        Config.qdrant_executor,
+        functools.partial(
+            Config.qdrant.delete,
+            collection_name=collection,
+            points_selector=models.FilterSelector(
+                filter=models.Filter(
+                    should=[
+                        models.Filter(
+                            must=[
+                                models.FieldCondition(
+                                    key="metadata.document",
+                                    match=models.MatchValue(value=document_id),
+                                )
+                            ],
+                            must_not=[models.HasIdCondition(has_id=list(point_ids))]
+                            if point_ids
+                            else None,
+                        )
+                        for (document_id, _, point_ids) in documents
+                    ]
+                )
+            ),
+            wait=True,
+        ),
+    )
+
+
+async def _upsert_batch(
+    batch: list["_Chunk"], /, *, collection: str, report: "IngestReport"
+):
+    # pylint: disable=import-outside-toplevel
+    from qdrant_client.http import models
+
+    loop = asyncio.get_running_loop()
+
+    # Chunks repeated in batch, or in collection already, e.g. upserted by earlier batch, are
+    # not embedded again. Ones in collection are upserted again, with their vectors, only if
+    # their payload changed, e.g. document was re-ingested with other tags
+    unique = {chunk.point_id: chunk for chunk in batch}
+    existing = {
+        str(point.id): point.payload
+        for point in await loop.run_in_executor(
+            Config.qdrant_executor,
+            functools.partial(
+                Config.qdrant.retrieve,
+                collection_name=collection,
+                ids=list(unique),
+                with_payload=True,
+                with_vectors=False,
+            ),
+        )
+    }
+    new = [chunk for chunk in unique.values() if chunk.point_id not in existing]
+    changed = [
+        point_id
+        for (point_id, payload) in existing.items()
+        if payload != _payload(unique[point_id])
+    ]
+
+    report.duplicate_chunks += len(batch) - len(new)
+
+    embeddings = await get_embeddings(
+        (chunk.content for chunk in new), priority="background", cache=False
+    )
+    points = [
+        models.PointStruct(
+            id=chunk.point_id, vector={"content": embedding}, payload=_payload(chunk)
+        )
+        for (chunk, embedding) in zip(new, embeddings)
+    ]
+
+    if changed:
+        for point in await loop.run_in_executor(
+            Config.qdrant_executor,
+            functools.partial(
+                Config.qdrant.retrieve,
+                collection_name=collection,
+                ids=changed,
+                with_payload=False,
+                with_vectors=True,
+            ),
+        ):
+            if point.vector is not None:
+                points.append(
+                    models.PointStruct(
+                        id=str(point.id),
+                        vector=point.vector,
+                        payload=_payload(unique[str(point.id)]),
+                    )
+                )
+
+    if not points:
+        return
+
+    await loop.run_in_executor(
+        Config.qdrant_executor,
+        functools.partial(
+            Config.qdrant.upsert, collection_name=collection, points=points, wait=True
+        ),
+    )
+
+    logging.debug("Upserted batch of '%s' chunks to '%s'", len(points), collection)
+
+
+def _payload(chunk: "_Chunk", /) -> dict[str, Any]:
+    return {
+        "id": chunk.point_id,
+        "content": chunk.content,
+        "metadata": {
+            "tags": chunk.document.tags,
+            "document": chunk.document.id,
+            "chunk": chunk.index,
+        },
+    }
+
+
+def create_collection(collection: str = "parts", /, *, dimensions: int = 1536):
+    """
+    Create QDrant collection of `Config.qdrant` for knowledge parts, if it doesn't exist
+
+    :param str collection:
+        Name of collection to create. Default `parts`
+    :param int dimensions:
+        Size of embeddings vectors of `Config.consts.embedding_model`. Default `1536`
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from qdrant_client.http import models
+
+    if collection in {c.name for c in Config.qdrant.get_collections().collections}:
+        return
+
+    Config.qdrant.create_collection(
+        collection_name=collection,
+        vectors_config={
+            "content": models.VectorParams(
+                size=dimensions, distance=models.Distance.COSINE
+            )
+        },
+    )
+
+
+def main():
+    """
+    Command line entry point of ingestion, printing :class:`IngestReport`
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Ingest knowledge documents into QDrant collection"
+    )
+    parser.add_argument(
+        "paths", nargs="*", help="Files or directories of documents to ingest"
+    )
+    parser.add_argument(
+        "--mongodb-collection", help="MongoDB collection to read documents from"
+    )
+    parser.add_argument("--collection", default="parts")
+    parser.add_argument("--checkpoint", help="Path of checkpoint file to resume from")
+    parser.add_argument("--tags", default="", help="Comma-separated tags of documents")
+    parser.add_argument("--chunk-tokens", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--create-collection",
+        action="store_true",
+        help="Create collection if it doesn't exist",
+    )
+    args = parser.parse_args()
+
+    if bool(args.paths) == bool(args.mongodb_collection):
+        parser.error("Set either paths or --mongodb-collection")
+
+    tags = [tag.strip() for tag in args.tags.split(",") if tag.strip()]
+
+    async def _run() -> "IngestReport":
+        if args.create_collection:
+            create_collection(args.collection)
+
+        try:
+            return await ingest(
+                read_files(args.paths, tags=tags)
+                if args.paths
+                else read_mongodb(args.mongodb_collection),
+                collection=args.collection,
+                checkpoint=args.checkpoint,
+                chunk_tokens=args.chunk_tokens,
+                chunk_overlap=args.chunk_overlap,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+            )
+        finally:
+            await Config.aclose()
+
+    print(asyncio.run(_run()))
+
+
+if __name__ == "__main__":
+    main()
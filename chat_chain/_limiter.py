@@ -0,0 +1,250 @@
+"""
+Class for token-bucket rate limiting of AI model requests, by priority
+"""
+
+import asyncio
+import collections
+import time
+from dataclasses import dataclass
+from typing import Literal, Optional
+
+Priority = Literal["answer", "classifier", "embedding", "background"]
+
+# Priorities, from highest to lowest. Requests of a priority are granted only once no request of a
+# higher priority is waiting
+_PRIORITIES: tuple[Priority, ...] = ("answer", "classifier", "embedding", "background")
+
+
+@dataclass(kw_only=True)
+class RateLimiterStats:
+    """
+    Dataclass to represent usage counters of :class:`RateLimiter`, per priority
+
+    :param int acquired:
+        Count of requests granted
+    :param int tokens:
+        Count of estimated tokens granted
+    :param int waited:
+        Count of requests that waited for budget
+    :param float wait_time:
+        Total seconds requests waited for budget
+    :param float max_wait:
+        Max seconds a request waited for budget
+    :param int max_queued:
+        Max count of requests waiting at once
+    """
+
+    acquired: int = 0
+    tokens: int = 0
+    waited: int = 0
+    wait_time: float = 0
+    max_wait: float = 0
+    max_queued: int = 0
+
+
+class RateLimiter:  # pylint: disable=too-many-instance-attributes
+    """
+    Rate limiter of AI model requests, with tokens-per-minute and requests-per-minute budgets
+    shared by all requests, and granted by priority
+
+    Each budget is a token bucket, holding up to `burst` seconds of its limit, and refilled
+    continuously. Requests beyond budget wait, rather than fail with rate limit error, and are
+    granted in order of priority, then of arrival, as budget is refilled. Estimated tokens of
+    requests are corrected with tokens used, once known
+
+    Waiting requests are bound to event loop, and are dropped if limiter is used from another
+    event loop
+
+    :param Optional[int] tokens_per_minute:
+        Max tokens per minute. Default not limited
+    :param Optional[int] requests_per_minute:
+        Max requests per minute. Default not limited
+    :param float burst:
+        Seconds of budget buckets hold, and can be spent at once. Default `60`
+    """
+
+    def __init__(
+        self,
+        *,
+        tokens_per_minute: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        burst: float = 60,
+    ):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.stats = {priority: RateLimiterStats() for priority in _PRIORITIES}
+
+        self._tokens = self._capacity(tokens_per_minute)
+        self._requests = self._capacity(requests_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: dict[Priority, collections.deque[tuple[int, asyncio.Future]]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> dict[Priority, int]:
+        """
+        Count of requests waiting for budget, per priority
+        """
+
+        return {
+            priority: sum(not future.done() for (_, future) in queue)
+            for (priority, queue) in self._queues.items()
+        }
+
+    async def acquire(self, tokens: int = 0, /, *, priority: Priority = "answer"):
+        """
+        Wait for budget of request, and take it
+
+        :param int tokens:
+            Estimated tokens of request, including max tokens of response. Requests of more tokens
+            than bucket holds wait for full bucket
+        :param Priority priority:
+            Priority of request, one of `answer`, `classifier`, `embedding`, or `background`.
+            Default `answer`
+        """
+
+        stats = self.stats[priority]
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._reset()
+            self._loop = loop
+
+        if not any(self._queues.values()) and self._take(tokens) == 0:
+            stats.acquired += 1
+            stats.tokens += tokens
+            return
+
+        future = loop.create_future()
+        queue = self._queues.setdefault(priority, collections.deque())
+        queue.append((tokens, future))
+        stats.max_queued = max(stats.max_queued, len(queue))
+        self._schedule(0)
+
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Budget granted to a cancelled request is returned to bucket
+            if future.done() and not future.cancelled():
+                self._give(tokens)
+            raise
+
+        wait = time.monotonic() - start
+        stats.acquired += 1
+        stats.tokens += tokens
+        stats.waited += 1
+        stats.wait_time += wait
+        stats.max_wait = max(stats.max_wait, wait)
+
+    def settle(self, estimated: int, used: int, /):
+        """
+        Correct tokens budget taken by request with estimated tokens, by tokens it used
+
+        :param int estimated:
+            Estimated tokens request was granted
+        :param int used:
+            Tokens request used, as reported by AI model
+        """
+
+        self._give(estimated - used)
+
+    def pause(self, seconds: float, /):
+        """
+        Hold all requests for `seconds`, e.g. after rate limit error of AI model
+
+        :param float seconds:
+            Seconds to hold requests for
+        """
+
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _reset(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._loop = None
+        self._queues = {}
+        self._timer = None
+
+    def _capacity(self, per_minute: Optional[int], /) -> float:
+        return (per_minute or 0) * self.burst / 60
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self._capacity(self.tokens_per_minute),
+                self._tokens + elapsed * self.tokens_per_minute / 60,
+            )
+        if self.requests_per_minute:
+            self._requests = min(
+                self._capacity(self.requests_per_minute),
+                self._requests + elapsed * self.requests_per_minute / 60,
+            )
+
+    def _take(self, tokens: int, /) -> float:
+        """
+        Take budget of request, if available, and return `0`, or return seconds until available
+        """
+
+        self._refill()
+
+        if (paused := self._paused_until - self._updated) > 0:
+            return paused
+
+        wait = 0.0
+        if self.tokens_per_minute:
+            deficit = min(tokens, self._capacity(self.tokens_per_minute)) - self._tokens
+            wait = max(wait, deficit * 60 / self.tokens_per_minute)
+        if self.requests_per_minute:
+            deficit = 1 - self._requests
+            wait = max(wait, deficit * 60 / self.requests_per_minute)
+
+        if wait > 0:
+            return wait
+
+        self._tokens -= tokens
+        self._requests -= 1
+        return 0
+
+    def _give(self, tokens: int, /):
+        if not self.tokens_per_minute:
+            return
+
+        self._refill()
+        self._tokens = min(
+            self._capacity(self.tokens_per_minute), self._tokens + tokens
+        )
+        if self._loop is not None and any(self._queues.values()):
+            self._schedule(0)
+
+    def _schedule(self, delay: float, /):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_later(delay, self._grant)  # type: ignore
+
+    def _grant(self):
+        self._timer = None
+
+        for priority in _PRIORITIES:
+            queue = self._queues.get(priority)
+            while queue:
+                (tokens, future) = queue[0]
+                if future.done():
+                    queue.popleft()
+                    continue
+
+                wait = self._take(tokens)
+                if wait > 0:
+                    # Lower priorities wait too, so budget is not taken from head of queue
+                    self._schedule(wait)
+                    return
+
+                queue.popleft()
+                future.set_result(None)
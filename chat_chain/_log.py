@@ -0,0 +1,240 @@
+"""
+Class for bounded conversation messages log
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import (TYPE_CHECKING, Callable, Iterable, Iterator, Optional,
+                    overload)
+
+from ._config import Config
+from ._gpt import num_tokens_from_text
+
+if TYPE_CHECKING:
+    from ._chain import Message
+
+
+class ConversationLog:  # pylint: disable=too-many-instance-attributes
+    """
+    Log of conversation messages, keeping only window of latest messages in memory. Messages are
+    only appended, but for latest messages of failed turns, which are removed again
+
+    Messages are indexed by their position in whole conversation, so indexes, e.g. in
+    `partial_log_range` of :class:`Conversation`, remain valid as older messages leave window.
+    Length of log is count of all messages in conversation, including ones that left window
+
+    :param Iterable[:class:`Message`] messages:
+        Initial messages of log
+    :param int offset:
+        Position in conversation of first message in `messages`. Default `0`
+    :param Optional[int] max_messages:
+        Max count of messages kept in window
+    :param Optional[int] max_tokens:
+        Max tokens of messages contents kept in window
+    :param Optional[Callable[[list[:class:`Message`]],None]] on_archive:
+        Callable to receive messages leaving window, e.g. to archive or summarise them
+    """
+
+    def __init__(
+        self,
+        messages: Iterable["Message"] = (),
+        /,
+        *,
+        offset: int = 0,
+        max_messages: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        on_archive: Optional[Callable[[list["Message"]], None]] = None,
+    ):
+        self.offset = offset
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.on_archive = on_archive
+
+        # Window is `_messages[_start:]`. Archived messages are compacted away in batches, to keep
+        # archiving O(1) amortised
+        self._start = 0
+        self._messages: list["Message"] = []
+        self._rendered: list[str] = []
+        self._tokens: list[int] = []
+        self._tokens_count = 0
+        self._transcript: Optional["_Transcript"] = None
+
+        for message in messages:
+            self.append(message)
+
+    def __repr__(self) -> str:
+        return (
+            f"ConversationLog({self._messages[self._start:]!r}, offset={self.offset})"
+        )
+
+    def __len__(self) -> int:
+        return self.offset + len(self._messages) - self._start
+
+    def __iter__(self) -> Iterator["Message"]:
+        return iter(self._messages[self._start :])
+
+    @overload
+    def __getitem__(self, index: int) -> "Message":
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list["Message"]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop) = self._window_range(index.start, index.stop)
+            return self._messages[start:stop]
+
+        if index < 0:
+            index += len(self)
+        if index < self.offset:
+            raise IndexError(
+                f"Message at index '{index}' has left window of conversation log"
+            )
+
+        return self._messages[self._start + index - self.offset]
+
+    def append(self, message: "Message", /):
+        """
+        Append message to log, moving older messages out of window if limits are exceeded
+
+        :param :class:`Message` message:
+            Message to append
+        """
+
+        self._messages.append(message)
+        self._rendered.append(f"{message['role']}: {message['content']}")
+
+        if self.max_tokens is not None:
+            tokens = num_tokens_from_text(message["content"], model=Config.consts.model)
+            self._tokens.append(tokens)
+            self._tokens_count += tokens
+
+        self._archive()
+
+    def pop(self) -> "Message":
+        """
+        Remove latest message from log, e.g. to roll back message of failed turn. Messages moved out
+        of window by appending it are not moved back
+
+        :return:
+            Removed message
+        """
+
+        if len(self._messages) == self._start:
+            raise IndexError("Window of conversation log is empty")
+
+        message = self._messages.pop()
+        self._rendered.pop()
+        if self.max_tokens is not None:
+            self._tokens_count -= self._tokens.pop()
+        self._transcript = None
+
+        return message
+
+    def transcript(self, start: int = 0, stop: Optional[int] = None, /) -> str:
+        """
+        Render messages in range as transcript of `role: content` lines
+
+        Messages are rendered once when appended, and transcript of range ending with log is
+        extended with new messages only, and has messages that left range dropped from its head,
+        rather than joined again
+
+        :param int start:
+            Position of first message in range. Positions out of window are clamped to window
+        :param Optional[int] stop:
+            Position after last message in range. `None` for end of log
+        :return:
+            Transcript of messages in range
+        """
+
+        (window_start, window_stop) = self._window_range(start, stop)
+        if stop is not None:
+            return "\n".join(self._rendered[window_start:window_stop])
+
+        # Cached range is kept by positions in conversation, which do not change as window moves
+        (start, stop) = (
+            window_start - self._start + self.offset,
+            window_stop - self._start + self.offset,
+        )
+        cached = self._transcript
+        if cached is None or not cached.start <= start <= cached.stop:
+            cached = self._transcript = _Transcript(start=start, stop=start)
+
+        if cached.start < start:
+            for _ in range(start - cached.start):
+                cached.lines.popleft()
+            head = cached.lines[0] if cached.lines else cached.base + len(cached.text)
+            cached.text = cached.text[head - cached.base :]
+            (cached.start, cached.base) = (start, head)
+
+        if cached.stop < stop:
+            rendered = self._rendered[
+                cached.stop - self.offset + self._start : window_stop
+            ]
+            texts = [cached.text] if cached.lines else []
+            line = cached.base + len(cached.text) + len(texts)
+            for content in rendered:
+                cached.lines.append(line)
+                line += len(content) + 1
+            cached.text = "\n".join(texts + rendered)
+            cached.stop = stop
+
+        return cached.text
+
+    def _window_range(
+        self, start: Optional[int], stop: Optional[int]
+    ) -> tuple[int, int]:
+        (start, stop, _) = slice(start, stop).indices(len(self))
+        return (
+            self._start + max(start - self.offset, 0),
+            self._start + max(stop - self.offset, 0),
+        )
+
+    def _archive(self):
+        archived: list["Message"] = []
+
+        # Latest message is always kept in window
+        while len(self._messages) - self._start > 1 and (
+            (
+                self.max_messages is not None
+                and len(self._messages) - self._start > self.max_messages
+            )
+            or (self.max_tokens is not None and self._tokens_count > self.max_tokens)
+        ):
+            archived.append(self._messages[self._start])
+            if self.max_tokens is not None:
+                self._tokens_count -= self._tokens[self._start]
+            self._start += 1
+            self.offset += 1
+
+        if not archived:
+            return
+
+        if self._start > len(self._messages) // 2:
+            self._compact()
+
+        if self.on_archive:
+            self.on_archive(archived)
+
+    def _compact(self):
+        del self._messages[: self._start]
+        del self._rendered[: self._start]
+        if self.max_tokens is not None:
+            del self._tokens[: self._start]
+        self._start = 0
+
+
+@dataclass
+class _Transcript:
+    """
+    Cached transcript of messages from `start` to `stop` positions in conversation, with offsets
+    of its lines in all text ever cached, of which `text` starts at offset `base`
+    """
+
+    start: int
+    stop: int
+    text: str = ""
+    base: int = 0
+    lines: deque[int] = field(default_factory=deque)
@@ -0,0 +1,144 @@
+"""
+Classes to parse AI model response to :class:`Mode` prompt
+"""
+
+import copy
+import json
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+
+
+class ResponseParser(ABC):
+    """
+    Abstract class for parsers of :class:`Mode` prompt response. Parser runs once per message, and
+    its result is passed to every :class:`ModeOption` condition and side effect
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    @abstractmethod
+    def parse(self, response: str, /) -> Any:
+        """
+        Abstract method to parse AI model response
+        """
+
+    def is_complete(self, _partial: str, /) -> bool:
+        """
+        Whether streamed response so far is enough to parse it, so rest of response can be
+        skipped. Default `False`, to parse complete response
+
+        :param str _partial:
+            AI model response streamed so far
+        :return:
+            `True` if parsing `partial` gives same result as parsing complete response
+        """
+
+        return False
+
+
+@dataclass(kw_only=True)
+class ResponseParserJSON(ResponseParser):
+    """
+    Implementation of :class:`ResponseParser` to parse JSON responses
+
+    If response is not valid JSON, first JSON object in response is parsed, to tolerate text or
+    code fences surrounding it. Streamed response is complete once it is a valid JSON object
+
+    :param Any default:
+        Value to return, as a copy, if response has no valid JSON. Default `None`
+    """
+
+    default: Any = None
+
+    def parse(self, response: str, /) -> Any:
+        try:
+            return json.loads(response)
+        except ValueError:
+            pass
+
+        (start, end) = (response.find("{"), response.rfind("}"))
+        if 0 <= start < end:
+            try:
+                return json.loads(response[start : end + 1])
+            except ValueError:
+                pass
+
+        return copy.deepcopy(self.default)
+
+    def is_complete(self, partial: str, /) -> bool:
+        partial = partial.strip()
+        if not partial.endswith("}"):
+            return False
+
+        try:
+            json.loads(partial)
+        except ValueError:
+            return False
+
+        return True
+
+
+@dataclass(kw_only=True)
+class ResponseParserInt(ResponseParser):
+    """
+    Implementation of :class:`ResponseParser` to parse integer class responses, e.g. `0` or `1`
+
+    First integer in response is parsed, to tolerate whitespace or text surrounding it. Streamed
+    response is complete once its first integer is followed by another character, or has
+    `max_digits` digits, e.g. on first token for single-digit classes
+
+    :param Optional[int] default:
+        Value to return if response has no integer. Default `None`
+    :param Optional[int] max_digits:
+        Max digits of integer in response. Default no limit
+    """
+
+    default: Optional[int] = None
+    max_digits: Optional[int] = None
+
+    def parse(self, response: str, /) -> Optional[int]:
+        match = re.search(r"-?\d+", response)
+        return int(match.group()) if match else self.default
+
+    def is_complete(self, partial: str, /) -> bool:
+        match = re.search(r"-?\d+", partial)
+        if not match:
+            return False
+
+        return match.end() < len(partial) or (
+            self.max_digits is not None
+            and len(match.group().lstrip("-")) >= self.max_digits
+        )
+
+
+@dataclass(kw_only=True)
+class ResponseParserEnum(ResponseParser):
+    """
+    Implementation of :class:`ResponseParser` to parse responses of one of set of values
+
+    Response matches a value if it equals it, case-insensitively and ignoring whitespace, quotes,
+    and punctuation around it, or else if it contains value as a word
+
+    :param Sequence[str] values:
+        Values response can be of
+    :param Optional[str] default:
+        Value to return if response matches no value. Default `None`
+    """
+
+    values: Sequence[str]
+    default: Optional[str] = None
+
+    def parse(self, response: str, /) -> Optional[str]:
+        normalised = response.strip().strip("\"'.!`").strip().lower()
+
+        for value in self.values:
+            if normalised == value.lower():
+                return value
+
+        for value in self.values:
+            if re.search(rf"\b{re.escape(value.lower())}\b", normalised):
+                return value
+
+        return self.default
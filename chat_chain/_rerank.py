@@ -0,0 +1,117 @@
+"""
+Functions to re-rank and deduplicate matched knowledge parts locally
+"""
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Literal, Optional, Sequence
+
+if TYPE_CHECKING:
+    import numpy
+
+
+@dataclass(kw_only=True)
+class KnowledgeRerank:
+    """
+    Dataclass to represent re-ranking of knowledge parts matched from QDrant
+
+    Parts are over-fetched with their vectors, then selected by maximal marginal relevance, that is
+    by match score penalised by similarity to parts selected already, or, with `dedup` strategy, by
+    match score only. In both strategies, parts near-duplicate of a selected part are dropped.
+    Selected parts are packed into tokens budget, so no part is truncated in prompt
+
+    :param Literal["mmr","dedup"] strategy:
+        Strategy to select parts with. Default `mmr`
+    :param int fetch_factor:
+        Multiplier of limit of parts fetched from collection to select from. Default `3`
+    :param float diversity:
+        Weight of similarity to selected parts against match score in `mmr` strategy, from `0` to
+        `1`. Default `0.3`
+    :param float duplicate_threshold:
+        Min cosine similarity to a selected part to drop part as near-duplicate. Default `0.95`
+    :param Optional[int] limit:
+        Max count of selected parts. Default `Config.consts.max_knowledge`
+    """
+
+    strategy: Literal["mmr", "dedup"] = "mmr"
+    fetch_factor: int = 3
+    diversity: float = 0.3
+    duplicate_threshold: float = 0.95
+    limit: Optional[int] = None
+
+
+def select_parts(
+    scores: Sequence[float],
+    vectors: Sequence[Sequence[float]],
+    /,
+    *,
+    rerank: "KnowledgeRerank",
+    limit: int,
+    tokens: Optional[Sequence[int]] = None,
+    max_tokens: Optional[int] = None,
+) -> list[int]:
+    """
+    Select parts by re-ranking, and pack them into tokens budget
+
+    Similarities of parts are calculated in one matrix product, and marginal relevance of all parts
+    is updated in one vector operation per selected part
+
+    :param Sequence[float] scores:
+        Match scores of parts
+    :param Sequence[Sequence[float]] vectors:
+        Vectors of parts
+    :param :class:`KnowledgeRerank` rerank:
+        Re-ranking to apply
+    :param int limit:
+        Max count of selected parts
+    :param Optional[Sequence[int]] tokens:
+        Tokens of parts contents, required if `max_tokens` is set
+    :param Optional[int] max_tokens:
+        Max tokens of selected parts contents. Parts not fitting in remaining budget are skipped
+    :return:
+        Indexes of selected parts, in order of selection
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import numpy
+
+    if not scores:
+        return []
+
+    matrix = _normalise(numpy.asarray(vectors, dtype=numpy.float32))
+    similarities = matrix @ matrix.T
+    relevance = numpy.asarray(scores, dtype=numpy.float32) * (
+        1.0 if rerank.strategy == "dedup" else 1.0 - rerank.diversity
+    )
+    penalty = 0.0 if rerank.strategy == "dedup" else rerank.diversity
+
+    selected: list[int] = []
+    available = numpy.ones(len(scores), dtype=bool)
+    max_similarity = numpy.zeros(len(scores), dtype=numpy.float32)
+
+    while len(selected) < limit and available.any():
+        # Marginal relevance of parts available, of which best part is selected
+        best = int(
+            numpy.where(
+                available, relevance - penalty * max_similarity, -numpy.inf
+            ).argmax()
+        )
+        available[best] = False
+
+        if max_tokens is not None and tokens is not None:
+            if tokens[best] > max_tokens:
+                continue
+            max_tokens -= tokens[best]
+
+        selected.append(best)
+        max_similarity = numpy.maximum(max_similarity, similarities[best])
+        available &= similarities[best] < rerank.duplicate_threshold
+
+    return selected
+
+
+def _normalise(vectors: "numpy.ndarray", /) -> "numpy.ndarray":
+    # pylint: disable=import-outside-toplevel
+    import numpy
+
+    norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / numpy.where(norms == 0, 1, norms)
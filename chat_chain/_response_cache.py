@@ -0,0 +1,348 @@
+"""
+Classes for semantic cache of AI model responses to knowledge questions
+"""
+
+import asyncio
+import contextvars
+import functools
+import hashlib
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Iterable, Optional
+
+from ._cache import CacheStats
+from ._config import Config
+
+if TYPE_CHECKING:
+    from ._chain import Message
+
+
+@dataclass(kw_only=True)
+class ResponseCacheKey:
+    """
+    Dataclass to represent key of response in :class:`ResponseCache`
+
+    :param list[float] embedding:
+        Embeddings of question
+    :param str fingerprint:
+        Hash of matched knowledge parts IDs and system prompt, which includes tag prompt
+    :param str prompt:
+        System prompt of messages list response is for
+    """
+
+    embedding: list[float]
+    fingerprint: str
+    prompt: str = field(repr=False)
+
+    @classmethod
+    def create(
+        cls, *, embedding: list[float], parts_ids: Iterable[Any], prompt: str
+    ) -> "ResponseCacheKey":
+        """
+        Create key from question embeddings, matched knowledge parts IDs and system prompt
+
+        :param list[float] embedding:
+            Embeddings of question
+        :param Iterable[Any] parts_ids:
+            IDs of matched knowledge parts
+        :param str prompt:
+            System prompt of messages list, composed from matched knowledge parts
+        :return:
+            :class:`ResponseCacheKey` object
+        """
+
+        fingerprint = hashlib.sha256()
+        for part_id in sorted(str(part_id) for part_id in parts_ids):
+            fingerprint.update(f"{part_id}\n".encode())
+        fingerprint.update(prompt.encode())
+
+        return cls(
+            embedding=embedding, fingerprint=fingerprint.hexdigest(), prompt=prompt
+        )
+
+    def matches(self, messages: list["Message"], /) -> bool:
+        """
+        Whether messages list is the one key was created for
+
+        :param list[:class:`Message`] messages:
+            Messages list response is requested for
+        :return:
+            `True` if system prompt of messages list is prompt of key
+        """
+
+        return bool(messages) and messages[0]["content"] == self.prompt
+
+
+# Key of response of current turn, set by knowledge side effect, and used by response functions
+response_cache_key: contextvars.ContextVar[
+    Optional["ResponseCacheKey"]
+] = contextvars.ContextVar("response_cache_key", default=None)
+
+
+class ResponseCacheStore(ABC):
+    """
+    Abstract class for store of :class:`ResponseCache`
+    """
+
+    @abstractmethod
+    async def lookup(
+        self, *, key: "ResponseCacheKey", threshold: float
+    ) -> Optional[list[str]]:
+        """
+        Abstract method to get chunks of response of most similar question of same fingerprint,
+        if similarity is at least `threshold`
+        """
+
+    @abstractmethod
+    async def add(self, *, key: "ResponseCacheKey", chunks: list[str]):
+        """
+        Abstract method to add chunks of response to store
+        """
+
+
+@dataclass(kw_only=True)
+class ResponseCacheStoreMemory(ResponseCacheStore):
+    """
+    Implementation of :class:`ResponseCacheStore` keeping responses in process memory, evicting
+    least recently used responses
+
+    :param int max_entries:
+        Max count of responses kept. Default `1000`
+    :param Optional[float] ttl:
+        Max age of responses in seconds. Default `86400`
+    """
+
+    max_entries: int = 1000
+    ttl: Optional[float] = 86400
+    # Entries are time added, normalised embedding, chunks, and fingerprint, by entry ID, so entry
+    # is removed from its fingerprint without scanning all fingerprints
+    _entries: OrderedDict[str, tuple[float, Any, list[str], str]] = field(
+        default_factory=OrderedDict, init=False, repr=False
+    )
+    _fingerprints: dict[str, set[str]] = field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    async def lookup(
+        self, *, key: "ResponseCacheKey", threshold: float
+    ) -> Optional[list[str]]:
+        # pylint: disable=import-outside-toplevel
+        import numpy
+
+        entries_ids = [
+            entry_id
+            # Expired entries are removed from set of fingerprint while it is iterated
+            for entry_id in list(self._fingerprints.get(key.fingerprint, ()))
+            if not self._expired(entry_id)
+        ]
+        if not entries_ids:
+            return None
+
+        similarities = numpy.stack(
+            [self._entries[entry_id][1] for entry_id in entries_ids]
+        ) @ _normalise(key.embedding)
+        best = int(similarities.argmax())
+
+        if similarities[best] < threshold:
+            return None
+
+        self._entries.move_to_end(entries_ids[best])
+
+        return self._entries[entries_ids[best]][2]
+
+    async def add(self, *, key: "ResponseCacheKey", chunks: list[str]):
+        entry_id = uuid.uuid4().hex
+        self._entries[entry_id] = (
+            time.monotonic(),
+            _normalise(key.embedding),
+            chunks,
+            key.fingerprint,
+        )
+        self._fingerprints.setdefault(key.fingerprint, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _expired(self, entry_id: str, /) -> bool:
+        if (
+            self.ttl is None
+            or time.monotonic() - self._entries[entry_id][0] <= self.ttl
+        ):
+            return False
+
+        self._remove(entry_id)
+        return True
+
+    def _remove(self, entry_id: str, /):
+        fingerprint = self._entries.pop(entry_id)[3]
+        entries_ids = self._fingerprints[fingerprint]
+        entries_ids.discard(entry_id)
+        if not entries_ids:
+            del self._fingerprints[fingerprint]
+
+
+@dataclass(kw_only=True)
+class ResponseCacheStoreQdrant(ResponseCacheStore):
+    """
+    Implementation of :class:`ResponseCacheStore` keeping responses in QDrant collection of
+    `Config.qdrant`, shared by processes
+
+    Collection should define `question` vector of cosine distance. Expired responses are not
+    matched, and are deleted every `prune_every` added responses
+
+    :param str collection:
+        Name of collection to store responses in. Default `responses`
+    :param Optional[float] ttl:
+        Max age of responses in seconds. Default `86400`
+    :param int prune_every:
+        Count of added responses to delete expired responses after. Default `100`
+    """
+
+    collection: str = "responses"
+    ttl: Optional[float] = 86400
+    prune_every: int = 100
+    _added: int = field(default=0, init=False, repr=False)
+
+    async def lookup(
+        self, *, key: "ResponseCacheKey", threshold: float
+    ) -> Optional[list[str]]:
+        results = await self._run(
+            "search",
+            collection_name=self.collection,
+            query_vector=("question", key.embedding),
+            query_filter=self._filter(fingerprint=key.fingerprint),
+            limit=1,
+            score_threshold=threshold,
+        )
+
+        return (results[0].payload or {}).get("chunks") if results else None
+
+    async def add(self, *, key: "ResponseCacheKey", chunks: list[str]):
+        # pylint: disable=import-outside-toplevel
+        from qdrant_client.http import models
+
+        await self._run(
+            "upsert",
+            collection_name=self.collection,
+            points=[
+                models.PointStruct(
+                    id=uuid.uuid4().hex,
+                    vector={"question": key.embedding},
+                    payload={
+                        "fingerprint": key.fingerprint,
+                        "chunks": chunks,
+                        "created": time.time(),
+                    },
+                )
+            ],
+        )
+
+        self._added += 1
+        if self.ttl is not None and self._added % self.prune_every == 0:
+            await self._run(
+                "delete",
+                collection_name=self.collection,
+                points_selector=models.FilterSelector(
+                    filter=models.Filter(
+                        must=[
+                            models.FieldCondition(
+                                key="created",
+                                range=models.Range(lt=time.time() - self.ttl),
+                            )
+                        ]
+                    )
+                ),
+            )
+
+    def _filter(self, *, fingerprint: str) -> Any:
+        # pylint: disable=import-outside-toplevel
+        from qdrant_client.http import models
+
+        conditions: list[models.Condition] = [
+            models.FieldCondition(
+                key="fingerprint", match=models.MatchValue(value=fingerprint)
+            )
+        ]
+        if self.ttl is not None:
+            conditions.append(
+                models.FieldCondition(
+                    key="created", range=models.Range(gte=time.time() - self.ttl)
+                )
+            )
+
+        return models.Filter(must=conditions)
+
+    async def _run(self, method: str, /, **kwargs: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            Config.qdrant_executor,
+            functools.partial(getattr(Config.qdrant, method), **kwargs),
+        )
+
+
+class ResponseCache:
+    """
+    Semantic cache of AI model responses to knowledge questions
+
+    Response is served from cache if a previous question had same knowledge fingerprint, that is
+    same matched knowledge parts and tag prompt, and its embeddings are similar to question by at
+    least `threshold` cosine similarity
+
+    :param :class:`ResponseCacheStore` store:
+        Store of cached responses. Default :class:`ResponseCacheStoreMemory`
+    :param float threshold:
+        Min cosine similarity of questions embeddings to serve cached response. Default `0.95`
+    """
+
+    def __init__(
+        self,
+        *,
+        store: Optional["ResponseCacheStore"] = None,
+        threshold: float = 0.95,
+    ):
+        self.store = store or ResponseCacheStoreMemory()
+        self.threshold = threshold
+        self.stats = CacheStats()
+
+    async def lookup(self, *, key: "ResponseCacheKey") -> Optional[list[str]]:
+        """
+        Get chunks of cached response for key
+
+        :param :class:`ResponseCacheKey` key:
+            Key of response
+        :return:
+            Chunks of cached response, or `None` if not cached
+        """
+
+        chunks = await self.store.lookup(key=key, threshold=self.threshold)
+
+        if chunks is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+
+        return chunks
+
+    async def add(self, *, key: "ResponseCacheKey", chunks: list[str]):
+        """
+        Add chunks of response to cache
+
+        :param :class:`ResponseCacheKey` key:
+            Key of response
+        :param list[str] chunks:
+            Chunks of response, as streamed by AI model
+        """
+
+        await self.store.add(key=key, chunks=chunks)
+
+
+def _normalise(embedding: list[float], /) -> Any:
+    # pylint: disable=import-outside-toplevel
+    import numpy
+
+    vector = numpy.asarray(embedding, dtype=numpy.float32)
+    norm = numpy.linalg.norm(vector)
+
+    return vector / norm if norm else vector
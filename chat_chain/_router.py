@@ -0,0 +1,176 @@
+"""
+Class for local routing of messages to :class:`Mode` prompt responses
+"""
+
+import collections
+from typing import TYPE_CHECKING, Any, Iterable, Optional
+
+from ._gpt import get_embedding, get_embeddings
+
+if TYPE_CHECKING:
+    from sklearn.linear_model import LogisticRegression
+
+
+class ModeRouter:
+    """
+    Local classifier predicting :class:`Mode` prompt response from message embeddings, to skip AI
+    model call when prediction is confident
+
+    Router is suited for modes whose prompt responds with one of few classes, e.g. `0` or `1`.
+    Predicted response is handled same as AI model response, including mode parser. Messages and
+    AI model responses are recorded as samples whenever AI model is called, to (re)train router on
+
+    :param float threshold:
+        Min probability of predicted response to use it instead of calling AI model. Default `0.9`
+    :param int max_samples:
+        Max count of latest samples recorded. Default `10000`
+    """
+
+    def __init__(self, *, threshold: float = 0.9, max_samples: int = 10_000):
+        self.threshold = threshold
+        self.samples: collections.deque[tuple[str, str]] = collections.deque(
+            maxlen=max_samples
+        )
+        self._classifier: Optional["LogisticRegression"] = None
+
+    @property
+    def trained(self) -> bool:
+        """
+        Whether router has been trained
+        """
+
+        return self._classifier is not None
+
+    def record(self, message: str, response: str, /):
+        """
+        Record message and AI model response to it as sample to train router on
+
+        :param str message:
+            User message
+        :param str response:
+            AI model raw response to :class:`Mode` prompt for message
+        """
+
+        self.samples.append((message.strip(), response.strip()))
+
+    async def train(self, samples: Optional[Iterable[tuple[str, str]]] = None, /):
+        """
+        Train router on samples of messages and responses
+
+        :param Optional[Iterable[tuple[str,str]]] samples:
+            Tuples of two values, first is message, second is AI model response. Default recorded
+            samples
+        """
+
+        samples = list(self.samples if samples is None else samples)
+        embeddings = await get_embeddings(message for (message, _) in samples)
+        self.fit(embeddings, [response for (_, response) in samples])
+
+    def fit(self, embeddings: list[list[float]], responses: list[str], /):
+        """
+        Fit router classifier on embeddings of messages and responses
+
+        :param list[list[float]] embeddings:
+            Embeddings of messages
+        :param list[str] responses:
+            AI model responses to messages
+        """
+
+        # pylint: disable=import-outside-toplevel
+        from sklearn.linear_model import LogisticRegression
+
+        if len(set(responses)) < 2:
+            raise ValueError(
+                "Router requires samples of at least two responses to train"
+            )
+
+        classifier = LogisticRegression(max_iter=1000)
+        classifier.fit(embeddings, responses)
+        self._classifier = classifier
+
+    def predict(self, embedding: list[float], /) -> tuple[str, float]:
+        """
+        Predict response for message embedding
+
+        :param list[float] embedding:
+            Embeddings of message
+        :return:
+            Tuple of two values, first is predicted response, second is its probability
+        """
+
+        if self._classifier is None:
+            raise ValueError("Router is not trained")
+
+        probabilities = self._classifier.predict_proba([embedding])[0]
+        best = probabilities.argmax()
+
+        return (self._classifier.classes_[best], float(probabilities[best]))
+
+    async def route(
+        self, message: str, /, *, embedding: Optional[list[float]] = None
+    ) -> Optional[str]:
+        """
+        Predict response for message, if router is trained and prediction is confident
+
+        :param str message:
+            User message
+        :param Optional[list[float]] embedding:
+            Embeddings of message, if already calculated, e.g. by turn of chain, to be shared with
+            knowledge side effect. Default calculated from message
+        :return:
+            Predicted response, or `None` if AI model should be called
+        """
+
+        if self._classifier is None:
+            return None
+
+        if embedding is None:
+            embedding = await get_embedding(message.strip())
+
+        (response, probability) = self.predict(embedding)
+
+        return response if probability >= self.threshold else None
+
+    def save(self, path: str, /):
+        """
+        Save router to file
+
+        :param str path:
+            Path of file to save router to
+        """
+
+        # pylint: disable=import-outside-toplevel
+        import joblib
+
+        joblib.dump(
+            {
+                "threshold": self.threshold,
+                "classifier": self._classifier,
+                "samples": list(self.samples),
+            },
+            path,
+        )
+
+    @classmethod
+    def load(cls, path: str, /, **kwargs: Any) -> "ModeRouter":
+        """
+        Load router saved to file
+
+        :param str path:
+            Path of file router was saved to
+        :param Any kwargs:
+            Arguments to override, e.g. `threshold`
+        :return:
+            :class:`ModeRouter` object
+        """
+
+        # pylint: disable=import-outside-toplevel
+        import joblib
+
+        data = joblib.load(path)
+
+        router = cls(**{"threshold": data["threshold"], **kwargs})
+        router.samples.extend(data["samples"])
+        router._classifier = data["classifier"]  # pylint: disable=protected-access
+
+        return router
@@ -0,0 +1,408 @@
+"""
+Class for ASGI server of conversations, streaming responses over SSE, or websocket
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import (TYPE_CHECKING, Any, AsyncGenerator, AsyncIterator,
+                    Awaitable, Callable, Optional)
+
+from ._cache import LRUCache
+from ._chain import (Conversation, ModeOptionSideEffectKnowledge,
+                     handle_message_stream)
+from ._config import Config
+
+if TYPE_CHECKING:
+    from ._chain import Mode
+    from ._store import ConversationStore
+
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+class ChatServerBase(ABC):
+    """
+    Abstract class of ASGI application serving turns of conversations, over SSE, or websocket, as
+    endpoints of :class:`ChatServer`. Subclasses implement :meth:`turn`, and :meth:`aclose`
+
+    :param int max_message_size:
+        Max bytes of request body. Default `65536`
+    """
+
+    def __init__(self, *, max_message_size: int = 65536):
+        self.max_message_size = max_message_size
+
+    async def __call__(self, scope: dict[str, Any], receive: Receive, send: Send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    @abstractmethod
+    async def turn(
+        self, session: str, message: str, /
+    ) -> AsyncGenerator[tuple[int, str], None]:
+        """
+        Handle message of `session`, streaming response to it, once previous turns of `session`
+        are done
+
+        :param str session:
+            Session ID of conversation
+        :param str message:
+            Received message
+        :return:
+            Tuple of two values, first is chunk index, second is chunk value, asynchronously
+            iterable
+        """
+
+        # Unreachable `yield` makes method async generator, as implementations are
+        raise NotImplementedError
+        yield  # pylint: disable=unreachable
+
+    async def start(self):
+        """
+        Prepare server to serve turns, once ASGI server starts. Default does nothing
+        """
+
+    @abstractmethod
+    async def aclose(self):
+        """
+        Release resources of server, once ASGI server shuts down
+        """
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        while True:
+            event = await receive()
+            if event["type"] == "lifespan.startup":
+                await self.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif event["type"] == "lifespan.shutdown":
+                await self.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope: dict[str, Any], receive: Receive, send: Send):
+        path = scope["path"].strip("/").split("/")
+
+        if scope["method"] == "GET" and path == ["health"]:
+            await _respond(send, 200, b"ok")
+            return
+
+        if (
+            scope["method"] != "POST"
+            or len(path) != 3
+            or path[::2] != ["sessions", "messages"]
+        ):
+            await _respond(send, 404, b"Not found")
+            return
+
+        body = b""
+        while True:
+            event = await receive()
+            if event["type"] == "http.disconnect":
+                return
+            body += event.get("body", b"")
+            if len(body) > self.max_message_size:
+                await _respond(send, 413, b"Message too large")
+                return
+            if not event.get("more_body"):
+                break
+
+        try:
+            message = json.loads(body)["message"]
+            if not isinstance(message, str):
+                raise TypeError("message is not a string")
+        except (ValueError, KeyError, TypeError) as e:
+            await _respond(send, 400, f"Invalid message: {e}".encode())
+            return
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                ],
+            }
+        )
+
+        # Client disconnect is only reported by receive, so turn is raced against it, and is
+        # cancelled at any stage of turn once client disconnects
+        disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+        streaming = asyncio.ensure_future(self._stream(path[1], message, send))
+        try:
+            await asyncio.wait(
+                [disconnect, streaming], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            disconnect.cancel()
+            if not streaming.done():
+                streaming.cancel()
+                await asyncio.gather(streaming, return_exceptions=True)
+
+        if streaming.cancelled():
+            return
+
+        await send({"type": "http.response.body", "body": b"event: done\ndata: {}\n\n"})
+
+    async def _stream(self, session: str, message: str, send: Send, /):
+        try:
+            async with contextlib.aclosing(self.turn(session, message)) as chunks:
+                async for (index, content) in chunks:
+                    data = json.dumps({"index": index, "content": content})
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": f"data: {data}\n\n".encode(),
+                            "more_body": True,
+                        }
+                    )
+        except Exception as e:  # pylint: disable=broad-except
+            logging.exception("Turn of session '%s' failed", session)
+            data = json.dumps({"error": type(e).__name__})
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": f"event: error\ndata: {data}\n\n".encode(),
+                    "more_body": True,
+                }
+            )
+
+    async def _websocket(self, scope: dict[str, Any], receive: Receive, send: Send):
+        path = scope["path"].strip("/").split("/")
+
+        event = await receive()
+        if event["type"] != "websocket.connect":
+            return
+
+        if len(path) != 2 or path[0] != "sessions":
+            await send({"type": "websocket.close", "code": 1008})
+            return
+
+        await send({"type": "websocket.accept"})
+
+        # Events are received while turns run, so turn is cancelled once client disconnects, as
+        # of SSE endpoint, and messages received meanwhile are handled in order after it
+        messages: asyncio.Queue[Optional[str]] = asyncio.Queue()
+        receiving = asyncio.ensure_future(_receive_messages(receive, messages))
+        try:
+            while (message := await messages.get()) is not None:
+                turn = asyncio.ensure_future(self._send(path[1], message, send))
+                await asyncio.wait(
+                    [receiving, turn], return_when=asyncio.FIRST_COMPLETED
+                )
+                if not turn.done():
+                    turn.cancel()
+                    await asyncio.gather(turn, return_exceptions=True)
+                    return
+        finally:
+            receiving.cancel()
+            await asyncio.gather(receiving, return_exceptions=True)
+
+    async def _send(self, session: str, message: str, send: Send, /):
+        try:
+            async with contextlib.aclosing(self.turn(session, message)) as chunks:
+                async for (index, content) in chunks:
+                    await send(
+                        {
+                            "type": "websocket.send",
+                            "text": json.dumps({"index": index, "content": content}),
+                        }
+                    )
+        except Exception as e:  # pylint: disable=broad-except
+            logging.exception("Turn of session '%s' failed", session)
+            await send(
+                {
+                    "type": "websocket.send",
+                    "text": json.dumps({"error": type(e).__name__}),
+                }
+            )
+
+        await send({"type": "websocket.send", "text": json.dumps({"done": True})})
+
+
+class ChatServer(ChatServerBase):
+    """
+    ASGI application serving conversations of many sessions on one event loop
+
+    Turns of a session are run one at a time, in order of arrival, while turns of different
+    sessions run concurrently. Conversations are kept in memory, up to `max_sessions` recently
+    used ones, and, if `store` is set, are loaded from it when not in memory, and saved to it after
+    each turn. Serve with any ASGI server, e.g. `uvicorn module:server`, as one event loop, or
+    sharded by session across worker processes with :class:`ChatServerSharded`
+
+    Endpoints:
+
+    - `POST /sessions/{session}/messages`, with JSON body `{"message": ...}`: Streams response as
+      server-sent events, each of `{"index": ..., "content": ...}` data, and ends with `done`
+      event. Turn is stopped if client disconnects
+    - `/sessions/{session}` websocket: Each text frame received is a message, response to which is
+      sent as `{"index": ..., "content": ...}` frames, ending with `{"done": true}` frame. Messages
+      received during turn are handled after it, in order. Turn is stopped if client disconnects
+    - `GET /health`: Responds with `ok`
+
+    :param :class:`Mode` mode:
+        Mode of new conversations
+    :param Optional[:class:`ConversationStore`] store:
+        Store to load conversations from, and save them to. Default conversations are kept in memory
+        only
+    :param int max_sessions:
+        Max count of conversations kept in memory. Default `10000`
+    :param Optional[float] session_ttl:
+        Max seconds conversation is kept in memory since last turn. Default `3600`
+    :param int max_message_size:
+        Max bytes of request body. Default `65536`
+    """
+
+    def __init__(
+        self,
+        *,
+        mode: "Mode",
+        store: Optional["ConversationStore"] = None,
+        max_sessions: int = 10_000,
+        session_ttl: Optional[float] = 3600,
+        max_message_size: int = 65536,
+    ):
+        super().__init__(max_message_size=max_message_size)
+        self.mode = mode
+        self.store = store
+
+        self._conversations: LRUCache[str, "Conversation"] = LRUCache(
+            max_size=max_sessions, ttl=session_ttl
+        )
+        # Locks of sessions with turns running or waiting, as lock and count of turns holding it
+        self._locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+    async def turn(
+        self, session: str, message: str, /
+    ) -> AsyncGenerator[tuple[int, str], None]:
+        """
+        Handle message of `session`, streaming response to it, once previous turns of `session`
+        are done
+
+        :param str session:
+            Session ID of conversation
+        :param str message:
+            Received message
+        :return:
+            Tuple of two values, first is chunk index, second is chunk value, asynchronously
+            iterable
+        """
+
+        async with self._lock(session):
+            conversation = await self._get(session)
+            # Failed, or stopped, turn is rolled back, so its message is not left without response
+            state = (
+                len(conversation.log),
+                conversation.mode,
+                conversation.partial_log_range,
+            )
+            done = False
+            try:
+                async with contextlib.aclosing(
+                    handle_message_stream(conversation=conversation, message=message)
+                ) as chunks:
+                    async for chunk in chunks:
+                        yield chunk
+                done = True
+            finally:
+                if not done:
+                    # Messages already moved out of window, e.g. by tiny window, are kept
+                    with contextlib.suppress(IndexError):
+                        while len(conversation.log) > state[0]:
+                            conversation.log.pop()
+                    (conversation.mode, conversation.partial_log_range) = state[1:]
+                if self.store is not None:
+                    self.store.save(conversation)
+
+    async def start(self):
+        """
+        Start cache of tags prompts, if modes reachable from `mode` use knowledge, so it is loaded,
+        and watched for changes, before first turn
+        """
+
+        if _uses_knowledge(self.mode):
+            await Config.tags_prompts.start()
+
+    async def aclose(self):
+        """
+        Flush writes of `store`, and close clients of `Config`
+        """
+
+        if self.store is not None:
+            await self.store.aclose()
+        await Config.aclose()
+
+    @contextlib.asynccontextmanager
+    async def _lock(self, session: str, /) -> AsyncIterator[None]:
+        (lock, holders) = self._locks.get(session) or (asyncio.Lock(), 0)
+        self._locks[session] = (lock, holders + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            (lock, holders) = self._locks[session]
+            if holders == 1:
+                del self._locks[session]
+            else:
+                self._locks[session] = (lock, holders - 1)
+
+    async def _get(self, session: str, /) -> "Conversation":
+        conversation = self._conversations.get(session)
+
+        if conversation is None and self.store is not None:
+            conversation = await self.store.load(session)
+
+        if conversation is None:
+            conversation = Conversation(
+                mode=self.mode, session=session, partial_log_range=(0, None)
+            )
+
+        self._conversations.set(session, conversation)
+        return conversation
+
+
+async def _respond(send: Send, status: int, body: bytes, /):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def _uses_knowledge(mode: "Mode", /) -> bool:
+    modes = [mode]
+    seen = {id(mode)}
+    while modes:
+        for option in modes.pop().options:
+            if isinstance(option.side_effect, ModeOptionSideEffectKnowledge):
+                return True
+            if option.target is not None and id(option.target) not in seen:
+                seen.add(id(option.target))
+                modes.append(option.target)
+
+    return False
+
+
+async def _wait_disconnect(receive: Receive, /):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _receive_messages(
+    receive: Receive, messages: "asyncio.Queue[Optional[str]]", /
+):
+    while (event := await receive())["type"] != "websocket.disconnect":
+        if event.get("text") is not None:
+            messages.put_nowait(event["text"])
+
+    messages.put_nowait(None)
@@ -0,0 +1,339 @@
+"""
+Class for ASGI server of conversations sharded by session across worker processes
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import zlib
+from typing import TYPE_CHECKING, AsyncGenerator, Optional
+
+from ._config import Config
+from ._server import ChatServerBase
+
+if TYPE_CHECKING:
+    from multiprocessing.process import BaseProcess
+
+    from ._server import ChatServer
+
+# Frames are header of payload size, turn ID, and frame kind, followed by payload bytes
+_HEADER = struct.Struct("!IIB")
+# Turn payload is size of session, session, and message. Chunk payload is index, and content
+_SIZE = struct.Struct("!I")
+
+(_TURN, _CHUNK, _DONE, _ERROR, _CANCEL) = range(5)
+
+
+class ChatServerSharded(ChatServerBase):
+    """
+    ASGI application serving conversations of many sessions on worker processes, so CPU-bound parts
+    of turns, e.g. tokens counting, and prompts composing, run on multiple cores
+
+    Each session is hashed to one worker, by CRC32 of session ID modulo count of workers, so every
+    turn of a session runs on same worker, with its conversation kept in memory of that worker only,
+    and serialized by that worker as with :class:`ChatServer`. Changing `workers` hashes almost
+    every session to another worker, so conversations are kept across such change only if loaded
+    from store of `server`. Workers are forked from server process, each running copy of
+    `server` on its own event loop, and are sent turns, and stream response chunks back, as
+    length-prefixed binary frames over socket pair, with no pickling. Endpoints are of
+    :class:`ChatServer`. Workers are started once ASGI server starts, or with first turn. Worker
+    that exits, e.g. as killed, is started again, with conversations of its sessions loaded again
+    from store of `server`, if any
+
+    Clients of `Config`, and store of `server`, are created again by each worker on use, so `server`
+    should not be used in server process before workers are started
+
+    :param :class:`ChatServer` server:
+        Server to run copy of on each worker
+    :param Optional[int] workers:
+        Count of worker processes. Default count of CPU cores
+    """
+
+    def __init__(self, server: "ChatServer", /, *, workers: Optional[int] = None):
+        super().__init__(max_message_size=server.max_message_size)
+        self.server = server
+        self.workers = workers or os.cpu_count() or 1
+
+        self._workers: list["_Worker"] = []
+        self._start_lock = asyncio.Lock()
+        self._restarts: set[asyncio.Task] = set()
+
+    async def start(self):
+        """
+        Fork worker processes, if not already started
+        """
+
+        async with self._start_lock:
+            if self._workers:
+                return
+
+            for i in range(self.workers):
+                self._workers.append(await self._spawn(i))
+
+    async def turn(
+        self, session: str, message: str, /
+    ) -> AsyncGenerator[tuple[int, str], None]:
+        """
+        Send message of `session` to its worker, streaming response to it, once previous turns of
+        `session` are done
+
+        :param str session:
+            Session ID of conversation
+        :param str message:
+            Received message
+        :return:
+            Tuple of two values, first is chunk index, second is chunk value, asynchronously
+            iterable
+        """
+
+        if not self._workers:
+            await self.start()
+
+        index = zlib.crc32(session.encode()) % len(self._workers)
+        worker = self._workers[index]
+        if worker.exited:
+            await self._restart(index, worker)
+            worker = self._workers[index]
+
+        async with contextlib.aclosing(worker.turn(session, message)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    async def aclose(self):
+        """
+        Stop worker processes, once their running turns are stopped, and their stores flushed
+        """
+
+        (workers, self._workers) = (self._workers, [])
+        for task in self._restarts:
+            task.cancel()
+        await asyncio.gather(*self._restarts, return_exceptions=True)
+        await asyncio.gather(*(worker.aclose() for worker in workers))
+        await Config.aclose()
+
+    async def _spawn(self, index: int, /) -> "_Worker":
+        (parent_socket, child_socket) = socket.socketpair()
+        process = multiprocessing.get_context("fork").Process(
+            target=_worker_main,
+            args=(
+                self.server,
+                child_socket,
+                [parent_socket, *(worker.socket for worker in self._workers)],
+            ),
+            name=f"chat_chain-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_socket.close()
+
+        (reader, writer) = await asyncio.open_connection(sock=parent_socket)
+        worker = _Worker(process, parent_socket, reader, writer)
+        # Worker exit is detected once its connection is closed, rather than with its next turn
+        worker.reading.add_done_callback(lambda _: self._restart_later(index, worker))
+
+        return worker
+
+    def _restart_later(self, index: int, worker: "_Worker", /):
+        if index < len(self._workers) and self._workers[index] is worker:
+            task = asyncio.create_task(self._restart(index, worker))
+            self._restarts.add(task)
+            task.add_done_callback(self._restarts.discard)
+
+    async def _restart(self, index: int, worker: "_Worker", /):
+        async with self._start_lock:
+            # Worker is restarted once, either once its exit is detected, or by turn of its session
+            if index >= len(self._workers) or self._workers[index] is not worker:
+                return
+
+            worker.writer.close()
+            await asyncio.to_thread(worker.process.join)
+            logging.error(
+                "Worker '%s' exited with code %s, starting it again",
+                worker.process.name,
+                worker.process.exitcode,
+            )
+            self._workers[index] = await self._spawn(index)
+
+
+class _Worker:
+    """
+    Connection of server process to one worker process
+    """
+
+    def __init__(
+        self,
+        process: "BaseProcess",
+        sock: socket.socket,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        /,
+    ):
+        self.process = process
+        self.socket = sock
+        self.writer = writer
+
+        self._turns: dict[int, asyncio.Queue[tuple[int, memoryview]]] = {}
+        self._next_id = 0
+        self.reading = asyncio.create_task(self._read(reader))
+
+    @property
+    def exited(self) -> bool:
+        """
+        Whether worker process exited, or its connection is closed
+        """
+
+        # Process is checked too, as its connection can be closed before it is read
+        return self.reading.done() or not self.process.is_alive()
+
+    async def turn(
+        self, session: str, message: str, /
+    ) -> AsyncGenerator[tuple[int, str], None]:
+        """
+        Send message of `session` to worker, streaming response to it. Turn is cancelled on worker
+        if stream is closed early
+
+        :param str session:
+            Session ID of conversation
+        :param str message:
+            Received message
+        :return:
+            Tuple of two values, first is chunk index, second is chunk value, asynchronously
+            iterable
+        """
+
+        if self.exited:
+            raise RuntimeError(f"Worker '{self.process.name}' exited")
+
+        turn_id = self._next_id
+        self._next_id = (self._next_id + 1) % 2**32
+        queue: asyncio.Queue[tuple[int, memoryview]] = asyncio.Queue()
+        self._turns[turn_id] = queue
+
+        session_bytes = session.encode()
+        _write(
+            self.writer,
+            _TURN,
+            turn_id,
+            _SIZE.pack(len(session_bytes)),
+            session_bytes,
+            message.encode(),
+        )
+
+        kind = _CHUNK
+        try:
+            while True:
+                (kind, payload) = await queue.get()
+                if kind == _CHUNK:
+                    yield (_SIZE.unpack_from(payload)[0], str(payload[4:], "utf-8"))
+                elif kind == _DONE:
+                    return
+                else:
+                    raise RuntimeError(
+                        f"Turn of session '{session}' failed in worker: {str(payload, 'utf-8')}"
+                    )
+        finally:
+            del self._turns[turn_id]
+            # Turn is stopped on worker too if closed early, e.g. as client disconnected
+            if kind == _CHUNK and not self.writer.is_closing():
+                _write(self.writer, _CANCEL, turn_id)
+
+    async def aclose(self):
+        """
+        Stop worker process, once its running turns are stopped, and its server is closed
+        """
+
+        # Closing connection makes worker stop its turns, and exit
+        self.writer.close()
+        await self.reading
+        await asyncio.to_thread(self.process.join)
+
+    async def _read(self, reader: asyncio.StreamReader, /):
+        try:
+            while True:
+                (size, turn_id, kind) = _HEADER.unpack(
+                    await reader.readexactly(_HEADER.size)
+                )
+                payload = memoryview(await reader.readexactly(size))
+                queue = self._turns.get(turn_id)
+                if queue is not None:
+                    queue.put_nowait((kind, payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        if self._turns:
+            logging.error("Worker '%s' exited with turns running", self.process.name)
+        for queue in self._turns.values():
+            queue.put_nowait((_ERROR, memoryview(b"WorkerExited")))
+
+
+def _forget(turns: dict[int, asyncio.Task], turn_id: int, _: asyncio.Task, /):
+    turns.pop(turn_id, None)
+
+
+def _write(writer: asyncio.StreamWriter, kind: int, turn_id: int, /, *payload: bytes):
+    writer.writelines((_HEADER.pack(sum(map(len, payload)), turn_id, kind), *payload))
+
+
+def _worker_main(
+    server: "ChatServer", sock: socket.socket, parent_sockets: list[socket.socket], /
+):
+    # Ends of server process are closed, so worker gets EOF once server process closes its end.
+    # Signals are handled by server process, which stops workers by closing connections to them
+    for parent_socket in parent_sockets:
+        parent_socket.close()
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    asyncio.run(_worker_serve(server, sock))
+
+
+async def _worker_serve(server: "ChatServer", sock: socket.socket, /):
+    (reader, writer) = await asyncio.open_connection(sock=sock)
+    await server.start()
+    turns: dict[int, asyncio.Task] = {}
+
+    async def _turn(turn_id: int, session: str, message: str):
+        try:
+            async with contextlib.aclosing(server.turn(session, message)) as chunks:
+                async for (index, content) in chunks:
+                    _write(writer, _CHUNK, turn_id, _SIZE.pack(index), content.encode())
+                    await writer.drain()
+            _write(writer, _DONE, turn_id)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:  # pylint: disable=broad-except
+            logging.exception("Turn of session '%s' failed", session)
+            _write(writer, _ERROR, turn_id, type(e).__name__.encode())
+
+    try:
+        while True:
+            (size, turn_id, kind) = _HEADER.unpack(
+                await reader.readexactly(_HEADER.size)
+            )
+            payload = memoryview(await reader.readexactly(size))
+
+            if kind == _TURN:
+                session_size = _SIZE.unpack_from(payload)[0]
+                session = str(payload[4 : 4 + session_size], "utf-8")
+                message = str(payload[4 + session_size :], "utf-8")
+                task = asyncio.create_task(_turn(turn_id, session, message))
+                # Task cancelled before it starts never runs, so it is removed once done instead
+                task.add_done_callback(functools.partial(_forget, turns, turn_id))
+                turns[turn_id] = task
+            elif kind == _CANCEL and turn_id in turns:
+                turns[turn_id].cancel()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+    for task in list(turns.values()):
+        task.cancel()
+    await asyncio.gather(*turns.values(), return_exceptions=True)
+    await server.aclose()
+    writer.close()
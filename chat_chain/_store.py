@@ -0,0 +1,306 @@
+"""
+Class for persisting conversations in MongoDB
+"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Any, Callable, Mapping, Optional
+
+from pymongo import UpdateOne
+
+from ._cache import LRUCache
+from ._chain import Conversation
+from ._config import Config
+from ._log import ConversationLog
+
+if TYPE_CHECKING:
+    from typing import Iterable
+
+    from ._chain import Message, Mode
+
+
+def _log_expression(
+    write: dict[str, Any], /, max_messages: Optional[int] = None
+) -> dict[str, Any]:
+    log: dict[str, Any] = {"$literal": write["messages"]}
+
+    if write["start"]:
+        # Truncate log to position of write, then append messages. Stored log can be capped, so
+        # position of its first message is stored log length less count of its messages
+        stored = {"$ifNull": ["$log", []]}
+        log = {
+            "$concatArrays": [
+                {
+                    "$slice": [
+                        stored,
+                        {
+                            "$max": [
+                                0,
+                                {
+                                    "$subtract": [
+                                        write["start"],
+                                        {
+                                            "$subtract": [
+                                                {"$ifNull": ["$log_length", 0]},
+                                                {"$size": stored},
+                                            ]
+                                        },
+                                    ]
+                                },
+                            ]
+                        },
+                    ]
+                },
+                log,
+            ]
+        }
+
+    if max_messages is not None:
+        # Keep latest messages only, so document stays within MongoDB document size limit
+        log = {"$slice": [log, -max_messages]}
+
+    return log
+
+
+class ConversationStore:  # pylint: disable=too-many-instance-attributes
+    """
+    Repository of conversations in MongoDB collection of `Config.mongodb`, with write-behind
+    batching of writes
+
+    Conversations are stored by `session` as documents with current mode name, partial log range,
+    log length, and log of messages. Only messages appended since last save are written, at their
+    position in log, so writes are idempotent. Messages leaving window of log before they are
+    saved are kept by store until next save, once store loads, or saves conversation. Saving a
+    conversation only queues its write, which is flushed in batch after `flush_interval`, or once
+    `batch_size` conversations are queued. Loading a conversation flushes its queued writes first,
+    and waits for flush in progress, so process reads its own writes. Stored log is capped to
+    `max_log_messages` latest messages
+
+    :param Mapping[str,:class:`Mode`]|Iterable[:class:`Mode`] modes:
+        Modes to rehydrate conversations with, by name, e.g. :class:`ModeGraph`
+    :param str collection:
+        Name of collection to store conversations in. Default `conversations`
+    :param int batch_size:
+        Count of queued conversations writes to flush at. Default `100`
+    :param float flush_interval:
+        Max seconds a write stays queued before flush. Default `0.5`
+    :param Optional[int] max_log_messages:
+        Max count of latest messages kept in stored log, so documents stay within MongoDB document
+        size limit. `None` to keep all messages. Default `1000`
+    """
+
+    def __init__(
+        self,
+        *,
+        modes: "Mapping[str, Mode] | Iterable[Mode]",
+        collection: str = "conversations",
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        max_log_messages: Optional[int] = 1000,
+    ):
+        self.modes: Mapping[str, "Mode"] = (
+            modes if isinstance(modes, Mapping) else {mode.name: mode for mode in modes}
+        )
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_log_messages = max_log_messages
+
+        # Log length persisted per session. If unknown, e.g. evicted, all messages in window of log
+        # are written again, which is safe as writes are by position
+        self._persisted: LRUCache[str, int] = LRUCache(max_size=100_000)
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set[asyncio.Task] = set()
+
+    async def load(self, session: str, /) -> Optional["Conversation"]:
+        """
+        Load conversation of `session`, with window of latest messages of its log
+
+        :param str session:
+            Session ID of conversation
+        :return:
+            :class:`Conversation` object, or `None` if no conversation is stored for `session`
+        """
+
+        # Flush in progress could be writing conversation already, out of queued writes
+        if session in self._pending or self._flush_lock.locked():
+            await self.flush()
+
+        max_messages = Config.consts.conversation_max_messages
+        doc = await Config.mongodb[self.collection].find_one(
+            {"_id": session},
+            {"log": {"$slice": -max_messages}} if max_messages else None,
+        )
+
+        if not doc:
+            # Conversation of session is new, so all its messages are to be written
+            self._persisted.set(session, 0)
+            return None
+
+        log = doc.get("log", [])
+        self._persisted.set(session, doc["log_length"])
+
+        return Conversation(
+            mode=self.modes[doc["mode"]],
+            session=session,
+            log=ConversationLog(
+                log,
+                offset=doc["log_length"] - len(log),
+                max_messages=max_messages,
+                max_tokens=Config.consts.conversation_max_tokens,
+                on_archive=_Unsaved(None),
+            ),
+            partial_log_range=tuple(doc["partial_log_range"]),  # type: ignore
+        )
+
+    def save(self, conversation: "Conversation", /):
+        """
+        Queue write of `conversation` state and messages appended to its log since last save.
+        Write is flushed in background
+
+        :param :class:`Conversation` conversation:
+            Conversation to save
+        """
+
+        session = conversation.session
+        log = conversation.log
+
+        unsaved = (
+            log.on_archive
+            if isinstance(log.on_archive, _Unsaved)
+            else _Unsaved(log.on_archive)
+        )
+        log.on_archive = unsaved
+        (archived, unsaved.messages) = (unsaved.messages, [])
+        # Position of first message kept, either archived since last save, or in window of log
+        start = log.offset - len(archived)
+
+        persisted = self._persisted.get(session)
+        if persisted is None:
+            # Unknown, e.g. evicted, so messages kept are all written again, which is safe as writes
+            # are by position
+            persisted = start
+        elif persisted < start:
+            raise ValueError(
+                f"Messages of conversation '{session}' from '{persisted}' to '{start}' left window"
+                " of its log before they were saved"
+            )
+
+        self._queue(
+            session,
+            {
+                "start": persisted,
+                "messages": archived[persisted - start :] + log[persisted:],
+                "state": {
+                    "mode": conversation.mode.name,
+                    "partial_log_range": list(conversation.partial_log_range),
+                    "log_length": len(conversation.log),
+                },
+            },
+        )
+
+        self._persisted.set(session, len(conversation.log))
+
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, self._schedule_flush
+            )
+
+    async def flush(self):
+        """
+        Write all queued conversations writes in one batch
+        """
+
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            (pending, self._pending) = (self._pending, {})
+
+            try:
+                await Config.mongodb[self.collection].bulk_write(
+                    [
+                        UpdateOne(
+                            {"_id": session},
+                            [
+                                {
+                                    "$set": {
+                                        **write["state"],
+                                        "log": _log_expression(
+                                            write, self.max_log_messages
+                                        ),
+                                    }
+                                }
+                            ],
+                            upsert=True,
+                        )
+                        for (session, write) in pending.items()
+                    ],
+                    ordered=False,
+                )
+            except Exception:
+                # Queue failed writes again, ahead of writes queued since
+                (newer, self._pending) = (self._pending, pending)
+                for (session, write) in newer.items():
+                    self._queue(session, write)
+                raise
+
+    async def aclose(self):
+        """
+        Flush queued writes, and wait for background flushes to finish
+        """
+
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+
+    def _queue(self, session: str, write: dict[str, Any], /):
+        queued = self._pending.get(session)
+
+        if queued and write["start"] >= queued["start"]:
+            write["messages"] = (
+                queued["messages"][: write["start"] - queued["start"]]
+                + write["messages"]
+            )
+            write["start"] = queued["start"]
+
+        self._pending[session] = write
+
+    def _schedule_flush(self):
+        flush = asyncio.ensure_future(self.flush())
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flush_done)
+
+    def _flush_done(self, flush: asyncio.Task, /):
+        self._flushes.discard(flush)
+        if not flush.cancelled() and flush.exception():
+            logging.warning(
+                "Failed to flush conversations writes, retrying: %s", flush.exception()
+            )
+            if self._pending and self._flush_timer is None:
+                self._flush_timer = asyncio.get_running_loop().call_later(
+                    self.flush_interval, self._schedule_flush
+                )
+
+
+class _Unsaved:  # pylint: disable=too-few-public-methods
+    """
+    Callback of conversation log, keeping messages leaving its window until conversation is
+    saved, and passing them to callback log had before, if any
+    """
+
+    def __init__(self, on_archive: Optional[Callable[[list["Message"]], None]], /):
+        self.on_archive = on_archive
+        self.messages: list["Message"] = []
+
+    def __call__(self, messages: list["Message"], /):
+        self.messages += messages
+        if self.on_archive:
+            self.on_archive(messages)
@@ -0,0 +1,83 @@
+"""
+Class for compiled prompt templates of modes
+"""
+
+import re
+from typing import Sequence
+
+from ._gpt import num_tokens_from_text
+
+
+class PromptTemplate:
+    """
+    Class to represent prompt compiled once into static segments, and named slots between them
+
+    Slots are slot names in braces, e.g. `{message}`. Only names in `slots` are slots, so other
+    braces, e.g. of JSON examples, are kept as is. Prompt is rendered in one pass, so values are
+    never scanned for slots, e.g. message with `{conversation}` in it is inserted as is
+
+    :param str template:
+        Prompt with slots
+    :param Sequence[str] slots:
+        Names of slots. Default `message`, and `conversation`
+    """
+
+    SLOTS = ("message", "conversation")
+
+    def __init__(self, template: str, /, *, slots: Sequence[str] = SLOTS):
+        self.template = template
+
+        parts = re.split(
+            "{(" + "|".join(re.escape(slot) for slot in slots) + ")}", template
+        )
+        # Parts alternate between static segments, and slots names, starting and ending with static
+        # segments, which can be empty
+        self.segments: tuple[str, ...] = tuple(parts[::2])
+        self.slots: tuple[str, ...] = tuple(parts[1::2])
+
+        self._segments_tokens: dict[str, int] = {}
+
+    def __repr__(self) -> str:
+        return f"PromptTemplate({self.template!r})"
+
+    def render(self, **values: str) -> str:
+        """
+        Render prompt with values of slots
+
+        :param str values:
+            Values of slots, by slot name. Slots without value are rendered empty
+        :return:
+            Rendered prompt
+        """
+
+        parts = [self.segments[0]]
+        for (slot, segment) in zip(self.slots, self.segments[1:]):
+            parts.append(values.get(slot, ""))
+            parts.append(segment)
+
+        return "".join(parts)
+
+    def num_tokens(self, *, model: str, **values: str) -> int:
+        """
+        Count tokens of rendered prompt, with tokens of static segments counted once per model, so
+        only values are encoded. Count can differ from tokens of rendered prompt by few tokens, as
+        tokens can span boundaries of segments and values
+
+        :param str model:
+            Name of model to use its encoding
+        :param str values:
+            Values of slots, by slot name
+        :return:
+            Tokens count
+        """
+
+        if model not in self._segments_tokens:
+            self._segments_tokens[model] = sum(
+                num_tokens_from_text(segment, model=model) for segment in self.segments
+            )
+
+        # Values, e.g. transcripts, differ every render, so their counts are not memoized
+        return self._segments_tokens[model] + sum(
+            num_tokens_from_text(values.get(slot, ""), model=model, memoize=False)
+            for slot in self.slots
+        )
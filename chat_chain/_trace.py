@@ -0,0 +1,389 @@
+"""
+Classes and definitions for per-stage latency instrumentation of chain
+"""
+
+import bisect
+import contextlib
+import contextvars
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import (TYPE_CHECKING, Any, ContextManager, Iterator, Optional,
+                    Sequence)
+
+from ._config import Config
+
+if TYPE_CHECKING:
+    from opentelemetry.trace import Tracer as OpenTelemetryTracer
+
+
+class Span:
+    """
+    Class to represent one timed stage of chain, e.g. one model call, with its attributes
+
+    Spans are created with :func:`span`, and are passed to `Config.tracer` exporters once started,
+    and once ended. Attributes of spans of chain are:
+
+    - `tokens_in`: Tokens sent to AI model
+    - `tokens_out`: Tokens, or stream chunks, received from AI model
+    - `cache_hit`: Whether result was served from cache
+    - `first_chunk`: Seconds until first chunk of stream
+    - `mode`: Name of :class:`Mode` of message
+    - `option`: Index of :class:`ModeOption` chosen for message, or `none`
+    - `collection`: Name of QDrant collection searched
+    - `error`: Name of exception type, if stage failed
+
+    :param str name:
+        Name of stage
+    :param dict[str,Any] attributes:
+        Attributes of span, set on creation, or with :meth:`set`
+    :param float start:
+        Time span started, as of :func:`time.perf_counter`
+    :param float duration:
+        Seconds span lasted, set once ended
+    :param Optional[Span] parent:
+        Span that was current when span started
+    """
+
+    __slots__ = ("name", "attributes", "start", "duration", "parent", "_token")
+
+    recording = True
+
+    def __init__(self, name: str, attributes: dict[str, Any], /):
+        self.name = name
+        self.attributes = attributes
+        self.start = 0.0
+        self.duration = 0.0
+        self.parent: Optional["Span"] = None
+        self._token: Optional[contextvars.Token] = None
+
+    def set(self, **attributes: Any):
+        """
+        Set attributes of span
+        """
+
+        self.attributes.update(attributes)
+
+    @contextlib.contextmanager
+    def detached(self) -> Iterator[None]:
+        """
+        Make span that was current when span started current again, e.g. while async generator
+        of span is suspended at `yield`, so spans of its caller are not nested in span
+
+        :return:
+            Context manager, making span current again on exit
+        """
+
+        _current_span.set(self.parent)
+        try:
+            yield
+        finally:
+            _current_span.set(self)
+
+    def __enter__(self) -> "Span":
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+
+        for exporter in Config.tracer.exporters:  # type: ignore
+            exporter.start(self)
+
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.duration = time.perf_counter() - self.start
+
+        # Async generators closed early by caller exit with `GeneratorExit`, which is not an error
+        if error_type is not None and not issubclass(error_type, GeneratorExit):
+            self.attributes["error"] = error_type.__name__
+
+        try:
+            _current_span.reset(self._token)  # type: ignore
+        except ValueError:
+            # Span of async generator closed from another context, e.g. by garbage collector
+            pass
+
+        for exporter in Config.tracer.exporters:  # type: ignore
+            exporter.end(self)
+
+
+class _SpanNoop:
+    """
+    Span returned by :func:`span` if tracing is disabled, doing nothing
+    """
+
+    __slots__ = ()
+
+    recording = False
+    start = 0.0
+
+    def set(self, **attributes: Any):
+        """
+        Set nothing
+        """
+
+    def detached(self) -> ContextManager[None]:
+        """
+        Do nothing
+
+        :return:
+            Context manager doing nothing
+        """
+
+        return _NULL_CONTEXT
+
+    def __enter__(self) -> "_SpanNoop":
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        pass
+
+
+_SPAN_NOOP = _SpanNoop()
+_NULL_CONTEXT = contextlib.nullcontext()
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "_current_span", default=None
+)
+
+
+def span(name: str, /, **attributes: Any) -> "Span | _SpanNoop":
+    """
+    Create span of stage of chain, to be used as context manager
+
+    If `Config.tracer` is not set, a shared span doing nothing is returned, so instrumentation
+    costs one function call. Attributes costly to compute should be set only if span `recording`
+    is truthy
+
+    :param str name:
+        Name of stage
+    :param Any attributes:
+        Attributes of span
+    :return:
+        :class:`Span` object
+    """
+
+    if Config.tracer is None:
+        return _SPAN_NOOP
+
+    return Span(name, attributes)
+
+
+class Tracer:  # pylint: disable=too-few-public-methods
+    """
+    Class to collect spans of chain into exporters. Tracing is enabled by setting
+    `Config.tracer`
+
+    :param Sequence[SpanExporter] exporters:
+        Exporters to pass spans to
+    """
+
+    def __init__(self, *, exporters: Sequence["SpanExporter"]):
+        self.exporters = tuple(exporters)
+
+
+class SpanExporter(ABC):
+    """
+    Abstract class of exporter of spans
+    """
+
+    def start(self, span: "Span", /):  # pylint: disable=redefined-outer-name
+        """
+        Handle started span. Default does nothing
+
+        :param :class:`Span` span:
+            Started span
+        """
+
+    @abstractmethod
+    def end(self, span: "Span", /):  # pylint: disable=redefined-outer-name
+        """
+        Handle ended span
+
+        :param :class:`Span` span:
+            Ended span
+        """
+
+
+class SpanExporterHistogram(SpanExporter):
+    """
+    Exporter of spans to in-memory latency histogram per stage, with totals of numeric attributes,
+    and counts of other attributes values
+
+    :param Sequence[float] buckets:
+        Upper bounds of histogram buckets, in seconds
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, *, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts: dict[str, list[int]] = {}
+        self.sums: dict[str, float] = {}
+        self.totals: dict[str, dict[str, float]] = {}
+        self.values: dict[str, Counter[tuple[str, str]]] = {}
+
+    def end(self, span: "Span", /):  # pylint: disable=redefined-outer-name
+        if span.name not in self.counts:
+            self.counts[span.name] = [0] * (len(self.buckets) + 1)
+            self.sums[span.name] = 0.0
+            self.totals[span.name] = {}
+            self.values[span.name] = Counter()
+
+        self.counts[span.name][bisect.bisect_left(self.buckets, span.duration)] += 1
+        self.sums[span.name] += span.duration
+
+        for (key, value) in span.attributes.items():
+            if isinstance(value, (int, float)):
+                totals = self.totals[span.name]
+                totals[key] = totals.get(key, 0) + value
+            else:
+                self.values[span.name][(key, str(value))] += 1
+
+    def percentile(self, name: str, percentile: float, /) -> Optional[float]:
+        """
+        Estimate latency percentile of stage, as upper bound of bucket it falls in
+
+        :param str name:
+            Name of stage
+        :param float percentile:
+            Percentile, from `0` to `100`
+        :return:
+            Seconds, `inf` if beyond last bucket, or `None` if stage has no spans
+        """
+
+        counts = self.counts.get(name)
+        if not counts or not sum(counts):
+            return None
+
+        rank = sum(counts) * percentile / 100
+        seen = 0
+        for (bound, count) in zip((*self.buckets, float("inf")), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return float("inf")  # pragma: no cover
+
+    def summary(self) -> dict[str, dict[str, Any]]:
+        """
+        Summarise spans per stage
+
+        :return:
+            Dict of stage name to dict of `count`, `mean`, `p50`, and `p99` latencies, and totals of
+            numeric attributes
+        """
+
+        return {
+            name: {
+                "count": sum(counts),
+                "mean": self.sums[name] / sum(counts),
+                "p50": self.percentile(name, 50),
+                "p99": self.percentile(name, 99),
+                **self.totals[name],
+            }
+            for (name, counts) in self.counts.items()
+        }
+
+
+class SpanExporterPrometheus(SpanExporterHistogram):
+    """
+    Exporter of spans to in-memory histogram, rendered in Prometheus text exposition format, e.g.
+    to be served from metrics endpoint
+
+    :param str prefix:
+        Prefix of metrics names. Default `chat_chain`
+    :param Sequence[float] buckets:
+        Upper bounds of histogram buckets, in seconds
+    """
+
+    def __init__(
+        self,
+        *,
+        prefix: str = "chat_chain",
+        buckets: Sequence[float] = SpanExporterHistogram.BUCKETS,
+    ):
+        super().__init__(buckets=buckets)
+        self.prefix = prefix
+
+    def render(self) -> str:
+        """
+        Render metrics in Prometheus text exposition format
+
+        :return:
+            Metrics text
+        """
+
+        metric = f"{self.prefix}_span_duration_seconds"
+        lines = [
+            f"# HELP {metric} Duration of chain stages",
+            f"# TYPE {metric} histogram",
+        ]
+
+        for (name, counts) in self.counts.items():
+            cumulative = 0
+            for (bound, count) in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{metric}_bucket{{span="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {self.sums[name]}')
+            lines.append(f'{metric}_count{{span="{name}"}} {cumulative}')
+
+        for key in sorted({key for totals in self.totals.values() for key in totals}):
+            metric = f"{self.prefix}_span_{key}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (name, totals) in self.totals.items():
+                if key in totals:
+                    lines.append(f'{metric}{{span="{name}"}} {totals[key]}')
+
+        metric = f"{self.prefix}_span_attribute_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (name, values) in self.values.items():
+            for ((key, value), count) in values.items():
+                value = value.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(
+                    f'{metric}{{span="{name}",attribute="{key}",value="{value}"}} {count}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+class SpanExporterOpenTelemetry(SpanExporter):
+    """
+    Exporter of spans to OpenTelemetry, as spans of `opentelemetry` tracer, nested as spans of
+    chain. Requires `opentelemetry-api` package
+
+    :param Optional[opentelemetry.trace.Tracer] tracer:
+        OpenTelemetry tracer to create spans with. Default tracer of global tracer provider
+    """
+
+    def __init__(self, *, tracer: Optional["OpenTelemetryTracer"] = None):
+        # pylint: disable=import-outside-toplevel,import-error
+        from opentelemetry import trace
+
+        self.tracer = tracer or trace.get_tracer("chat_chain")
+        self._spans: dict[int, Any] = {}
+
+    def start(self, span: "Span", /):  # pylint: disable=redefined-outer-name
+        # pylint: disable=import-outside-toplevel,import-error
+        from opentelemetry import trace
+
+        parent = self._spans.get(id(span.parent)) if span.parent else None
+        self._spans[id(span)] = self.tracer.start_span(
+            span.name,
+            context=trace.set_span_in_context(parent) if parent else None,
+            attributes=span.attributes,
+        )
+
+    def end(self, span: "Span", /):  # pylint: disable=redefined-outer-name
+        # pylint: disable=import-outside-toplevel,import-error
+        from opentelemetry.trace import Status, StatusCode
+
+        otel_span = self._spans.pop(id(span), None)
+        if otel_span is None:
+            return
+
+        otel_span.set_attributes(span.attributes)
+        if "error" in span.attributes:
+            otel_span.set_status(Status(StatusCode.ERROR, span.attributes["error"]))
+        otel_span.end()
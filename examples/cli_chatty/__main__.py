@@ -5,31 +5,12 @@ Chatty executable functions
 import asyncio
 import logging
 import os
-from typing import AsyncIterable
 
 import dotenv
 import openai
-from chat_chain import (Config, Conversation, get_response_chunks,
-                        handle_message)
-
 from _modes import lobby
 
-async def _process_conversation_message(
-    *, conversation: "Conversation", message: str
-) -> AsyncIterable[tuple[int, str]]:
-    messages, response_tokens_limit = await handle_message(
-        conversation=conversation, message=message
-    )
-
-    response = ""
-
-    async for chunk in get_response_chunks(
-        messages=messages, response_tokens_limit=response_tokens_limit
-    ):
-        yield chunk
-        response += chunk[1]
-
-    conversation.log.append({"role": "assistant", "content": response})
+from chat_chain import Config, Conversation, handle_message_stream
 
 
 async def answer_message(conversation, message, /):
@@ -38,7 +19,7 @@ async def answer_message(conversation, message, /):
     """
 
     print("AI: ", end="", flush=True)
-    async for chunk in _process_conversation_message(
+    async for chunk in handle_message_stream(
         conversation=conversation, message=message
     ):
         print(chunk[1], end="", flush=True)
@@ -65,18 +46,30 @@ def main():
         " team."
     )
 
+    asyncio.run(chat())
+
+
+async def chat():
+    """
+    Chatty conversation loop, on one event loop, so clients of `Config` are reused across turns
+    """
+
     conversation = Conversation(
-        mode=lobby, session="session", log=[], partial_log_range=(0, None)
+        mode=lobby, session="session", partial_log_range=(0, None)
     )
 
     # Conversation starter
     print("> Who are you?")
-    asyncio.run(answer_message(conversation, "Who are you?"))
-
-    # Conversation loop
-    while True:
-        message = input("> ")
-        asyncio.run(answer_message(conversation, message))
+    await answer_message(conversation, "Who are you?")
+
+    # Conversation loop, reading input without blocking event loop
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            message = await loop.run_in_executor(None, input, "> ")
+            await answer_message(conversation, message)
+    finally:
+        await Config.aclose()
 
 
 if __name__ == "__main__":
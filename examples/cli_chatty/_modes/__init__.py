@@ -2,6 +2,12 @@
 Chatty modes
 """
 
+from chat_chain import ModeGraph
+
+from ._comment_confirm import comment_confirm
+from ._comment_details import comment_details
 from ._lobby import lobby
 
-__all__ = ["lobby"]
+modes = ModeGraph([lobby, comment_details, comment_confirm])
+
+__all__ = ["lobby", "modes"]
@@ -2,51 +2,36 @@
 Request confirm mode
 """
 
-import json
 import logging
 from typing import TYPE_CHECKING
 
 from chat_chain import (Config, Mode, ModeOption,
-                        ModeOptionSideEffectTransaction)
+                        ModeOptionSideEffectTransaction, ResponseParserJSON)
 
 if TYPE_CHECKING:
     from chat_chain import Conversation, Message
 
 
-def _load_details_json(response: str) -> dict:
-    try:
-        j = json.loads(response)
-    except Exception:  # pylint: disable=broad-except
-        j = {"name": None, "email": None, "comment": None, "confirm": False}
-
-    return j
-
-
 async def _comment_confirm_handle_confirm(
-    conversation: "Conversation", message: str, response: str
+    conversation: "Conversation", message: str, response: dict
 ) -> list["Message"]:
     # pylint: disable=unused-argument
-    # pylint: disable=import-outside-toplevel
-
-    from ._lobby import lobby
-
-    j = _load_details_json(response)
 
     ref = "123"
     # Uncomment for live transaction
-    # result = await Config.mongoddb.comments.insert_one(j)
+    # result = await Config.mongoddb.comments.insert_one(response)
     # ref = result.inserted_id
 
     logging.debug("Changing mode to 'lobby' as user confirmed details")
-    # Return user to lobby mode and reset partial_log_range
+    # Reset partial_log_range, as user returns to lobby mode
     conversation.partial_log_range = (len(conversation.log) - 1, None)
-    conversation.mode = lobby
 
     return [
         {
             "role": "system",
             "content": (
-                f"You are a chat bot assisting {j['name']} register a comment for Chatty team."
+                f"You are a chat bot assisting {response['name']} register a comment for Chatty"
+                " team."
                 " Thank user and inform him request has been received and that Masaar team would"
                 f" contact him shortly. Also infor user the reference for request is {ref}."
                 " Also inform user you are ready to receive his questions about what you know."
@@ -57,19 +42,20 @@ async def _comment_confirm_handle_confirm(
 
 
 async def _comment_confirm_handle_cancel(
-    conversation: "Conversation", message: str, response: str
+    conversation: "Conversation", message: str, response: dict
 ) -> list["Message"]:
     # pylint: disable=unused-argument
-    # pylint: disable=import-outside-toplevel
-
-    from ._lobby import lobby
 
     logging.debug(
         "Changing mode to 'lobby' as user cancelled process to register a comment"
     )
-    # Return user to lobby mode and reset partial_log_range
+    # Reset partial_log_range, as user returns to lobby mode
     conversation.partial_log_range = (len(conversation.log) - 1, None)
-    conversation.mode = lobby
+
+    # Window of log may have moved past first message of range
+    first_message = conversation.log[
+        max(conversation.partial_log_range[0], conversation.log.offset)
+    ]
 
     return [
         {
@@ -80,7 +66,7 @@ async def _comment_confirm_handle_cancel(
                 " cancelled and user can start asking again about information on Muslims and"
                 " Arabs contributions to science and knowledge, past and modern."
                 " Reply in the same language as following sentence:"
-                f" '{conversation.log[conversation.partial_log_range[0]]['content']}'"
+                f" '{first_message['content']}'"
             ),
         }
     ]
@@ -97,18 +83,23 @@ comment_confirm = Mode(
         " If any values are missing set the value in json format to null."
         " The conversion is:\n{conversation}"
     ),
+    parser=ResponseParserJSON(
+        default={"name": None, "email": None, "comment": None, "confirm": False}
+    ),
     options=[
         ModeOption(
-            condition=lambda response: not _load_details_json(response)["confirm"],
+            condition=lambda response: not response.get("confirm"),
             side_effect=ModeOptionSideEffectTransaction(
                 transaction=_comment_confirm_handle_cancel
             ),
+            transition="lobby",
         ),
         ModeOption(
-            condition=lambda response: _load_details_json(response)["confirm"],
+            condition=lambda response: response.get("confirm"),
             side_effect=ModeOptionSideEffectTransaction(
                 transaction=_comment_confirm_handle_confirm
             ),
+            transition="lobby",
         ),
     ],
 )
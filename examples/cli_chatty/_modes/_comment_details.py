@@ -2,39 +2,31 @@
 Request details mode
 """
 
-import json
 import logging
 from typing import TYPE_CHECKING
 
-from chat_chain import Mode, ModeOption, ModeOptionSideEffectTransaction
+from chat_chain import (Mode, ModeOption, ModeOptionSideEffectTransaction,
+                        ResponseParserJSON)
 
 if TYPE_CHECKING:
     from chat_chain import Conversation, Message
 
 
-def _load_details_json(response: str) -> dict:
-    try:
-        j = json.loads(response)
-    except Exception:  # pylint: disable=broad-except
-        j = {"name": None, "email": None, "comment": None}
-
-    return j
-
-
 async def _comment_details_handle_cancel(
-    conversation: "Conversation", message: str, response: str
+    conversation: "Conversation", message: str, response: dict
 ) -> list["Message"]:
     # pylint: disable=unused-argument
-    # pylint: disable=import-outside-toplevel
-
-    from ._lobby import lobby
 
     logging.debug(
         "Changing mode to 'lobby' as user cancelled process to register a comment"
     )
-    # Return user to lobby mode and reset partial_log_range
+    # Reset partial_log_range, as user returns to lobby mode
     conversation.partial_log_range = (len(conversation.log) - 1, None)
-    conversation.mode = lobby
+
+    # Window of log may have moved past first message of range
+    first_message = conversation.log[
+        max(conversation.partial_log_range[0], conversation.log.offset)
+    ]
 
     return [
         {
@@ -45,52 +37,49 @@ async def _comment_details_handle_cancel(
                 " cancelled and user can start asking again about information on Muslims and"
                 " Arabs contributions to science and knowledge, past and modern."
                 " Reply in the same language as following sentence:"
-                f" '{conversation.log[conversation.partial_log_range[0]]['content']}'"
+                f" '{first_message['content']}'"
             ),
         }
     ]
 
 
 async def _comment_details_handle_missing(
-    conversation: "Conversation", message: str, response: str
+    conversation: "Conversation", message: str, response: dict
 ) -> list["Message"]:
     # pylint: disable=unused-argument
 
-    j = _load_details_json(response)
+    # Window of log may have moved past first message of range
+    first_message = conversation.log[
+        max(conversation.partial_log_range[0], conversation.log.offset)
+    ]
 
     return [
         {
             "role": "system",
             "content": (
                 "You are a chat bot assisting a user registering a comment. Extract values from"
-                f" following JSON '{j}', iterate it to user and request missing values."
+                f" following JSON '{response}', iterate it to user and request missing values."
                 " Reply in the same language as following sentence:"
-                f" '{conversation.log[conversation.partial_log_range[0]]['content']}'"
+                f" '{first_message['content']}'"
             ),
         }
     ]
 
 
 async def _comment_details_handle_completed(
-    conversation: "Conversation", message: str, response: str
+    conversation: "Conversation", message: str, response: dict
 ) -> list["Message"]:
     # pylint: disable=unused-argument
-    # pylint: disable=import-outside-toplevel
-
-    from ._comment_confirm import comment_confirm
-
-    j = _load_details_json(response)
 
     logging.debug("Changing mode to 'comment_confirm' as user provided all details")
-    # Change conversation mode to comment_confirm
-    conversation.mode = comment_confirm
 
     return [
         {
             "role": "system",
             "content": (
-                f"You are a chat bot assisting {j['name']} registering a comment. User has provided"
-                " all required details which are 'name', 'email', 'comment'. Display the details to"
+                f"You are a chat bot assisting {response['name']} registering a comment. User has"
+                " provided all required details which are 'name', 'email', 'comment'. Display the"
+                " details to"
                 " user and request his confirmation on the details before finally registering the"
                 " comment in the system."
                 f" Reply in the same language as following sentence: {message}"
@@ -110,26 +99,27 @@ comment_details = Mode(
         " If any values are missing set the value in json format to null."
         " The conversion is:\n{conversation}"
     ),
+    parser=ResponseParserJSON(default={"name": None, "email": None, "comment": None}),
     options=[
         ModeOption(
-            condition=lambda response: "cancel" in _load_details_json(response),
+            condition=lambda response: "cancel" in response,
             side_effect=ModeOptionSideEffectTransaction(
                 transaction=_comment_details_handle_cancel
             ),
+            transition="lobby",
         ),
         ModeOption(
-            condition=lambda response: any(
-                v is None for v in _load_details_json(response).values()
-            ),
+            condition=lambda response: any(v is None for v in response.values()),
             side_effect=ModeOptionSideEffectTransaction(
                 transaction=_comment_details_handle_missing
             ),
         ),
         ModeOption(
-            condition=lambda response: all(_load_details_json(response).values()),
+            condition=lambda response: all(response.values()),
             side_effect=ModeOptionSideEffectTransaction(
                 transaction=_comment_details_handle_completed
             ),
+            transition="comment_confirm",
         ),
     ],
 )
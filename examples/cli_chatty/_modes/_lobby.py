@@ -5,22 +5,18 @@ Lobby mode definition
 from typing import TYPE_CHECKING
 
 from chat_chain import (Mode, ModeOption, ModeOptionSideEffectKnowledge,
-                        ModeOptionSideEffectTransaction)
+                        ModeOptionSideEffectTransaction, ResponseParserInt)
 
 if TYPE_CHECKING:
     from chat_chain import Conversation, Message
 
 
 async def _lobby_handle_request(
-    conversation: "Conversation", message: str, response: str
+    conversation: "Conversation", message: str, response: int
 ) -> list["Message"]:
     # pylint: disable=unused-argument
-    # pylint: disable=import-outside-toplevel
-
-    from ._comment_details import comment_details
 
     conversation.partial_log_range = (len(conversation.log) - 1, None)
-    conversation.mode = comment_details
 
     return [
         {
@@ -45,16 +41,19 @@ lobby = Mode(
         " 0. If sentence for anything else."
         " The sentence is: {message}"
     ),
+    parser=ResponseParserInt(max_digits=1),
     options=[
         ModeOption(
-            condition=lambda response: response == "0",
-            side_effect=ModeOptionSideEffectKnowledge(collection="knowledge"),
+            condition=lambda response: response == 0,
+            side_effect=ModeOptionSideEffectKnowledge(collection="parts"),
+            prefetch=True,
         ),
         ModeOption(
-            condition=lambda response: response == "1",
+            condition=lambda response: response == 1,
             side_effect=ModeOptionSideEffectTransaction(
                 transaction=_lobby_handle_request
             ),
+            transition="comment_details",
         ),
     ],
 )
@@ -0,0 +1,31 @@
+"""
+Chatty ASGI server, serving conversations of many sessions
+
+Serve with:
+    uvicorn server:server
+"""
+
+import logging
+import os
+
+import dotenv
+import openai
+from _modes import lobby
+
+from chat_chain import ChatServer, Config
+
+dotenv.load_dotenv()
+
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+if os.getenv("DEBUG"):
+    logging.basicConfig(level=logging.DEBUG)
+
+Config.consts.system_prompt_intro = (
+    "You are a helpful assistant named Chatty who is helps users learn about contributions"
+    " of Muslims and Arabs to science and knowledge, past and modern. You also can take"
+    " comments from users on the information you provide and register them for review by"
+    " team."
+)
+
+server = ChatServer(mode=lobby)
@@ -0,0 +1,34 @@
+"""
+Fixtures shared by tests
+"""
+
+import re
+
+import pytest
+
+from chat_chain import _gpt
+
+
+class _Encoding:
+    # Encoding of words, and runs of other characters, as tokens, so tests need no BPE ranks
+    name = "words"
+    _PATTERN = re.compile(r" ?\w+| ?[^\s\w]+|\s+")
+
+    def encode(self, text: str, **_) -> list[str]:
+        return self._PATTERN.findall(text)
+
+    def decode(self, tokens: list[str]) -> str:
+        return "".join(tokens)
+
+
+@pytest.fixture(name="encoding")
+def fixture_encoding(monkeypatch: pytest.MonkeyPatch) -> _Encoding:
+    """
+    Encoding of all models, counting words as tokens
+    """
+
+    encoding = _Encoding()
+    monkeypatch.setattr(_gpt, "_get_encoding", lambda model: encoding)
+    _gpt._num_tokens_memoized.cache_clear()  # pylint: disable=protected-access
+    yield encoding
+    _gpt._num_tokens_memoized.cache_clear()  # pylint: disable=protected-access
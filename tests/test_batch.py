@@ -0,0 +1,48 @@
+"""
+Tests of micro-batching of concurrent embeddings requests by `EmbeddingBatcher`
+"""
+
+import asyncio
+
+import pytest
+
+from chat_chain import EmbeddingBatcher
+
+
+def test_batcher_batches_concurrent_requests():
+    batcher = EmbeddingBatcher(max_size=2, max_delay=0.01)
+    batches: list[list[str]] = []
+
+    async def _create(texts):
+        batches.append(texts)
+        return [[float(len(text))] for text in texts]
+
+    async def _run():
+        return await asyncio.gather(
+            *(batcher.get(text, create=_create) for text in ["a", "bb", "ccc"])
+        )
+
+    assert asyncio.run(_run()) == [[1.0], [2.0], [3.0]]
+    # Batch is sent once full, and rest once max delay passes
+    assert batches == [["a", "bb"], ["ccc"]]
+    assert (batcher.stats.batches, batcher.stats.items) == (2, 3)
+
+
+def test_batcher_fails_all_callers_of_batch():
+    batcher = EmbeddingBatcher(max_size=8, max_delay=0.01)
+
+    async def _create(texts):
+        return [[0.0]] * (len(texts) - 1)
+
+    async def _run():
+        return await asyncio.gather(
+            batcher.get("a", create=_create),
+            batcher.get("b", create=_create),
+            return_exceptions=True,
+        )
+
+    for result in asyncio.run(_run()):
+        assert isinstance(result, ValueError)
+
+    with pytest.raises(ValueError, match="'0' embeddings for '1' texts"):
+        asyncio.run(batcher.get("a", create=_create))
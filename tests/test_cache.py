@@ -0,0 +1,151 @@
+"""
+Tests of `EmbeddingCache`, and of loading, and watching, of `TagsPromptsCache`
+"""
+
+import asyncio
+from typing import Iterable
+
+import pytest
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from chat_chain import EmbeddingCache, TagsPromptsCache
+
+
+class _Stream:
+    def __init__(self, calls: list[str]):
+        self.calls = calls
+        self.changes: asyncio.Queue[dict] = asyncio.Queue()
+
+    async def __aenter__(self):
+        await asyncio.sleep(0.01)
+        self.calls.append("watch")
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.changes.get()
+
+
+class _Collection:
+    def __init__(self, errors: Iterable[Exception] = ()):
+        self.calls: list[str] = []
+        self.docs = [{"tag": "history", "prompt": "Be precise."}]
+        self.stream = _Stream(self.calls)
+        self.errors = list(errors)
+
+    def watch(self):
+        if self.errors:
+            self.calls.append("error")
+            raise self.errors.pop(0)
+        return self.stream
+
+    async def find(self, *_):
+        self.calls.append("find")
+        for doc in list(self.docs):
+            yield doc
+
+
+def test_start_watches_before_load():
+    collection = _Collection()
+    cache = TagsPromptsCache(collection=collection, ttl=60)  # type: ignore
+
+    async def _run():
+        await cache.start()
+        assert await cache.get(["history"]) == {"history": "Be precise."}
+
+        collection.docs.append({"tag": "science", "prompt": "Cite sources."})
+        collection.stream.changes.put_nowait({})
+        await asyncio.sleep(0.01)
+        assert await cache.get(["science"]) == {"science": "Cite sources."}
+        await cache.aclose()
+
+    asyncio.run(_run())
+
+    assert collection.calls == ["watch", "find", "find"]
+
+
+def test_watch_reopens_after_error():
+    collection = _Collection([AutoReconnect("primary stepped down")])
+    cache = TagsPromptsCache(collection=collection, ttl=0.05)  # type: ignore
+
+    async def _run():
+        await cache.start()
+        await asyncio.sleep(0.1)
+        collection.docs.append({"tag": "science", "prompt": "Cite sources."})
+        collection.stream.changes.put_nowait({})
+        await asyncio.sleep(0.01)
+        assert await cache.get(["science"]) == {"science": "Cite sources."}
+        await cache.aclose()
+
+    asyncio.run(_run())
+
+    # Cache is reloaded on reopen, as changes could be missed, then on change
+    assert collection.calls == ["error", "find", "watch", "find", "find"]
+
+
+def test_watch_polls_if_not_supported():
+    collection = _Collection([OperationFailure("not a replica set", code=40573)])
+    cache = TagsPromptsCache(collection=collection, ttl=0.05)  # type: ignore
+
+    async def _run():
+        await cache.start()
+        await asyncio.sleep(0.12)
+        await cache.aclose()
+
+    asyncio.run(_run())
+
+    assert collection.calls[:2] == ["error", "find"]
+    assert set(collection.calls[2:]) == {"find"}
+
+
+def test_embedding_cache_hit_equals_miss():
+    cache = EmbeddingCache(max_size=4)
+
+    async def _create():
+        return [0.1, 0.2, 0.3]
+
+    async def _run():
+        return (
+            await cache.get_or_create("key", _create),
+            await cache.get_or_create("key", _create),
+        )
+
+    miss, hit = asyncio.run(_run())
+
+    assert miss == hit
+    assert miss == pytest.approx([0.1, 0.2, 0.3])
+    assert (cache.stats.misses, cache.stats.hits) == (1, 1)
+
+
+def test_embedding_cache_drop_pending():
+    cache = EmbeddingCache(max_size=4)
+
+    async def _hang():
+        await asyncio.Event().wait()
+        return [0.0]
+
+    async def _create():
+        return [0.5]
+
+    async def _start():
+        lookup = asyncio.ensure_future(cache.get_or_create("key", _hang))
+        await asyncio.sleep(0)
+        return lookup
+
+    # Leave lookup in flight on a loop that is then discarded, as in parent process before fork
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(_start())
+
+    cache.drop_pending()
+    assert asyncio.run(cache.get_or_create("key", _create)) == [0.5]
+    assert cache.stats.coalesced == 0
+
+    for task in asyncio.all_tasks(loop):
+        task.cancel()
+    loop.run_until_complete(asyncio.sleep(0.01))
+    loop.close()
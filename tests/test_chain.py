@@ -0,0 +1,210 @@
+"""
+Tests of handling of messages by modes, and their side effects
+"""
+
+import asyncio
+from collections import Counter
+
+from chat_chain import (Conversation, Mode, ModeOption, ModeOptionSideEffect,
+                        ModeOptionSideEffectKnowledge,
+                        ModeOptionSideEffectTransaction, ResponseParserInt,
+                        TokenBudget, _chain, handle_message_stream)
+from chat_chain._gpt import Knowledge
+
+
+def _handle(mode: Mode, message: str) -> tuple[list, int]:
+    conversation = Conversation(mode=mode, session="s", partial_log_range=(0, None))
+    return asyncio.run(
+        _chain._handle_message(  # pylint: disable=protected-access
+            conversation=conversation, message=message, stream=False
+        )
+    )
+
+
+def _mode(side_effect) -> Mode:
+    return Mode(
+        name="lobby",
+        prompt="Is this a question: {message}",
+        options=[ModeOption(condition=lambda _: True, side_effect=side_effect)],
+    )
+
+
+def test_knowledge_response_limit_fits_context_window(encoding, monkeypatch):
+    async def _get_model_answer(*, prompt, tokens):
+        # pylint: disable=unused-argument
+        return "1"
+
+    async def _match_knowledge(self, message, /):
+        # pylint: disable=unused-argument
+        return Knowledge(matched_parts=(), parts_tags=Counter())
+
+    monkeypatch.setattr(_chain, "_get_model_answer", _get_model_answer)
+    monkeypatch.setattr(
+        ModeOptionSideEffectKnowledge, "_match_knowledge", _match_knowledge
+    )
+
+    side_effect = ModeOptionSideEffectKnowledge(
+        collection="parts", budget=TokenBudget(total=4000)
+    )
+    (messages, limit) = _handle(_mode(side_effect), " ".join(["ask"] * 5000))
+
+    tokens = sum(len(encoding.encode(message["content"])) for message in messages)
+    assert 0 < limit < 300
+    assert tokens + limit <= 4096
+
+
+def test_transaction_response_limit_defaults(encoding, monkeypatch):
+    # pylint: disable=unused-argument
+    async def _get_model_answer(*, prompt, tokens):
+        return "1"
+
+    async def _transaction(*, conversation, message, response):
+        return [{"role": "system", "content": "Answer politely."}]
+
+    monkeypatch.setattr(_chain, "_get_model_answer", _get_model_answer)
+
+    (_, limit) = _handle(
+        _mode(ModeOptionSideEffectTransaction(transaction=_transaction)), "Hello"
+    )
+
+    assert limit == 300
+
+
+def test_conversation_log_defaults_to_config_window(monkeypatch):
+    monkeypatch.setattr(_chain.Config.consts, "conversation_max_messages", 2)
+    conversation = Conversation(
+        mode=_mode(None), session="s", partial_log_range=(0, None)
+    )
+
+    for i in range(3):
+        conversation.log.append({"role": "user", "content": f"Message {i}"})
+
+    assert (len(conversation.log), conversation.log.offset) == (3, 1)
+
+
+class _StubClient:
+    # Client streaming chunks of one of `responses` per call, recording chunks streamed by call
+    limiter = None
+
+    def __init__(self, *responses: list[str]):
+        self.responses = list(responses)
+        self.streamed: list[list[str]] = []
+
+    async def stream(self, endpoint, /, **kwargs):
+        # pylint: disable=unused-argument
+        streamed: list[str] = []
+        self.streamed.append(streamed)
+
+        for chunk in self.responses.pop(0):
+            streamed.append(chunk)
+            yield {"choices": [{"delta": {"content": chunk}}]}
+
+
+def test_stream_stops_classifier_once_parsed(encoding, monkeypatch):
+    # pylint: disable=unused-argument
+    async def _transaction(*, conversation, message, response):
+        return [{"role": "system", "content": "Greet user."}]
+
+    client = _StubClient(["1", " because", " reasons"], ["Hello", " there"])
+    monkeypatch.setattr(_chain.Config, "_openai_client", client)
+
+    conversation = Conversation(
+        mode=Mode(
+            name="lobby",
+            prompt="Is this a greeting: {message}",
+            parser=ResponseParserInt(),
+            options=[
+                ModeOption(
+                    condition=lambda response: response == 1,
+                    side_effect=ModeOptionSideEffectTransaction(
+                        transaction=_transaction
+                    ),
+                )
+            ],
+        ),
+        session="s",
+        partial_log_range=(0, None),
+    )
+
+    async def _turn() -> list[tuple[int, str]]:
+        return [
+            chunk
+            async for chunk in handle_message_stream(
+                conversation=conversation, message="Hi"
+            )
+        ]
+
+    assert asyncio.run(_turn()) == [(0, "Hello"), (1, " there")]
+    assert client.streamed[0] == ["1", " because"]
+    assert conversation.log[-1] == {"role": "assistant", "content": "Hello there"}
+
+
+class _Prefetching(ModeOptionSideEffect):
+    # Side effect recording its prefetch and execution, and replying with its prefetched value
+    def __init__(self, name: str, events: list[str], hang: bool = False):
+        self.name = name
+        self.events = events
+        self.hang = hang
+
+    async def prefetch(self, *, conversation, message):
+        self.events.append(f"prefetch {self.name}")
+        try:
+            if self.hang:
+                await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.events.append(f"cancel {self.name}")
+            raise
+        return f"Prefetched by {self.name}."
+
+    async def exec(self, *, conversation, message, response, prefetched=None):
+        self.events.append(f"exec {self.name}: {prefetched}")
+        return [{"role": "system", "content": prefetched}]
+
+
+def test_prefetch_runs_with_classifier_and_is_discarded_if_not_matched(
+    encoding, monkeypatch
+):
+    # pylint: disable=unused-argument
+    events: list[str] = []
+    client = _StubClient(["1"], ["Hello"])
+    monkeypatch.setattr(_chain.Config, "_openai_client", client)
+
+    conversation = Conversation(
+        mode=Mode(
+            name="lobby",
+            prompt="Is this a greeting: {message}",
+            parser=ResponseParserInt(),
+            options=[
+                ModeOption(
+                    condition=lambda response: response == 0,
+                    side_effect=_Prefetching("question", events, hang=True),
+                    prefetch=True,
+                ),
+                ModeOption(
+                    condition=lambda response: response == 1,
+                    side_effect=_Prefetching("greeting", events),
+                    prefetch=True,
+                ),
+            ],
+        ),
+        session="s",
+        partial_log_range=(0, None),
+    )
+
+    async def _turn() -> list[tuple[int, str]]:
+        chunks = [
+            chunk
+            async for chunk in handle_message_stream(
+                conversation=conversation, message="Hi"
+            )
+        ]
+        await asyncio.sleep(0)
+        return chunks
+
+    assert asyncio.run(_turn()) == [(0, "Hello")]
+    assert events == [
+        "prefetch question",
+        "prefetch greeting",
+        "exec greeting: Prefetched by greeting.",
+        "cancel question",
+    ]
@@ -0,0 +1,109 @@
+"""
+Tests of retrying, and limiting, requests of `OpenAIClient`
+"""
+
+import asyncio
+import json
+
+import openai
+import pytest
+from aiohttp import web
+
+from chat_chain import OpenAIClient, RateLimiter
+
+_COMPLETION = {
+    "choices": [{"message": {"role": "assistant", "content": "Hi"}}],
+    "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4},
+}
+
+
+async def _serve(responses: list[web.Response], monkeypatch: pytest.MonkeyPatch):
+    # Serves `responses` in order, to requests of any endpoint
+    async def _handle(_):
+        return responses.pop(0)
+
+    app = web.Application()
+    app.router.add_post("/v1/{endpoint:.*}", _handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+
+    port = runner.addresses[0][1]
+    monkeypatch.setattr(openai, "api_base", f"http://127.0.0.1:{port}/v1")
+    return runner
+
+
+def _error(status: int, message: str) -> web.Response:
+    return web.json_response({"error": {"message": message}}, status=status)
+
+
+def test_client_retries_and_refunds_failed_attempt(monkeypatch):
+    # Bucket of 10 tokens, refilled by 10 tokens per second
+    limiter = RateLimiter(tokens_per_minute=600, burst=1)
+    client = OpenAIClient(backoff=0.01, limiter=limiter)
+
+    async def _run():
+        runner = await _serve(
+            [_error(503, "Overloaded"), web.json_response(_COMPLETION)], monkeypatch
+        )
+        try:
+            response = await asyncio.wait_for(
+                client.request("chat/completions", api_key="sk", tokens=10), 0.5
+            )
+            # Unused tokens are given back, so request of them is not held
+            await asyncio.wait_for(limiter.acquire(6), 0.05)
+        finally:
+            await client.aclose()
+            await runner.cleanup()
+        return response
+
+    assert asyncio.run(_run()) == _COMPLETION
+    assert (client.stats.requests, client.stats.retries) == (2, 1)
+    assert limiter.stats["answer"].waited == 0
+
+
+def test_client_raises_not_retryable_error(monkeypatch):
+    client = OpenAIClient(backoff=0.01)
+
+    async def _run():
+        runner = await _serve([_error(400, "Bad request")], monkeypatch)
+        try:
+            await client.request("chat/completions", api_key="sk")
+        finally:
+            await client.aclose()
+            await runner.cleanup()
+
+    with pytest.raises(openai.error.InvalidRequestError, match="Bad request"):
+        asyncio.run(_run())
+    assert (client.stats.requests, client.stats.failures) == (1, 1)
+
+
+def test_client_streams_chunks(monkeypatch):
+    chunks = [
+        {"choices": [{"delta": {"content": text}}]} for text in ["Hello", " world"]
+    ]
+    body = (
+        "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks)
+        + "data: [DONE]\n\n"
+    )
+    client = OpenAIClient(backoff=0.01)
+
+    async def _run():
+        runner = await _serve(
+            [
+                _error(429, "Rate limit reached"),
+                web.Response(body=body, content_type="text/event-stream"),
+            ],
+            monkeypatch,
+        )
+        try:
+            return [
+                chunk async for chunk in client.stream("chat/completions", api_key="sk")
+            ]
+        finally:
+            await client.aclose()
+            await runner.cleanup()
+
+    assert asyncio.run(_run()) == chunks
+    assert client.stats.retries == 1
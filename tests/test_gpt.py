@@ -0,0 +1,139 @@
+"""
+Tests of budgeting of messages lists sent to AI model, and of matching knowledge
+"""
+
+import asyncio
+
+import pytest
+import qdrant_client
+from qdrant_client.http import models
+
+from chat_chain import (Config, KnowledgeCollection, TokenBudget, _gpt,
+                        build_messages_list)
+from chat_chain._gpt import (match_knowledge, num_tokens_from_messages,
+                             truncate_prompt)
+
+
+def _words(count: int, word: str = "word") -> str:
+    return " ".join([word] * count)
+
+
+def test_truncate_prompt_at_token_boundary(encoding):
+    # pylint: disable=unused-argument
+    assert truncate_prompt(prompt=_words(10), max_tokens=3) == _words(3)
+    assert truncate_prompt(prompt=_words(10), max_tokens=None) == _words(10)
+
+
+def test_messages_list_fits_prompt_and_question(encoding):
+    # pylint: disable=unused-argument
+    (messages, limit) = build_messages_list(
+        prompt=_words(100, "fact"), question=_words(20, "ask")
+    )
+
+    assert messages[0]["content"] == _words(100, "fact")
+    assert messages[1]["content"] == _words(20, "ask")
+    assert limit == 500
+
+
+def test_long_question_does_not_empty_prompt(encoding):
+    # pylint: disable=unused-argument
+    budget = TokenBudget(total=2500)
+    (messages, _) = build_messages_list(
+        prompt=_words(1000, "fact"), question=_words(5000, "ask"), budget=budget
+    )
+
+    assert messages[0]["content"] == _words(1000, "fact")
+    assert 0 < len(encoding.encode(messages[1]["content"])) <= 1500
+
+
+def test_long_prompt_keeps_question_minimum(encoding):
+    budget = TokenBudget(total=2500)
+    (messages, _) = build_messages_list(
+        prompt=_words(5000, "fact"), question=_words(500, "ask"), budget=budget
+    )
+
+    assert len(encoding.encode(messages[1]["content"])) == 100
+    assert len(encoding.encode(messages[0]["content"])) > 2000
+
+
+def test_question_budget_is_honoured(encoding):
+    budget = TokenBudget(total=2500, question=10)
+    (messages, _) = build_messages_list(
+        prompt=_words(100, "fact"), question=_words(500, "ask"), budget=budget
+    )
+
+    assert len(encoding.encode(messages[1]["content"])) == 10
+
+
+def test_response_limit_stays_in_context_window(encoding):
+    # pylint: disable=unused-argument
+    (_, limit) = build_messages_list(
+        prompt=_words(8000, "fact"), budget=TokenBudget(total=8000)
+    )
+
+    assert limit == 0
+
+
+def test_num_tokens_from_messages(encoding):
+    # pylint: disable=unused-argument,protected-access
+    messages = [
+        {"role": "system", "content": "Be brief"},
+        {"role": "user", "name": "ann", "content": "Hi there"},
+    ]
+
+    # Message of 4 tokens, name of -1, value of 1, and reply of 2, for gpt-3.5-turbo
+    assert num_tokens_from_messages(messages) == (4 + 1 + 2) + (4 + 1 - 1 + 1 + 2) + 2
+    # Values of memoized counts are encoded once per model
+    assert _gpt._num_tokens_memoized.cache_info().currsize == 5
+    num_tokens_from_messages(messages, memoize=False)
+    assert _gpt._num_tokens_memoized.cache_info().currsize == 5
+
+    # Message of 3 tokens, name of 1, and reply of 3, for later models
+    assert (
+        num_tokens_from_messages(messages, model="gpt-4")
+        == (3 + 1 + 2) + (3 + 1 + 1 + 1 + 2) + 3
+    )
+
+
+def test_knowledge_is_merged_across_collections(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(Config, "_qdrant", qdrant_client.QdrantClient(":memory:"))
+    for (collection, parts) in [
+        ("faq", [("faq-1", [1.0, 0.1]), ("faq-2", [0.0, 1.0])]),
+        ("docs", [("docs-1", [1.0, 0.0]), ("docs-2", [1.0, 0.3])]),
+    ]:
+        Config.qdrant.create_collection(
+            collection_name=collection,
+            vectors_config={
+                "content": models.VectorParams(size=2, distance=models.Distance.COSINE)
+            },
+        )
+        Config.qdrant.upsert(
+            collection_name=collection,
+            points=[
+                models.PointStruct(
+                    id=i,
+                    vector={"content": vector},
+                    payload={
+                        "id": part,
+                        "content": part,
+                        "metadata": {"tags": [collection]},
+                    },
+                )
+                for (i, (part, vector)) in enumerate(parts)
+            ],
+        )
+
+    knowledge = asyncio.run(
+        match_knowledge(
+            question="Question",
+            embedding=[1.0, 0.0],
+            collection=["faq", KnowledgeCollection(name="docs", limit=1)],
+        )
+    )
+
+    assert [part for (part, _, _) in knowledge.matched_parts] == [
+        "docs-1",
+        "faq-1",
+        "faq-2",
+    ]
+    assert knowledge.parts_tags == {"faq": 2, "docs": 1}
@@ -0,0 +1,54 @@
+"""
+Tests of registering modes, and resolving their transitions, in `ModeGraph`
+"""
+
+import pytest
+
+from chat_chain import (Mode, ModeGraph, ModeOption,
+                        ModeOptionSideEffectTransaction)
+
+
+async def _reply(**_):
+    return []
+
+
+def _mode(name: str, *transitions: str) -> Mode:
+    return Mode(
+        name=name,
+        prompt="Reply 1 to {message}",
+        options=[
+            ModeOption(
+                condition=lambda response: response == "1",
+                side_effect=ModeOptionSideEffectTransaction(transaction=_reply),
+                transition=transition,
+            )
+            for transition in transitions
+        ],
+    )
+
+
+def test_graph_resolves_transitions(encoding):
+    # pylint: disable=unused-argument
+    (start, checkout) = (
+        _mode("start", "checkout"),
+        _mode("checkout", "start", "checkout"),
+    )
+    graph = ModeGraph([start, checkout])
+
+    assert list(graph) == ["start", "checkout"]
+    assert graph["checkout"] is checkout
+    assert start.options[0].target is checkout
+    assert checkout.options[0].target is start
+    assert graph.transitions == {
+        "start": frozenset({"checkout"}),
+        "checkout": frozenset({"start", "checkout"}),
+    }
+
+
+def test_graph_rejects_invalid_modes(encoding):
+    # pylint: disable=unused-argument
+    with pytest.raises(ValueError, match="more than once"):
+        ModeGraph([_mode("start"), _mode("start")])
+
+    with pytest.raises(ValueError, match="'checkout' which is not registered"):
+        ModeGraph([_mode("start", "checkout")])
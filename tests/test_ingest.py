@@ -0,0 +1,94 @@
+"""
+Tests of ingestion of documents by `ingest`
+"""
+
+import asyncio
+
+import pytest
+import qdrant_client
+
+from chat_chain import (Config, IngestDocument, _ingest, create_collection,
+                        ingest)
+
+
+@pytest.fixture(name="embedded")
+def fixture_embedded(monkeypatch: pytest.MonkeyPatch, encoding) -> list[str]:
+    """
+    Texts embedded, by in-memory QDrant client of `Config`
+    """
+
+    embedded: list[str] = []
+
+    async def _get_embeddings(texts, /, *, priority, cache):
+        assert (priority, cache) == ("background", False)
+        texts = list(texts)
+        embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    monkeypatch.setattr(_ingest, "_get_encoding", lambda model: encoding)
+    monkeypatch.setattr(_ingest, "get_embeddings", _get_embeddings)
+    monkeypatch.setattr(Config, "_qdrant", qdrant_client.QdrantClient(":memory:"))
+    create_collection("parts", dimensions=2)
+
+    return embedded
+
+
+def _points() -> dict[tuple[str, int], dict]:
+    (points, _) = Config.qdrant.scroll(collection_name="parts", limit=100)
+    return {
+        (point.payload["metadata"]["document"], point.payload["metadata"]["chunk"]): (
+            point.payload
+        )
+        for point in points
+    }
+
+
+def test_reingest_updates_tags_without_embedding(embedded: list[str], tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    document = IngestDocument(id="a", content="one two three four", tags=["x"])
+
+    asyncio.run(
+        ingest([document], checkpoint=checkpoint, chunk_tokens=2, chunk_overlap=0)
+    )
+    assert len(embedded) == 2
+
+    document.tags = ["y"]
+    report = asyncio.run(
+        ingest([document], checkpoint=checkpoint, chunk_tokens=2, chunk_overlap=0)
+    )
+
+    assert (report.documents, report.skipped_documents) == (1, 0)
+    assert len(embedded) == 2
+    assert [p["metadata"]["tags"] for p in _points().values()] == [["y"], ["y"]]
+
+    report = asyncio.run(
+        ingest([document], checkpoint=checkpoint, chunk_tokens=2, chunk_overlap=0)
+    )
+    assert (report.documents, report.skipped_documents) == (0, 1)
+
+
+def test_reingest_deletes_stale_chunks_of_batch(
+    embedded: list[str], monkeypatch: pytest.MonkeyPatch
+):
+    documents = [
+        IngestDocument(id="a", content="one two three four"),
+        IngestDocument(id="b", content="five six"),
+    ]
+    asyncio.run(ingest(documents, chunk_tokens=2, chunk_overlap=0))
+
+    deletes = []
+    delete = Config.qdrant.delete
+    monkeypatch.setattr(
+        Config.qdrant, "delete", lambda **kwargs: deletes.append(1) or delete(**kwargs)
+    )
+
+    documents = [
+        IngestDocument(id="a", content="one two"),
+        IngestDocument(id="b", content=""),
+    ]
+    report = asyncio.run(ingest(documents, chunk_tokens=2, chunk_overlap=0))
+
+    assert report.documents == 2
+    assert len(deletes) == 1
+    assert list(_points()) == [("a", 0)]
+    assert embedded == ["one two", "three four", "five six"]
@@ -0,0 +1,65 @@
+"""
+Tests of granting budget of AI model requests by `RateLimiter`
+"""
+
+import asyncio
+
+import pytest
+
+from chat_chain import RateLimiter
+
+
+def test_limiter_grants_by_priority():
+    # Bucket of 1 request, refilled every 0.1 seconds
+    limiter = RateLimiter(requests_per_minute=600, burst=0.1)
+    granted: list[str] = []
+
+    async def _acquire(priority):
+        await limiter.acquire(priority=priority)
+        granted.append(priority)
+
+    async def _run():
+        await limiter.acquire()
+        waiting = [
+            asyncio.ensure_future(_acquire("background")),
+            asyncio.ensure_future(_acquire("classifier")),
+        ]
+        await asyncio.sleep(0)
+        assert limiter.queued == {"background": 1, "classifier": 1}
+        await asyncio.gather(*waiting)
+
+    asyncio.run(_run())
+
+    assert granted == ["classifier", "background"]
+    assert limiter.stats["answer"].waited == 0
+    assert limiter.stats["background"].waited == 1
+
+
+def test_limiter_settle_returns_unused_tokens():
+    # Bucket of 10 tokens, refilled by 10 tokens per second
+    limiter = RateLimiter(tokens_per_minute=600, burst=1)
+
+    async def _run():
+        await limiter.acquire(10)
+        waiting = asyncio.ensure_future(limiter.acquire(5))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        limiter.settle(10, 2)
+        await asyncio.wait_for(waiting, 0.1)
+
+    asyncio.run(_run())
+
+    assert limiter.stats["answer"].tokens == 15
+
+
+def test_limiter_pause():
+    limiter = RateLimiter(requests_per_minute=6000)
+
+    async def _run():
+        limiter.pause(0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire(), 0.05)
+        await asyncio.wait_for(limiter.acquire(), 0.1)
+
+    asyncio.run(_run())
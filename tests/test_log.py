@@ -0,0 +1,33 @@
+"""
+Tests of transcripts of `ConversationLog`
+"""
+
+from chat_chain import ConversationLog
+
+
+def _transcript(messages: list[str]) -> str:
+    return "\n".join(f"user: {message}" for message in messages)
+
+
+def test_transcript_follows_window():
+    log = ConversationLog(max_messages=3)
+    messages = [f"Message {i}" for i in range(10)]
+
+    for (i, message) in enumerate(messages):
+        log.append({"role": "user", "content": message})
+        assert log.transcript() == _transcript(messages[max(i - 2, 0) : i + 1])
+        assert log.transcript(i) == _transcript(messages[i : i + 1])
+        assert log.transcript(0, i) == _transcript(messages[max(i - 2, 0) : i])
+
+
+def test_transcript_after_pop():
+    log = ConversationLog(max_messages=2)
+    for i in range(4):
+        log.append({"role": "user", "content": f"Message {i}"})
+    log.transcript()
+
+    log.pop()
+    assert log.transcript() == _transcript(["Message 2"])
+
+    log.append({"role": "user", "content": "Message 4"})
+    assert log.transcript() == _transcript(["Message 2", "Message 4"])
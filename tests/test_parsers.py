@@ -0,0 +1,55 @@
+"""
+Tests of parsing, and of completeness of streamed, mode prompt responses
+"""
+
+import pytest
+
+from chat_chain import (ResponseParserEnum, ResponseParserInt,
+                        ResponseParserJSON)
+
+
+def test_json_parser():
+    parser = ResponseParserJSON(default={"topic": None})
+
+    assert parser.parse('{"topic": "history"}') == {"topic": "history"}
+    assert parser.parse('```json\n{"topic": "science"}\n```') == {"topic": "science"}
+
+    default = parser.parse("No topic")
+    assert default == {"topic": None}
+    assert default is not parser.default
+
+    assert not parser.is_complete('{"topic": "hist')
+    assert not parser.is_complete('{"a": {"b": 1}')
+    assert parser.is_complete('{"topic": "history"} ')
+
+
+@pytest.mark.parametrize(
+    "response,expected", [("1", 1), (" Class: 12.", 12), ("-3", -3), ("none", 0)]
+)
+def test_int_parser(response: str, expected: int):
+    assert ResponseParserInt(default=0).parse(response) == expected
+
+
+def test_int_parser_is_complete():
+    assert not ResponseParserInt().is_complete("Class ")
+    assert not ResponseParserInt().is_complete("1")
+    assert ResponseParserInt().is_complete("12 ")
+    assert ResponseParserInt(max_digits=1).is_complete("1")
+    assert ResponseParserInt(max_digits=1).is_complete("-1")
+    assert not ResponseParserInt(max_digits=2).is_complete("1")
+
+
+@pytest.mark.parametrize(
+    "response,expected",
+    [
+        ("Yes", "yes"),
+        (' "NO". ', "no"),
+        ("I think the answer is yes", "yes"),
+        ("yesterday", "unsure"),
+    ],
+)
+def test_enum_parser(response: str, expected: str):
+    parser = ResponseParserEnum(values=["yes", "no"], default="unsure")
+
+    assert parser.parse(response) == expected
+    assert not parser.is_complete(response)
@@ -0,0 +1,62 @@
+"""
+Tests of local re-ranking, and deduplication, of matched knowledge parts
+"""
+
+import pytest
+from qdrant_client.http import models
+
+from chat_chain import KnowledgeRerank
+from chat_chain._gpt import _rerank_results
+from chat_chain._rerank import select_parts
+
+# Parts of two near-duplicates of first topic, and one part of second topic
+_SCORES = [0.95, 0.94, 0.90]
+_VECTORS = [[1.0, 0.0], [0.999, 0.01], [0.6, 0.8]]
+
+
+def test_mmr_selects_diverse_parts_without_duplicates():
+    selected = select_parts(_SCORES, _VECTORS, rerank=KnowledgeRerank(), limit=3)
+
+    assert selected == [0, 2]
+
+
+def test_dedup_selects_by_score_without_duplicates():
+    rerank = KnowledgeRerank(strategy="dedup", duplicate_threshold=0.9)
+    selected = select_parts(
+        [0.9, 0.95, 0.8], [[1.0, 0.0], [0.0, 1.0], [0.1, 1.0]], rerank=rerank, limit=3
+    )
+
+    assert selected == [1, 0]
+
+
+def test_parts_are_packed_into_tokens_budget():
+    selected = select_parts(
+        _SCORES,
+        _VECTORS,
+        rerank=KnowledgeRerank(duplicate_threshold=1.1),
+        limit=3,
+        tokens=[50, 20, 40],
+        max_tokens=70,
+    )
+
+    assert selected == [0, 1]
+    assert select_parts([], [], rerank=KnowledgeRerank(), limit=3) == []
+
+
+def test_results_under_knowledge_bar_or_without_vectors(encoding):
+    # pylint: disable=unused-argument
+    results = [
+        models.ScoredPoint(
+            id=i, version=0, score=score, payload={"content": "Part"}, vector=vector
+        )
+        for (i, (score, vector)) in enumerate(
+            [(0.95, {"content": [1.0, 0.0]}), (0.5, [0.0, 1.0])]
+        )
+    ]
+
+    selected = _rerank_results(results, rerank=KnowledgeRerank(), max_tokens=10)
+    assert [result.id for result in selected] == [0]
+
+    results[0].vector = None
+    with pytest.raises(ValueError):
+        _rerank_results(results, rerank=KnowledgeRerank(), max_tokens=None)
@@ -0,0 +1,94 @@
+"""
+Tests of semantic cache of responses, `ResponseCache`, and its stores
+"""
+
+import asyncio
+import time
+
+import pytest
+import qdrant_client
+from qdrant_client.http import models
+
+from chat_chain import (Config, ResponseCache, ResponseCacheStoreMemory,
+                        ResponseCacheStoreQdrant)
+from chat_chain._response_cache import ResponseCacheKey
+
+
+def _key(embedding: list[float], parts_ids=("a", "b")) -> ResponseCacheKey:
+    return ResponseCacheKey.create(
+        embedding=embedding, parts_ids=parts_ids, prompt="Answer from parts"
+    )
+
+
+def test_key_fingerprint_ignores_parts_order():
+    assert _key([1.0], ("a", "b")).fingerprint == _key([1.0], ("b", "a")).fingerprint
+    assert _key([1.0], ("a",)).fingerprint != _key([1.0], ("a", "b")).fingerprint
+    assert _key([1.0]).matches([{"role": "system", "content": "Answer from parts"}])
+
+
+def test_cache_serves_similar_question_of_same_fingerprint():
+    cache = ResponseCache(threshold=0.95)
+
+    async def _run():
+        await cache.add(key=_key([1.0, 0.0]), chunks=["Hello", " there"])
+        return (
+            await cache.lookup(key=_key([0.99, 0.05])),
+            await cache.lookup(key=_key([0.0, 1.0])),
+            await cache.lookup(key=_key([1.0, 0.0], ("c",))),
+        )
+
+    assert asyncio.run(_run()) == (["Hello", " there"], None, None)
+    assert (cache.stats.hits, cache.stats.misses) == (1, 2)
+
+
+def test_memory_store_evicts_least_recently_used(monkeypatch: pytest.MonkeyPatch):
+    store = ResponseCacheStoreMemory(max_entries=2, ttl=10)
+
+    async def _run():
+        await store.add(key=_key([1.0, 0.0], ("a",)), chunks=["a"])
+        await store.add(key=_key([1.0, 0.0], ("b",)), chunks=["b"])
+        # Lookup makes entry of `a` most recently used, so `b` is evicted
+        await store.lookup(key=_key([1.0, 0.0], ("a",)), threshold=0.9)
+        await store.add(key=_key([1.0, 0.0], ("c",)), chunks=["c"])
+
+        return [
+            await store.lookup(key=_key([1.0, 0.0], (part,)), threshold=0.9)
+            for part in "abc"
+        ]
+
+    assert asyncio.run(_run()) == [["a"], None, ["c"]]
+
+    now = time.monotonic()
+    monkeypatch.setattr("time.monotonic", lambda: now + 11)
+    assert (
+        asyncio.run(store.lookup(key=_key([1.0, 0.0], ("a",)), threshold=0.9)) is None
+    )
+    assert not store._fingerprints.get(  # pylint: disable=protected-access
+        _key([1.0, 0.0], ("a",)).fingerprint
+    )
+
+
+def test_qdrant_store_serves_unexpired_responses(monkeypatch: pytest.MonkeyPatch):
+    client = qdrant_client.QdrantClient(":memory:")
+    client.recreate_collection(
+        collection_name="responses",
+        vectors_config={
+            "question": models.VectorParams(size=2, distance=models.Distance.COSINE)
+        },
+    )
+    monkeypatch.setattr(Config, "_qdrant", client)
+    store = ResponseCacheStoreQdrant(ttl=10)
+
+    async def _run():
+        await store.add(key=_key([1.0, 0.0]), chunks=["Hello"])
+        return (
+            await store.lookup(key=_key([0.99, 0.05]), threshold=0.95),
+            await store.lookup(key=_key([0.0, 1.0]), threshold=0.95),
+            await store.lookup(key=_key([1.0, 0.0], ("c",)), threshold=0.95),
+        )
+
+    assert asyncio.run(_run()) == (["Hello"], None, None)
+
+    now = time.time()
+    monkeypatch.setattr("time.time", lambda: now + 11)
+    assert asyncio.run(store.lookup(key=_key([1.0, 0.0]), threshold=0.95)) is None
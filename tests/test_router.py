@@ -0,0 +1,77 @@
+"""
+Tests of local routing of messages to mode prompt responses by `ModeRouter`
+"""
+
+import asyncio
+from collections import Counter
+
+import pytest
+
+from chat_chain import (Conversation, Mode, ModeOption,
+                        ModeOptionSideEffectKnowledge, ModeRouter, _chain)
+from chat_chain._gpt import Knowledge
+
+
+def _router(threshold: float = 0.8) -> ModeRouter:
+    router = ModeRouter(threshold=threshold)
+    router.fit(
+        [[1.0, 0.0], [0.9, 0.1], [0.0, 1.0], [0.1, 0.9]] * 10, ["1", "1", "0", "0"] * 10
+    )
+    return router
+
+
+def test_router_routes_only_confident_predictions():
+    router = _router()
+
+    assert router.predict([1.0, 0.0])[0] == "1"
+    assert asyncio.run(router.route("Hi", embedding=[0.0, 1.0])) == "0"
+    assert asyncio.run(router.route("Hi", embedding=[0.5, 0.5])) is None
+    assert asyncio.run(ModeRouter().route("Hi", embedding=[1.0, 0.0])) is None
+
+
+def test_router_requires_two_responses():
+    with pytest.raises(ValueError):
+        ModeRouter().fit([[1.0, 0.0], [0.0, 1.0]], ["1", "1"])
+
+
+def test_turn_embeds_message_once(encoding, monkeypatch):
+    # pylint: disable=unused-argument
+    embedded = []
+
+    async def _get_embedding(text, /):
+        embedded.append(text)
+        await asyncio.sleep(0)
+        return [1.0, 0.0]
+
+    async def _get_model_answer(*, prompt, tokens):
+        raise AssertionError("Routed message should not call model")
+
+    async def _match_knowledge(*, question, embedding, **kwargs):
+        assert embedding == [1.0, 0.0]
+        return Knowledge(matched_parts=(), parts_tags=Counter())
+
+    monkeypatch.setattr(_chain, "get_embedding", _get_embedding)
+    monkeypatch.setattr(_chain, "_get_model_answer", _get_model_answer)
+    monkeypatch.setattr(_chain, "match_knowledge", _match_knowledge)
+
+    side_effect = ModeOptionSideEffectKnowledge(collection="parts")
+    mode = Mode(
+        name="lobby",
+        prompt="Is this a question: {message}",
+        router=_router(),
+        options=[
+            ModeOption(
+                condition=lambda response: response == "1",
+                side_effect=side_effect,
+                prefetch=True,
+            )
+        ],
+    )
+    conversation = Conversation(mode=mode, session="s", partial_log_range=(0, None))
+
+    (messages, _) = asyncio.run(
+        _chain.handle_message(conversation=conversation, message=" What is algebra? ")
+    )
+
+    assert embedded == ["What is algebra?"]
+    assert messages[-1]["content"] == " What is algebra? "
@@ -0,0 +1,170 @@
+"""
+Tests of starting, and turns of, `ChatServer`
+"""
+
+import asyncio
+from typing import Any
+
+from chat_chain import (ChatServer, ChatServerBase, Config, Conversation, Mode,
+                        ModeOption, ModeOptionSideEffectKnowledge,
+                        ModeOptionSideEffectTransaction, _server)
+
+
+class _Server(ChatServerBase):
+    def __init__(self):
+        super().__init__(max_message_size=1024)
+        self.cancelled = asyncio.Event()
+
+    async def turn(self, session, message, /):
+        try:
+            yield (0, "Thinking")
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+
+    async def aclose(self):
+        pass
+
+
+async def _request(app, path: str, body: bytes, received: list[dict[str, Any]]):
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def _receive():
+        if requests:
+            return requests.pop(0)
+        # Client disconnects once first chunk is received
+        while len(received) < 2:
+            await asyncio.sleep(0)
+        return {"type": "http.disconnect"}
+
+    async def _send(event):
+        received.append(event)
+
+    scope = {"type": "http", "method": "POST", "path": path, "headers": []}
+    await app(scope, _receive, _send)
+
+
+def test_http_disconnect_cancels_turn():
+    server = _Server()
+    received: list[dict[str, Any]] = []
+
+    async def _run():
+        await asyncio.wait_for(
+            _request(server, "/sessions/s/messages", b'{"message": "Hello"}', received),
+            timeout=1,
+        )
+
+    asyncio.run(_run())
+
+    assert server.cancelled.is_set()
+    assert all(b"event: done" not in event.get("body", b"") for event in received)
+
+
+def test_websocket_disconnect_cancels_turn():
+    server = _Server()
+    received: list[dict[str, Any]] = []
+    events = [
+        {"type": "websocket.connect"},
+        {"type": "websocket.receive", "text": "Hello"},
+    ]
+
+    async def _receive():
+        if events:
+            return events.pop(0)
+        # Client sends another message, and disconnects, once first chunk is received
+        while len(received) < 2:
+            await asyncio.sleep(0)
+        if len(received) == 2:
+            received.append({"type": "client.message"})
+            return {"type": "websocket.receive", "text": "Are you there?"}
+        return {"type": "websocket.disconnect"}
+
+    async def _send(event):
+        received.append(event)
+
+    scope = {"type": "websocket", "path": "/sessions/s", "headers": []}
+    asyncio.run(asyncio.wait_for(server(scope, _receive, _send), timeout=1))
+
+    assert server.cancelled.is_set()
+    assert [event["type"] for event in received] == [
+        "websocket.accept",
+        "websocket.send",
+        "client.message",
+    ]
+
+
+def test_turn_failed_is_rolled_back(monkeypatch):
+    mode = Mode(name="lobby", prompt="{message}", options=[])
+    other = Mode(name="other", prompt="{message}", options=[])
+    server = ChatServer(mode=mode)
+
+    async def _handle_message_stream(*, conversation: Conversation, message: str):
+        conversation.log.append({"role": "user", "content": message})
+        conversation.mode = other
+        conversation.partial_log_range = (1, None)
+        yield (0, "Partial")
+        raise RuntimeError("Failed")
+
+    monkeypatch.setattr(_server, "handle_message_stream", _handle_message_stream)
+
+    async def _run() -> Conversation:
+        conversation = await server._get("s")
+        conversation.log.append({"role": "user", "content": "Hello"})
+        try:
+            async for _ in server.turn("s", "Again"):
+                pass
+        except RuntimeError:
+            pass
+        return conversation
+
+    conversation = asyncio.run(_run())
+
+    assert list(conversation.log) == [{"role": "user", "content": "Hello"}]
+    assert conversation.mode is mode
+    assert conversation.partial_log_range == (0, None)
+
+
+def test_start_starts_tags_prompts_of_knowledge_modes():
+    class _TagsPrompts:
+        started = False
+
+        async def start(self):
+            self.started = True
+
+    async def _transaction(*, conversation, message, response):
+        return []
+
+    lobby = Mode(
+        name="lobby",
+        prompt="{message}",
+        options=[
+            ModeOption(
+                condition=lambda _: True,
+                side_effect=ModeOptionSideEffectTransaction(transaction=_transaction),
+                transition="answer",
+            )
+        ],
+    )
+    answer = Mode(
+        name="answer",
+        prompt="{message}",
+        options=[
+            ModeOption(
+                condition=lambda _: True,
+                side_effect=ModeOptionSideEffectKnowledge(collection="faq"),
+            )
+        ],
+    )
+    # Transition is resolved as by `ModeGraph`, without counting tokens of prompts
+    lobby.options[0].target = answer
+    tags_prompts = _TagsPrompts()
+    Config.tags_prompts = tags_prompts  # type: ignore
+    try:
+        asyncio.run(ChatServer(mode=Mode(name="other", prompt="", options=[])).start())
+        assert not tags_prompts.started
+
+        asyncio.run(ChatServer(mode=lobby).start())
+        assert tags_prompts.started
+    finally:
+        Config.tags_prompts = None  # type: ignore
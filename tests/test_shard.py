@@ -0,0 +1,68 @@
+"""
+Tests of turns of `ChatServerSharded` across worker processes
+"""
+
+import asyncio
+import os
+import signal
+
+import pytest
+
+from chat_chain import ChatServer, ChatServerSharded, Mode
+
+
+class _EchoServer(ChatServer):
+    # Server streaming words of message back, along with session, and process ID of worker
+    def __init__(self):
+        super().__init__(mode=Mode(name="lobby", prompt="{message}", options=[]))
+
+    async def turn(self, session, message, /):
+        if message == "fail":
+            raise ValueError(message)
+
+        for (index, word) in enumerate(message.split()):
+            yield (index, f"{session}:{word}:{os.getpid()}")
+
+
+async def _turn(server: ChatServerSharded, session: str, message: str) -> list:
+    return [chunk async for chunk in server.turn(session, message)]
+
+
+def test_sessions_are_served_by_their_workers():
+    async def _run():
+        server = ChatServerSharded(_EchoServer(), workers=2)
+        try:
+            return await asyncio.gather(
+                *(_turn(server, session, "héllo wörld") for session in "abcdef")
+            )
+        finally:
+            await server.aclose()
+
+    pids = set()
+    for (session, chunks) in zip("abcdef", asyncio.run(_run())):
+        assert [(index, content.rsplit(":", 1)[0]) for (index, content) in chunks] == [
+            (0, f"{session}:héllo"),
+            (1, f"{session}:wörld"),
+        ]
+        pids.update(content.rsplit(":", 1)[1] for (_, content) in chunks)
+
+    assert len(pids) == 2 and str(os.getpid()) not in pids
+
+
+def test_failed_turn_and_exited_worker():
+    async def _run():
+        server = ChatServerSharded(_EchoServer(), workers=1)
+        try:
+            with pytest.raises(RuntimeError, match="ValueError"):
+                await _turn(server, "a", "fail")
+
+            [(_, content)] = await _turn(server, "a", "hi")
+            os.kill(int(content.rsplit(":", 1)[1]), signal.SIGKILL)
+            await asyncio.sleep(0.5)
+
+            return await _turn(server, "a", "hi")
+        finally:
+            await server.aclose()
+
+    [(index, content)] = asyncio.run(asyncio.wait_for(_run(), timeout=10))
+    assert (index, content.rsplit(":", 1)[0]) == (0, "a:hi")
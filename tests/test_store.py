@@ -0,0 +1,203 @@
+"""
+Tests of conversations writes of `ConversationStore`
+"""
+
+import asyncio
+from typing import Any
+
+import pytest
+
+from chat_chain import (Config, Conversation, ConversationLog,
+                        ConversationStore, Mode)
+from chat_chain._store import _log_expression
+
+
+def _evaluate(expression: Any, doc: dict[str, Any]) -> Any:
+    # Evaluate aggregation expression operators used by `_log_expression` against `doc`
+    if isinstance(expression, str) and expression.startswith("$"):
+        return doc.get(expression[1:])
+    if not isinstance(expression, dict):
+        return expression
+
+    ((operator, args),) = expression.items()
+    if operator == "$literal":
+        return args
+
+    values = [_evaluate(arg, doc) for arg in args] if isinstance(args, list) else []
+    if operator == "$ifNull":
+        return values[1] if values[0] is None else values[0]
+    if operator == "$concatArrays":
+        return [item for value in values for item in value]
+    if operator == "$slice":
+        return values[0][values[1] :] if values[1] < 0 else values[0][: values[1]]
+    if operator == "$subtract":
+        return values[0] - values[1]
+    if operator == "$max":
+        return max(values)
+    if operator == "$size":
+        return len(_evaluate(args, doc))
+    raise NotImplementedError(operator)
+
+
+def _write(start: int, *messages: str) -> dict[str, Any]:
+    return {
+        "start": start,
+        "messages": list(messages),
+        "state": {"log_length": start + len(messages)},
+    }
+
+
+def test_log_expression_new_log():
+    assert _evaluate(_log_expression(_write(0, "a", "b")), {}) == ["a", "b"]
+
+
+def test_log_expression_appends_at_position():
+    doc = {"log": ["a", "b", "c"], "log_length": 3}
+
+    assert _evaluate(_log_expression(_write(3, "d")), doc) == ["a", "b", "c", "d"]
+    # Messages after position of write, e.g. of write flushed twice, are replaced
+    assert _evaluate(_log_expression(_write(2, "x")), doc) == ["a", "b", "x"]
+
+
+def test_log_expression_capped():
+    doc = {"log": ["c", "d"], "log_length": 4}
+
+    assert _evaluate(_log_expression(_write(4, "e"), 2), doc) == ["d", "e"]
+    assert _evaluate(_log_expression(_write(3, "x"), 3), doc) == ["c", "x"]
+    assert _evaluate(_log_expression(_write(0, "a", "b", "c"), 2), {}) == ["b", "c"]
+
+
+def test_queue_merges_writes():
+    store = ConversationStore(modes=[])
+
+    store._queue("s", _write(2, "c"))  # pylint: disable=protected-access
+    store._queue("s", _write(3, "d", "e"))  # pylint: disable=protected-access
+
+    write = store._pending["s"]  # pylint: disable=protected-access
+    assert (write["start"], write["messages"]) == (2, ["c", "d", "e"])
+    assert write["state"] == {"log_length": 5}
+
+
+def test_queue_rewrite_replaces_merged_messages():
+    store = ConversationStore(modes=[])
+
+    store._queue("s", _write(2, "c", "d"))  # pylint: disable=protected-access
+    store._queue("s", _write(3, "x"))  # pylint: disable=protected-access
+    store._queue("t", _write(0, "a"))  # pylint: disable=protected-access
+
+    write = store._pending["s"]  # pylint: disable=protected-access
+    assert (write["start"], write["messages"]) == (2, ["c", "x"])
+    assert store._pending["t"]["messages"] == ["a"]  # pylint: disable=protected-access
+
+
+def test_queue_earlier_write_replaces_queued():
+    store = ConversationStore(modes=[])
+
+    store._queue("s", _write(4, "e"))  # pylint: disable=protected-access
+    store._queue("s", _write(0, "a", "b"))  # pylint: disable=protected-access
+
+    write = store._pending["s"]  # pylint: disable=protected-access
+    assert (write["start"], write["messages"]) == (0, ["a", "b"])
+
+
+class _Collection:
+    def __init__(self):
+        self.docs: dict[str, dict[str, Any]] = {}
+
+    async def bulk_write(self, requests, ordered):
+        # pylint: disable=unused-argument
+        await asyncio.sleep(0.01)
+        for request in requests:
+            # pylint: disable=protected-access
+            (query, (stage,)) = (request._filter, request._doc)
+            doc = self.docs.setdefault(query["_id"], {})
+            doc.update(
+                {key: _evaluate(value, doc) for (key, value) in stage["$set"].items()}
+            )
+
+    async def find_one(self, query, projection=None):
+        # pylint: disable=unused-argument
+        return self.docs.get(query["_id"])
+
+
+def test_load_waits_for_flush_in_progress():
+    async def _test():
+        collection = _Collection()
+        Config.mongodb = {"conversations": collection}  # type: ignore
+        store = ConversationStore(modes=[mode])
+        conversation = Conversation(mode=mode, session="s", partial_log_range=(0, None))
+        conversation.log.append({"role": "user", "content": "Hi"})
+
+        store.save(conversation)
+        flush = asyncio.ensure_future(store.flush())
+        await asyncio.sleep(0)
+
+        loaded = await store.load("s")
+        await flush
+
+        assert loaded is not None
+        assert list(loaded.log) == [{"role": "user", "content": "Hi"}]
+
+    mode = Mode(name="lobby", prompt="{message}", options=[])
+    try:
+        asyncio.run(_test())
+    finally:
+        Config.mongodb = None  # type: ignore
+
+
+def test_save_writes_messages_archived_since_last_save():
+    async def _test():
+        collection = _Collection()
+        Config.mongodb = {"conversations": collection}  # type: ignore
+        store = ConversationStore(modes=[mode])
+        assert await store.load("s") is None
+
+        conversation = Conversation(
+            mode=mode,
+            session="s",
+            partial_log_range=(0, None),
+            log=ConversationLog(max_messages=2),
+        )
+        for content in "ab":
+            conversation.log.append({"role": "user", "content": content})
+        store.save(conversation)
+        for content in "cde":
+            conversation.log.append({"role": "user", "content": content})
+        store.save(conversation)
+        await store.flush()
+
+        assert conversation.log.offset == 3
+        assert [message["content"] for message in collection.docs["s"]["log"]] == list(
+            "abcde"
+        )
+
+    mode = Mode(name="lobby", prompt="{message}", options=[])
+    try:
+        asyncio.run(_test())
+    finally:
+        Config.mongodb = None  # type: ignore
+
+
+def test_save_raises_for_messages_archived_before_tracked():
+    async def _test():
+        Config.mongodb = {"conversations": _Collection()}  # type: ignore
+        store = ConversationStore(modes=[mode])
+        assert await store.load("s") is None
+
+        conversation = Conversation(
+            mode=mode,
+            session="s",
+            partial_log_range=(0, None),
+            log=ConversationLog(max_messages=1),
+        )
+        for content in "ab":
+            conversation.log.append({"role": "user", "content": content})
+
+        with pytest.raises(ValueError):
+            store.save(conversation)
+
+    mode = Mode(name="lobby", prompt="{message}", options=[])
+    try:
+        asyncio.run(_test())
+    finally:
+        Config.mongodb = None  # type: ignore
@@ -0,0 +1,36 @@
+"""
+Tests of rendering, and counting tokens of, `PromptTemplate`
+"""
+
+from chat_chain import PromptTemplate
+
+
+def test_render_in_one_pass():
+    template = PromptTemplate('Reply {"answer": 1} to {message}, after {conversation}.')
+
+    assert template.slots == ("message", "conversation")
+    assert (
+        template.render(message="{conversation}", conversation="Hi")
+        == 'Reply {"answer": 1} to {conversation}, after Hi.'
+    )
+    assert template.render(message="Hi") == 'Reply {"answer": 1} to Hi, after .'
+
+
+def test_render_custom_slots():
+    template = PromptTemplate("{greeting}, {message}", slots=["greeting"])
+
+    assert template.render(greeting="Hello", message="Hi") == "Hello, {message}"
+
+
+def test_num_tokens(encoding):
+    template = PromptTemplate("Answer {message} briefly")
+
+    # Segments, and values, are counted separately, so tokens at their boundaries can differ
+    assert template.num_tokens(model="gpt-3.5-turbo") == len(
+        encoding.encode("Answer ") + encoding.encode(" briefly")
+    )
+    assert template.num_tokens(model="gpt-3.5-turbo", message="what is history") == len(
+        encoding.encode("Answer ")
+        + encoding.encode("what is history")
+        + encoding.encode(" briefly")
+    )
@@ -0,0 +1,78 @@
+"""
+Tests of spans of chain stages, and their exporters
+"""
+
+import asyncio
+
+import pytest
+
+from chat_chain import (Config, Span, SpanExporter, SpanExporterPrometheus,
+                        Tracer)
+from chat_chain._trace import span
+
+
+class _SpanExporterParents(SpanExporter):
+    # Record names of ended spans, and of their parents
+    def __init__(self):
+        self.ended: list[tuple[str, str | None]] = []
+
+    def end(self, span: "Span", /):  # pylint: disable=redefined-outer-name
+        self.ended.append((span.name, span.parent.name if span.parent else None))
+
+
+def test_spans_of_stream_caller_are_not_nested_in_stream(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    exporter = _SpanExporterParents()
+    monkeypatch.setattr(Config, "tracer", Tracer(exporters=[exporter]))
+
+    async def _stream():
+        with span("stream") as stage:
+            for index in range(2):
+                with stage.detached():
+                    yield index
+
+    async def _turn():
+        with span("turn"):
+            async for _ in _stream():
+                with span("caller"):
+                    pass
+            with span("after"):
+                pass
+
+    asyncio.run(_turn())
+
+    assert exporter.ended == [
+        ("caller", "turn"),
+        ("caller", "turn"),
+        ("stream", "turn"),
+        ("after", "turn"),
+        ("turn", None),
+    ]
+
+
+def test_noop_span_without_tracer(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(Config, "tracer", None)
+
+    with span("stage", tokens_in=1) as stage:
+        with stage.detached():
+            stage.set(tokens_out=1)
+
+    assert (stage.recording, stage.start) == (False, 0.0)
+
+
+def test_histogram_totals_numeric_attributes(monkeypatch: pytest.MonkeyPatch):
+    exporter = SpanExporterPrometheus(buckets=(1,))
+    monkeypatch.setattr(Config, "tracer", Tracer(exporters=[exporter]))
+
+    for (tokens, cache_hit) in ((2, True), (0.5, False)):
+        with span("stage", tokens_in=tokens, cache_hit="yes" if cache_hit else "no"):
+            pass
+
+    summary = exporter.summary()["stage"]
+    assert (summary["count"], summary["tokens_in"], summary["p99"]) == (2, 2.5, 1)
+    assert 'chat_chain_span_tokens_in_total{span="stage"} 2.5' in exporter.render()
+    assert (
+        'chat_chain_span_attribute_total{span="stage",attribute="cache_hit",value="no"} 1'
+        in exporter.render()
+    )